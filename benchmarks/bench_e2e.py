@@ -0,0 +1,231 @@
+"""
+Сквозной бенчмарк бота: синтетические Update проходят через настоящий
+Dispatcher со всеми пятью роутерами. Bot API подменяется сессией без сети,
+YooKassa и Crypto Pay - локальным поддельным сервером, база - временный
+файл SQLite (или --db-url).
+
+Сценарии:
+    start     - /start от --users новых пользователей, затем повторно от тех же
+    carousel  - листание карточек (--products товаров) кнопками вперед/назад
+    checkout  - создание платежей YooKassa и счетов Crypto Pay
+    sweep     - фоновая проверка --pending ожидающих платежей
+
+Для каждого сценария печатаются число апдейтов в секунду и перцентили
+задержки p50/p95/p99; результат - JSON (--output - записать в файл для
+сравнения между прогонами).
+
+Пример:
+    python benchmarks/bench_e2e.py --users 2000 --updates 5000 --concurrency 200
+    python benchmarks/bench_e2e.py --scenarios sweep --pending 10000 --provider-latency 50
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from datetime import datetime, timedelta
+
+from harness import (FakeSession, FakePaymentServers, setup_environment, message_update, callback_update,
+                     latency_stats, run_concurrently)
+
+SCENARIOS = ("start", "carousel", "checkout", "sweep")
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+parser.add_argument("--users", type=int, default=1000)
+parser.add_argument("--products", type=int, default=50)
+parser.add_argument("--updates", type=int, default=2000, help="апдейтов в сценариях carousel и checkout")
+parser.add_argument("--pending", type=int, default=2000, help="ожидающих платежей в сценарии sweep")
+parser.add_argument("--concurrency", type=int, default=100, help="одновременно обрабатываемых апдейтов")
+parser.add_argument("--api-latency", type=float, default=0.0, help="задержка ответа Bot API, мс")
+parser.add_argument("--provider-latency", type=float, default=0.0, help="задержка ответа платежных систем, мс")
+parser.add_argument("--db-url", default=None)
+parser.add_argument("--output", default=None, help="файл для JSON-результата")
+args = parser.parse_args()
+
+db_url = setup_environment(args.db_url)
+
+from aiogram import Dispatcher  # noqa: E402
+from aiogram.types import Update  # noqa: E402
+
+from bot import bot  # noqa: E402
+from db.catalog import catalog  # noqa: E402
+from db.migrations import run_migrations  # noqa: E402
+from db.models import Session, Product, LedgerModel, engine, read_engine  # noqa: E402
+from db.positions import positions  # noqa: E402
+from db.write_behind import write_behind  # noqa: E402
+from handlers import handlers_admin, handlers_user, handlers_yookassa, handlers_stars, handlers_crypto  # noqa: E402
+from services.bot_context import bot_context  # noqa: E402
+from services.crypto_client import crypto  # noqa: E402
+from services.outbox import outbox  # noqa: E402
+from services.poller import select_due  # noqa: E402
+from services.sender import sender  # noqa: E402
+from services.yookassa_client import yookassa  # noqa: E402
+from tasks import check_payments  # noqa: E402
+
+
+class ErrorCounter(logging.Handler):
+    """Ошибки, которые обработчики перехватывают и только пишут в лог"""
+
+    def __init__(self) -> None:
+        super().__init__(logging.ERROR)
+        self.count = 0
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.count += 1
+
+
+def build_dispatcher() -> Dispatcher:
+    """Диспетчер с роутерами в том же порядке, что и в main.py"""
+    dp = Dispatcher()
+    dp.include_router(handlers_admin.router)
+    dp.include_router(handlers_user.router)
+    dp.include_router(handlers_yookassa.router)
+    dp.include_router(handlers_stars.router)
+    dp.include_router(handlers_crypto.router)
+    return dp
+
+
+async def seed_products(count: int) -> None:
+    async with Session() as session:
+        await session.execute(Product.__table__.insert(), [
+            {"name": f"Товар {i}", "description": f"Описание товара {i}", "price": 10000 + i * 100,
+             "photo_file_id": f"photo{i}"}
+            for i in range(1, count + 1)
+        ])
+        await session.commit()
+    await catalog.load()
+
+
+async def run_updates(dp: Dispatcher, updates: list) -> dict:
+    async def feed(raw: dict) -> None:
+        # Разбор JSON входит в замер, как при получении апдейта из сети
+        await dp.feed_update(bot, Update.model_validate(raw, context={"bot": bot}))
+
+    latencies, errors, elapsed = await run_concurrently(
+        [lambda raw=raw: feed(raw) for raw in updates], args.concurrency
+    )
+    return {**latency_stats(latencies, elapsed), "errors": errors}
+
+
+async def scenario_start(dp: Dispatcher) -> dict:
+    users = range(1, args.users + 1)
+    new = await run_updates(dp, [message_update(user_id, "/start") for user_id in users])
+    known = await run_updates(dp, [message_update(user_id, "/start") for user_id in users])
+    return {"new_users": new, "known_users": known}
+
+
+async def scenario_carousel(dp: Dispatcher) -> dict:
+    product_ids = [product.id for product in catalog.products]
+    updates = []
+    for _ in range(args.updates):
+        user_id = random.randint(1, args.users)
+        data = random.choice(["next_product", "prev_product"]) + f"_{random.choice(product_ids)}"
+        updates.append(callback_update(user_id, data, photo=True))
+    result = await run_updates(dp, updates)
+    await positions.flush()
+    return result
+
+
+async def scenario_checkout(dp: Dispatcher) -> dict:
+    product_ids = [product.id for product in catalog.products]
+    updates = [
+        callback_update(random.randint(1, args.users), f"{provider}_{random.choice(product_ids)}")
+        for provider in ("yookassa", "cryptobot") for _ in range(args.updates // 2)
+    ]
+    random.shuffle(updates)
+    return await run_updates(dp, updates)
+
+
+async def scenario_sweep() -> dict:
+    created = datetime.now() - timedelta(minutes=1)
+    payments = [("yookassa", f"sweep-{i}", "RUB") for i in range(args.pending // 2)]
+    payments += [("crypto", str(1_000_000 + i), "USDT") for i in range(args.pending - len(payments))]
+    async with Session() as session:
+        # Платежи сценария checkout снимаются с расписания: проверяются только платежи сценария
+        await session.execute(
+            LedgerModel.__table__.update().where(LedgerModel.status == "pending").values(next_check_at=None)
+        )
+        await session.execute(LedgerModel.__table__.insert(), [
+            {"provider": provider, "external_id": external_id, "status": "pending", "user_id": 1,
+             "product_id": 1, "amount": 10000, "currency": currency, "created_at": created,
+             "next_check_at": created}
+            for provider, external_id, currency in payments
+        ])
+        await session.commit()
+
+    # Проход обрабатывает не больше PAYMENTS_SWEEP_LIMIT платежей: повторяем,
+    # пока не останется платежей, у которых подошло время проверки
+    latencies = []
+    started = time.perf_counter()
+    while await select_due(LedgerModel, "pending", datetime.now()):
+        sweep_started = time.perf_counter()
+        await check_payments()
+        latencies.append(time.perf_counter() - sweep_started)
+    elapsed = time.perf_counter() - started
+
+    async with Session() as session:
+        result = await session.execute(
+            LedgerModel.__table__.select()
+            .where(LedgerModel.status == "succeeded",
+                   LedgerModel.external_id.in_([external_id for _, external_id, _ in payments]))
+        )
+        finalized = len(result.fetchall())
+    return {"sweeps": latency_stats(latencies, elapsed), "payments": len(payments), "finalized": finalized,
+            "payments_per_s": round(len(payments) / elapsed, 1) if elapsed else 0.0}
+
+
+async def main() -> None:
+    logging.basicConfig(level=logging.WARNING)
+    error_counter = ErrorCounter()
+    logging.getLogger().addHandler(error_counter)
+
+    session = FakeSession(latency=args.api_latency / 1000)
+    bot.session = session
+    servers = FakePaymentServers(latency=args.provider_latency / 1000)
+    url = await servers.start()
+    yookassa.base_url = f"{url}/v3"
+    crypto.network = url
+
+    await run_migrations()
+    await bot_context.refresh(bot)
+    sender.start()
+    dispatcher = asyncio.create_task(outbox.run())
+    await seed_products(args.products)
+    dp = build_dispatcher()
+
+    results = {}
+    for name in args.scenarios:
+        before = error_counter.count
+        if name == "sweep":
+            results[name] = await scenario_sweep()
+        else:
+            results[name] = await globals()[f"scenario_{name}"](dp)
+        results[name]["logged_errors"] = error_counter.count - before
+
+    await write_behind.close()
+    dispatcher.cancel()
+    await sender.close()
+    await outbox.close()
+    await yookassa.close()
+    await crypto.close()
+    await servers.close()
+    await engine.dispose()
+    if read_engine is not engine:
+        await read_engine.dispose()
+
+    report = json.dumps({
+        "params": vars(args) | {"db_url": db_url},
+        "scenarios": results,
+        "bot_api_calls": dict(session.calls),
+        "provider_requests": dict(servers.requests),
+    }, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(report + "\n")
+    print(report)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
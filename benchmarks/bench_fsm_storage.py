@@ -0,0 +1,153 @@
+"""
+Накладные расходы хранилища FSM на апдейт: MemoryStorage против SqlStorage
+(db/fsm_storage.py) на одном и том же потоке апдейтов.
+
+Поток: --users обычных пользователей пишут боту текст, на который нет
+обработчика (апдейт проходит только FSMContextMiddleware и фильтры
+состояний роутеров - чистые накладные расходы FSM), --admins
+администраторов параллельно проходят мастер рассылки (/broadcast, текст,
+отмена - установка, данные и очистка состояния). Апдейты идут через
+Dispatcher с роутерами бота, Bot API подменен (harness.py).
+
+Каждое хранилище прогоняется дважды: cold - первый апдейт каждого
+пользователя (для SqlStorage у администраторов - чтение из БД), warm -
+повторный. Состояния обычных пользователей SqlStorage в БД не читает.
+В отчете: задержка p50/p95/p99 обычных и админских апдейтов, число
+SQL-запросов на апдейт, скорость прямых вызовов get_state/set_state/
+get_data/set_data; для SqlStorage - статистика кэша и отложенной записи.
+Результат печатается в JSON.
+
+Пример:
+    python benchmarks/bench_fsm_storage.py --users 5000 --admins 20
+    python benchmarks/bench_fsm_storage.py --db-url postgresql+asyncpg://...
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from harness import FakeSession, setup_environment, message_update, callback_update, latency_stats, \
+    run_concurrently
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--users", type=int, default=5000)
+parser.add_argument("--admins", type=int, default=20)
+parser.add_argument("--rounds", type=int, default=5, help="мастеров рассылки на администратора")
+parser.add_argument("--concurrency", type=int, default=50)
+parser.add_argument("--ops", type=int, default=20000, help="прямых вызовов хранилища на вид операции")
+parser.add_argument("--db-url", default=None)
+args = parser.parse_args()
+
+ADMIN_BASE = 10 ** 9
+db_url = setup_environment(args.db_url,
+                           ADMIN_IDS=" ".join(str(ADMIN_BASE + i) for i in range(1, args.admins + 1)))
+
+from aiogram import Dispatcher  # noqa: E402
+from aiogram.fsm.storage.base import BaseStorage, StorageKey  # noqa: E402
+from aiogram.fsm.storage.memory import MemoryStorage  # noqa: E402
+from aiogram.types import Update  # noqa: E402
+
+from bot import bot  # noqa: E402
+from db.fsm_storage import SqlStorage  # noqa: E402
+from db.migrations import run_migrations  # noqa: E402
+from db.models import engine  # noqa: E402
+from db.write_behind import write_behind  # noqa: E402
+from handlers import handlers_admin, handlers_user  # noqa: E402
+from harness import BOT_ID, QueryCounter  # noqa: E402
+from services.sender import sender  # noqa: E402
+
+queries = QueryCounter(engine)
+
+
+def admin_session(admin_id: int) -> list:
+    """Мастер рассылки, отмененный на подтверждении"""
+    return [message_update(admin_id, "/broadcast"),
+            message_update(admin_id, f"Акция для всех от {admin_id}"),
+            callback_update(admin_id, "broadcast_cancel")]
+
+
+async def run_updates(dp: Dispatcher) -> dict:
+    latencies = {"user": [], "admin": []}
+
+    async def feed(kind: str, raw: dict) -> None:
+        update = Update.model_validate(raw, context={"bot": bot})
+        started = time.perf_counter()
+        await dp.feed_update(bot, update)
+        latencies[kind].append(time.perf_counter() - started)
+
+    async def admin(admin_id: int) -> None:
+        # Шаги одного администратора последовательны, как в реальном чате
+        for _ in range(args.rounds):
+            for raw in admin_session(admin_id):
+                await feed("admin", raw)
+
+    user_calls = [lambda user_id=user_id: feed("user", message_update(user_id, "Здравствуйте!"))
+                  for user_id in range(1, args.users + 1)]
+    queries.count = 0
+    started = time.perf_counter()
+    _, (_, errors, _) = await asyncio.gather(
+        asyncio.gather(*(admin(ADMIN_BASE + i) for i in range(1, args.admins + 1))),
+        run_concurrently(user_calls, args.concurrency),
+    )
+    elapsed = time.perf_counter() - started
+    await write_behind.flush()
+    total = args.users + args.admins * args.rounds * 3
+    return {
+        "seconds": round(elapsed, 2),
+        "user": latency_stats(latencies["user"], elapsed),
+        "admin": latency_stats(latencies["admin"], elapsed),
+        "sql_per_update": round(queries.count / total, 2),
+        "errors": errors,
+    }
+
+
+async def run_ops(storage: BaseStorage) -> dict:
+    """Прямые вызовы хранилища, тысяч операций в секунду"""
+    keys = [StorageKey(bot_id=BOT_ID, chat_id=ADMIN_BASE + i, user_id=ADMIN_BASE + i)
+            for i in range(1, args.admins + 1)]
+    result = {}
+    for name, call in (
+        ("set_state", lambda key: storage.set_state(key, "Broadcast:text")),
+        ("get_state", lambda key: storage.get_state(key)),
+        ("set_data", lambda key: storage.set_data(key, {"text": "Акция", "n": random.random()})),
+        ("get_data", lambda key: storage.get_data(key)),
+    ):
+        started = time.perf_counter()
+        for i in range(args.ops):
+            await call(keys[i % len(keys)])
+        result[name] = round(args.ops / (time.perf_counter() - started) / 1000, 1)
+    for key in keys:
+        await storage.set_state(key, None)
+        await storage.set_data(key, {})
+    await write_behind.flush()
+    return result
+
+
+async def main() -> None:
+    bot.session = FakeSession()
+    await run_migrations()
+    sender.start()
+
+    dp = Dispatcher()
+    dp.include_router(handlers_admin.router)
+    dp.include_router(handlers_user.router)
+
+    report = {"params": vars(args) | {"db_url": db_url}}
+    for name, storage in (("memory", MemoryStorage()), ("sql", SqlStorage())):
+        # Роутеры подключаются к диспетчеру один раз, поэтому меняется только хранилище
+        dp.fsm.storage = storage
+        report[name] = {"cold": await run_updates(dp), "warm": await run_updates(dp),
+                        "ops_k_per_s": await run_ops(storage)}
+        if isinstance(storage, SqlStorage):
+            report[name]["cache"] = storage.stats()
+    report["write_behind"] = write_behind.stats()
+
+    await write_behind.close()
+    await sender.close()
+    await engine.dispose()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
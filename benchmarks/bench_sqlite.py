@@ -0,0 +1,139 @@
+"""
+Микро-бенчмарк профиля SQLite: конкурентные чтения и записи до и после настройки.
+
+Профили:
+    baseline - движок по умолчанию (журнал отката, без PRAGMA и вторичных индексов)
+    tuned    - WAL и PRAGMA из apply_sqlite_pragmas, индексы моделей, отдельный движок чтения
+
+Читатели выполняют запросы каталога и выборки платежей по статусу, писатели -
+создание платежа и смену его статуса отдельными транзакциями, как обработчики бота.
+Результат печатается в JSON.
+
+Пример:
+    python benchmarks/bench_sqlite.py --payments 50000 --readers 8 --writers 2 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.models import Base, User, Product, PaymentModel, apply_sqlite_pragmas  # noqa: E402
+
+STATUSES = ["succeeded"] * 8 + ["canceled", "pending"]
+
+
+async def populate(engine, payments: int) -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(User.__table__.insert(), [{"user_id": i} for i in range(1, 1001)])
+        await conn.execute(Product.__table__.insert(), [
+            {"id": i, "name": f"Товар {i}", "price": 10000, "photo_file_id": "file", "is_active": i % 4 != 0}
+            for i in range(1, 201)
+        ])
+        now = datetime.now()
+        await conn.execute(PaymentModel.__table__.insert(), [
+            {"id": f"p{i}", "status": random.choice(STATUSES), "user_id": random.randint(1, 1000),
+             "product_id": random.randint(1, 200), "amount": 10000, "created_at": now,
+             "updated_at": now, "next_check_at": now, "check_attempts": 0}
+            for i in range(payments)
+        ])
+
+
+async def drop_secondary_indexes(engine) -> None:
+    async with engine.begin() as conn:
+        rows = await conn.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL"
+        ))
+        for (name,) in rows.fetchall():
+            await conn.execute(text(f"DROP INDEX {name}"))
+
+
+async def reader(engine, deadline: float, stats: dict) -> None:
+    while time.perf_counter() < deadline:
+        try:
+            async with engine.connect() as conn:
+                await conn.execute(Product.__table__.select().where(Product.is_active == True))
+                await conn.execute(PaymentModel.__table__.select().where(PaymentModel.status == "pending"))
+            stats["reads"] += 1
+        except Exception:
+            stats["read_errors"] += 1
+
+
+async def writer(engine, deadline: float, stats: dict, worker: int) -> None:
+    n = 0
+    while time.perf_counter() < deadline:
+        payment_id = f"w{worker}-{n}"
+        n += 1
+        try:
+            async with engine.begin() as conn:
+                await conn.execute(PaymentModel.__table__.insert().values(
+                    id=payment_id, user_id=1, product_id=1, amount=100, status="pending"
+                ))
+            async with engine.begin() as conn:
+                await conn.execute(
+                    PaymentModel.__table__.update()
+                    .where(PaymentModel.id == payment_id)
+                    .values(status="succeeded")
+                )
+            stats["writes"] += 1
+        except Exception:
+            stats["write_errors"] += 1
+
+
+async def run_profile(profile: str, args) -> dict:
+    path = os.path.join(tempfile.mkdtemp(), f"{profile}.db")
+    url = f"sqlite+aiosqlite:///{path}"
+    write_engine = create_async_engine(url)
+    read_engine = write_engine
+    if profile == "tuned":
+        apply_sqlite_pragmas(write_engine)
+        read_engine = create_async_engine(url)
+        apply_sqlite_pragmas(read_engine, read_only=True)
+
+    await populate(write_engine, args.payments)
+    if profile == "baseline":
+        await drop_secondary_indexes(write_engine)
+
+    stats = {"reads": 0, "writes": 0, "read_errors": 0, "write_errors": 0}
+    deadline = time.perf_counter() + args.duration
+    await asyncio.gather(
+        *(reader(read_engine, deadline, stats) for _ in range(args.readers)),
+        *(writer(write_engine, deadline, stats, i) for i in range(args.writers)),
+    )
+
+    await write_engine.dispose()
+    if read_engine is not write_engine:
+        await read_engine.dispose()
+
+    return {
+        "profile": profile,
+        "reads_per_s": round(stats["reads"] / args.duration, 1),
+        "writes_per_s": round(stats["writes"] / args.duration, 1),
+        **stats,
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--payments", type=int, default=50000)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=10.0, help="секунды на профиль")
+    args = parser.parse_args()
+
+    results = [await run_profile(profile, args) for profile in ("baseline", "tuned")]
+    print(json.dumps({"params": vars(args), "results": results}, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
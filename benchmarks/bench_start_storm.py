@@ -0,0 +1,115 @@
+"""
+Нагрузка /start во время рекламной кампании: --users новых пользователей за
+--duration секунд (по умолчанию 10 000 за минуту), часть из них (--repeat)
+нажимает /start повторно. Апдейты поступают равномерно с заданным темпом и
+проходят через Dispatcher с роутерами бота; Bot API подменен (harness.py).
+
+В отчете: задержка p50/p95/p99 для первых и повторных /start, число
+SQL-запросов на апдейт, статистика кэша зарегистрированных пользователей
+и отложенной записи, число пользователей в БД после прогона.
+--no-cache отключает кэш для сравнения. Результат печатается в JSON.
+
+Пример:
+    python benchmarks/bench_start_storm.py --users 10000 --duration 60
+    python benchmarks/bench_start_storm.py --db-url postgresql+asyncpg://... --no-cache
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+
+from harness import FakeSession, setup_environment, message_update, latency_stats, QueryCounter
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--users", type=int, default=10000)
+parser.add_argument("--duration", type=float, default=60.0, help="секунды на всю волну")
+parser.add_argument("--repeat", type=float, default=0.3, help="доля пользователей, повторяющих /start")
+parser.add_argument("--no-cache", action="store_true", help="без кэша зарегистрированных пользователей")
+parser.add_argument("--db-url", default=None)
+args = parser.parse_args()
+
+db_url = setup_environment(args.db_url)
+
+from aiogram import Dispatcher  # noqa: E402
+from aiogram.types import Update  # noqa: E402
+from sqlalchemy import func, select  # noqa: E402
+
+from bot import bot  # noqa: E402
+from db.migrations import run_migrations  # noqa: E402
+from db.models import Session, User, engine  # noqa: E402
+from db.users import known_users  # noqa: E402
+from db.write_behind import write_behind  # noqa: E402
+from handlers import handlers_admin, handlers_user  # noqa: E402
+from services.sender import sender  # noqa: E402
+
+queries = QueryCounter(engine)
+
+
+async def main() -> None:
+    bot.session = FakeSession()
+    await run_migrations()
+    queries.count = 0
+    sender.start()
+    if args.no_cache:
+        known_users.capacity = 0
+
+    dp = Dispatcher()
+    dp.include_router(handlers_admin.router)
+    dp.include_router(handlers_user.router)
+
+    # Повторный /start приходит позже первого того же пользователя
+    timeline = [(user_id, user_id, False) for user_id in range(1, args.users + 1)]
+    for user_id in random.sample(range(1, args.users + 1), int(args.users * args.repeat)):
+        timeline.append((random.uniform(user_id, args.users), user_id, True))
+    arrivals = [(user_id, repeat) for _, user_id, repeat in sorted(timeline)]
+
+    latencies = {False: [], True: []}
+    errors = 0
+
+    async def feed(user_id: int, repeat: bool) -> None:
+        nonlocal errors
+        update = Update.model_validate(message_update(user_id, "/start"), context={"bot": bot})
+        started = time.perf_counter()
+        try:
+            await dp.feed_update(bot, update)
+        except Exception as e:
+            errors += 1
+            if errors <= 3:
+                print(f"Ошибка обработки /start: {e!r}", file=sys.stderr)
+        latencies[repeat].append(time.perf_counter() - started)
+
+    interval = args.duration / len(arrivals)
+    tasks = []
+    started = time.perf_counter()
+    for i, (user_id, repeat) in enumerate(arrivals):
+        delay = started + i * interval - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(feed(user_id, repeat)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    await write_behind.close()
+    await sender.close()
+    async with Session() as session:
+        registered = (await session.execute(select(func.count()).select_from(User))).scalar()
+    await engine.dispose()
+
+    print(json.dumps({
+        "params": vars(args) | {"db_url": db_url},
+        "updates": len(arrivals),
+        "seconds": round(elapsed, 2),
+        "lag_s": round(elapsed - args.duration, 2),
+        "first_start": latency_stats(latencies[False], elapsed),
+        "repeat_start": latency_stats(latencies[True], elapsed),
+        "sql_per_update": round(queries.count / len(arrivals), 2),
+        "errors": errors,
+        "cache": known_users.stats(),
+        "write_behind": write_behind.stats(),
+        "registered": registered,
+    }, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
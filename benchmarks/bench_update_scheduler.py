@@ -0,0 +1,190 @@
+"""
+Планировщик апдейтов (services/update_scheduler.py) против штатных режимов
+aiogram на потоке, где часть апдейтов ждет медленную платежную систему.
+
+Апдейты поступают с темпом --rate в секунду: листание карусели (серии
+кликов одного пользователя подряд) и доля --pay-share создания платежа
+YooKassa, ответ которой задерживается на --provider-latency мс. Режимы:
+    sequential - апдейты по одному (start_polling(handle_as_tasks=False))
+    tasks      - задача на каждый апдейт (start_polling по умолчанию)
+    scheduler  - UpdateScheduler: чаты параллельно, апдейты чата по порядку
+
+В отчете для каждого режима: задержка от поступления апдейта до конца
+обработки (p50/p95/p99) отдельно для карусели и платежей, overlaps - апдейты
+чата, начатые до окончания предыдущего апдейта того же чата, reordered -
+начатые не в порядке поступления. Результат печатается в JSON.
+
+Пример:
+    python benchmarks/bench_update_scheduler.py --updates 2000 --rate 200 --provider-latency 500
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict
+
+from harness import FakeSession, FakePaymentServers, setup_environment, callback_update, latency_stats
+
+MODES = ("sequential", "tasks", "scheduler")
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+parser.add_argument("--updates", type=int, default=1000)
+parser.add_argument("--rate", type=float, default=200.0, help="апдейтов в секунду")
+parser.add_argument("--users", type=int, default=200)
+parser.add_argument("--burst", type=int, default=5, help="кликов карусели одного пользователя подряд")
+parser.add_argument("--pay-share", type=float, default=0.05, help="доля апдейтов с созданием платежа")
+parser.add_argument("--provider-latency", type=float, default=300.0, help="задержка ответа YooKassa, мс")
+parser.add_argument("--workers", type=int, default=16)
+parser.add_argument("--products", type=int, default=20)
+parser.add_argument("--db-url", default=None)
+args = parser.parse_args()
+
+db_url = setup_environment(args.db_url, UPDATE_WORKERS=str(args.workers))
+
+from aiogram import BaseMiddleware, Dispatcher  # noqa: E402
+from aiogram.types import TelegramObject, Update  # noqa: E402
+
+from bot import bot  # noqa: E402
+from db.catalog import catalog  # noqa: E402
+from db.migrations import run_migrations  # noqa: E402
+from db.models import Session, Product, engine  # noqa: E402
+from db.positions import positions  # noqa: E402
+from db.write_behind import write_behind  # noqa: E402
+from handlers import handlers_admin, handlers_user, handlers_yookassa, handlers_stars, handlers_crypto  # noqa: E402
+from services.bot_context import bot_context  # noqa: E402
+from services.sender import sender  # noqa: E402
+from services.update_scheduler import update_scheduler  # noqa: E402
+from services.yookassa_client import yookassa  # noqa: E402
+
+ROUTERS = (handlers_admin.router, handlers_user.router, handlers_yookassa.router, handlers_stars.router,
+           handlers_crypto.router)
+
+
+class ProcessingMiddleware(BaseMiddleware):
+    """Начало и конец обработки каждого апдейта и нарушения порядка в чате"""
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.finished: Dict[int, float] = {}
+        self.in_flight: Dict[int, int] = defaultdict(int)
+        self.last_started: Dict[int, int] = {}
+        self.overlaps = 0
+        self.reordered = 0
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        update_id = data["event_update"].update_id
+        chat_id = data["event_chat"].id
+        if self.in_flight[chat_id]:
+            self.overlaps += 1
+        if self.last_started.get(chat_id, 0) > update_id:
+            self.reordered += 1
+        self.last_started[chat_id] = max(self.last_started.get(chat_id, 0), update_id)
+        self.in_flight[chat_id] += 1
+        try:
+            return await handler(event, data)
+        finally:
+            self.in_flight[chat_id] -= 1
+            self.finished[update_id] = time.perf_counter()
+
+
+def make_updates(product_ids: list) -> list:
+    """Серии кликов карусели и платежи вперемешку: (вид, апдейт)"""
+    updates = []
+    while len(updates) < args.updates:
+        user_id = random.randint(1, args.users)
+        if random.random() < args.pay_share:
+            updates.append(("pay", callback_update(user_id, f"yookassa_{random.choice(product_ids)}")))
+            continue
+        for _ in range(args.burst):
+            data = random.choice(["next_product", "prev_product"]) + f"_{random.choice(product_ids)}"
+            updates.append(("carousel", callback_update(user_id, data, photo=True)))
+    return updates[:args.updates]
+
+
+async def run_mode(dp: Dispatcher, mode: str, updates: list, processing: ProcessingMiddleware) -> dict:
+    processing.reset()
+    arrivals: Dict[int, tuple] = {}
+    tasks = set()
+    interval = 1 / args.rate
+    started = time.perf_counter()
+    for i, (kind, raw) in enumerate(updates):
+        arrival = started + i * interval
+        delay = arrival - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        update = Update.model_validate(raw, context={"bot": bot})
+        arrivals[update.update_id] = (kind, arrival)
+        if mode == "tasks":
+            task = asyncio.create_task(dp.feed_update(bot, update))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        else:
+            # sequential: обработка до конца; scheduler: постановка в очередь чата
+            await dp.feed_update(bot, update)
+    while tasks or update_scheduler.stats()["pending"]:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+
+    latencies = defaultdict(list)
+    for update_id, (kind, arrival) in arrivals.items():
+        latencies[kind].append(processing.finished[update_id] - arrival)
+    return {
+        "seconds": round(elapsed, 2),
+        "carousel": latency_stats(latencies["carousel"], elapsed),
+        "pay": latency_stats(latencies["pay"], elapsed),
+        "overlaps": processing.overlaps,
+        "reordered": processing.reordered,
+    }
+
+
+async def main() -> None:
+    bot.session = FakeSession()
+    servers = FakePaymentServers(latency=args.provider_latency / 1000)
+    url = await servers.start()
+    yookassa.base_url = f"{url}/v3"
+
+    await run_migrations()
+    await bot_context.refresh(bot)
+    async with Session() as session:
+        await session.execute(Product.__table__.insert(), [
+            {"name": f"Товар {i}", "description": f"Описание товара {i}", "price": 10000, "photo_file_id": f"p{i}"}
+            for i in range(1, args.products + 1)
+        ])
+        await session.commit()
+    await catalog.load()
+    sender.start()
+
+    dp = Dispatcher()
+    processing = ProcessingMiddleware()
+    for router in ROUTERS:
+        router.callback_query.middleware(processing)
+        dp.include_router(router)
+
+    product_ids = [product.id for product in catalog.products]
+    report = {"params": vars(args) | {"db_url": db_url}}
+    # Планировщик подключается к диспетчеру насовсем, поэтому его режим - последним
+    for mode in sorted(args.modes, key=MODES.index):
+        if mode == "scheduler":
+            update_scheduler.setup(dp)
+        report[mode] = await run_mode(dp, mode, make_updates(product_ids), processing)
+    if "scheduler" in args.modes:
+        report["scheduler"]["stats"] = update_scheduler.stats()
+        await update_scheduler.close()
+
+    await positions.flush()
+    await write_behind.close()
+    await sender.close()
+    await yookassa.close()
+    await servers.close()
+    await engine.dispose()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
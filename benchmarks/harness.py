@@ -0,0 +1,272 @@
+"""
+Общие заготовки бенчмарков: окружение, поддельные сессия Bot API, YooKassa
+и Crypto Pay, синтетические Update, статистика задержек и счетчик SQL-запросов.
+
+Настройки бота читаются при импорте config, поэтому скрипт сначала вызывает
+setup_environment и только затем импортирует модули бота.
+"""
+import asyncio
+import itertools
+import math
+import os
+import sys
+import tempfile
+import time
+import typing
+import uuid
+import zlib
+from collections import Counter
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import GetMe, TelegramMethod
+from aiogram.types import Chat, Message, User
+from aiohttp import web
+from sqlalchemy import event as sql_event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+BOT_ID = 42
+update_ids = itertools.count(1)
+message_ids = itertools.count(1)
+
+
+def setup_environment(db_url: Optional[str] = None, **settings: str) -> str:
+    """
+    Окружение бота для бенчмарка: база (по умолчанию временный файл SQLite),
+    токены, очередь отправки без лимитов Telegram. Возвращает DB_URL
+    """
+    os.environ["DB_URL"] = db_url or f"sqlite+aiosqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    os.environ.setdefault("TG_TOKEN", f"{BOT_ID}:bench")
+    os.environ.setdefault("CRYPTO_PAY_API_KEY", "bench")
+    os.environ.update(SEND_RATE="1000000", SEND_BURST="1000000", SEND_CHAT_INTERVAL="0",
+                      SEND_GROUP_INTERVAL="0", SEND_QUEUE_SIZE="1000000")
+    os.environ.update(settings)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return os.environ["DB_URL"]
+
+
+# Bot API
+
+class FakeSession(BaseSession):
+    """
+    Сессия Bot API без сети: запросы считаются по методам, ответ собирается
+    по типу результата метода (Message, User или True). latency - задержка
+    ответа, секунды
+    """
+
+    def __init__(self, latency: float = 0.0) -> None:
+        super().__init__()
+        self.latency = latency
+        self.calls: Counter = Counter()
+
+    async def close(self) -> None:
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        raise NotImplementedError
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None) -> Any:
+        self.calls[method.__api_method__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if isinstance(method, GetMe):
+            return User(id=BOT_ID, is_bot=True, first_name="Bench", username="bench_bot")
+
+        returning = method.__returning__
+        if returning is Message or Message in typing.get_args(returning):
+            chat_id = getattr(method, "chat_id", None) or 1
+            return Message(message_id=next(message_ids), date=datetime.now(),
+                           chat=Chat(id=chat_id, type="private"), text=getattr(method, "text", None)).as_(bot)
+        return True
+
+
+# Синтетические Update
+
+def _user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}",
+            "language_code": "ru"}
+
+
+def _chat(user_id: int) -> dict:
+    return {"id": user_id, "type": "private", "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+
+def message_update(user_id: int, text: str) -> dict:
+    return {
+        "update_id": next(update_ids),
+        "message": {
+            "message_id": next(message_ids),
+            "date": int(time.time()),
+            "chat": _chat(user_id),
+            "from": _user(user_id),
+            "text": text,
+            **({"entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]}
+               if text.startswith("/") else {}),
+        },
+    }
+
+
+def callback_update(user_id: int, data: str, photo: bool = False) -> dict:
+    """Нажатие кнопки под сообщением бота (photo - под карточкой товара с фото)"""
+    message = {
+        "message_id": next(message_ids),
+        "date": int(time.time()),
+        "chat": _chat(user_id),
+        "from": {"id": BOT_ID, "is_bot": True, "first_name": "Bench", "username": "bench_bot"},
+    }
+    if photo:
+        message["photo"] = [{"file_id": "photo", "file_unique_id": "photo", "width": 100, "height": 100}]
+        message["caption"] = "📦 Товар"
+    else:
+        message["text"] = "Выберите способ оплаты 💫"
+    return {
+        "update_id": next(update_ids),
+        "callback_query": {
+            "id": str(uuid.uuid4()),
+            "chat_instance": str(user_id),
+            "from": _user(user_id),
+            "message": message,
+            "data": data,
+        },
+    }
+
+
+# Платежные системы
+
+class FakePaymentServers:
+    """
+    Поддельные YooKassa API (/v3/payments) и Crypto Pay API (/api/...) на
+    одном локальном порту. Статус, который возвращает проверка платежа,
+    задается paid_ratio: доля оплаченных платежей
+    """
+
+    def __init__(self, latency: float = 0.0, paid_ratio: float = 0.5) -> None:
+        self.latency = latency
+        self.paid_ratio = paid_ratio
+        self.requests: Counter = Counter()
+        self._invoice_ids = itertools.count(1)
+        self._runner: Optional[web.AppRunner] = None
+        self.url = ""
+
+    def _paid(self, external_id: str) -> bool:
+        return zlib.crc32(external_id.encode()) % 1000 < self.paid_ratio * 1000
+
+    async def _delay(self, name: str) -> None:
+        self.requests[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def create_payment(self, request: web.Request) -> web.Response:
+        await self._delay("yookassa.create_payment")
+        params = await request.json()
+        payment_id = str(uuid.uuid4())
+        return web.json_response({
+            "id": payment_id, "status": "pending", "paid": False, "amount": params["amount"],
+            "metadata": params.get("metadata", {}),
+            "confirmation": {"type": "redirect", "confirmation_url": f"https://yookassa.test/pay/{payment_id}"},
+        })
+
+    async def find_payment(self, request: web.Request) -> web.Response:
+        await self._delay("yookassa.find_payment")
+        payment_id = request.match_info["payment_id"]
+        paid = self._paid(payment_id)
+        return web.json_response({"id": payment_id, "status": "succeeded" if paid else "pending", "paid": paid,
+                                  "amount": {"value": "100.00", "currency": "RUB"}, "metadata": {}})
+
+    @staticmethod
+    def _invoice(invoice_id: int, status: str) -> dict:
+        return {
+            "invoice_id": invoice_id, "status": status, "hash": f"IV{invoice_id}", "asset": "USDT",
+            "amount": "1.00", "bot_invoice_url": f"https://t.me/CryptoBot?start=IV{invoice_id}",
+            "web_app_invoice_url": "https://app.send.tg", "mini_app_invoice_url": "https://t.me/CryptoBot/app",
+            "created_at": datetime.now().isoformat(), "allow_comments": True, "allow_anonymous": True,
+            "currency_type": "crypto",
+        }
+
+    async def create_invoice(self, request: web.Request) -> web.Response:
+        await self._delay("crypto.createInvoice")
+        return web.json_response({"ok": True, "result": self._invoice(next(self._invoice_ids), "active")})
+
+    async def get_invoices(self, request: web.Request) -> web.Response:
+        await self._delay("crypto.getInvoices")
+        invoice_ids = request.query.get("invoice_ids", "").split(",")
+        items = [self._invoice(int(i), "paid" if self._paid(i) else "active") for i in invoice_ids if i]
+        return web.json_response({"ok": True, "result": {"items": items}})
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_post("/v3/payments", self.create_payment)
+        app.router.add_get("/v3/payments/{payment_id}", self.find_payment)
+        app.router.add_get("/api/createInvoice", self.create_invoice)
+        app.router.add_get("/api/getInvoices", self.get_invoices)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self.url
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+# Замеры
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+class QueryCounter:
+    """Число SQL-запросов, выполненных движком (сбрасывается присваиванием count = 0)"""
+
+    def __init__(self, engine: AsyncEngine) -> None:
+        self.count = 0
+        sql_event.listen(engine.sync_engine, "before_cursor_execute", self._count)
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        self.count += 1
+
+
+def latency_stats(latencies: List[float], elapsed: float) -> Dict[str, float]:
+    """Пропускная способность и перцентили задержки, мс"""
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "seconds": round(elapsed, 3),
+        "per_s": round(len(values) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 2),
+        "p95_ms": round(percentile(values, 95) * 1000, 2),
+        "p99_ms": round(percentile(values, 99) * 1000, 2),
+        "max_ms": round(values[-1] * 1000, 2) if values else 0.0,
+    }
+
+
+async def run_concurrently(calls: List[Callable[[], Awaitable]], concurrency: int) -> tuple:
+    """
+    Выполняет вызовы не более чем по concurrency одновременно.
+    Возвращает (задержки, число ошибок, общее время)
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async def timed(call: Callable[[], Awaitable]) -> None:
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await call()
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(timed(call) for call in calls))
+    return latencies, errors, time.perf_counter() - started
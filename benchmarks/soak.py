@@ -0,0 +1,237 @@
+"""
+Длительный прогон (soak) для поиска утечек памяти.
+
+Через Dispatcher со всеми роутерами прогоняется --updates апдейтов вперемешку:
+/start, открытие каталога, листание карточек, выбор товара и создание
+платежей (Bot API, YooKassa и Crypto Pay подменены, см. harness.py).
+Фоновые задачи бота (проверка платежей, сохранение позиций, outbox)
+работают как в проде.
+
+Каждые --sample-every апдейтов записываются RSS процесса и объем памяти,
+отслеживаемой tracemalloc. После разогрева (--warmup, доля апдейтов)
+память должна выйти на плато: если к концу прогона RSS или tracemalloc
+выросли больше чем на --max-growth-mb, код возврата 1.
+
+В отчете также:
+    top_allocators - строки кода с наибольшим ростом памяти после разогрева
+    handlers       - по обработчикам: вызовы, средний пик выделений за вызов
+                     и суммарный остаток памяти после вызовов (точно при
+                     --concurrency 1, при большей конкурентности - оценка)
+
+Пример:
+    python benchmarks/soak.py --updates 1000000 --users 50000 --output soak.json
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import resource
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict
+
+from harness import FakeSession, FakePaymentServers, setup_environment, message_update, callback_update
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--updates", type=int, default=200000)
+parser.add_argument("--users", type=int, default=20000)
+parser.add_argument("--products", type=int, default=50)
+parser.add_argument("--concurrency", type=int, default=1)
+parser.add_argument("--sample-every", type=int, default=10000, help="апдейтов между замерами памяти")
+parser.add_argument("--warmup", type=float, default=0.2, help="доля апдейтов на разогрев")
+parser.add_argument("--max-growth-mb", type=float, default=20.0)
+parser.add_argument("--top", type=int, default=15, help="строк в top_allocators")
+parser.add_argument("--frames", type=int, default=1, help="глубина стека tracemalloc")
+parser.add_argument("--db-url", default=None)
+parser.add_argument("--output", default=None, help="файл для JSON-результата")
+args = parser.parse_args()
+
+db_url = setup_environment(args.db_url)
+
+from aiogram import BaseMiddleware, Dispatcher  # noqa: E402
+from aiogram.types import TelegramObject, Update  # noqa: E402
+
+from bot import bot  # noqa: E402
+from db.catalog import catalog  # noqa: E402
+from db.migrations import run_migrations  # noqa: E402
+from db.models import Session, Product  # noqa: E402
+from handlers import handlers_admin, handlers_user, handlers_yookassa, handlers_stars, handlers_crypto  # noqa: E402
+from services.bot_context import bot_context  # noqa: E402
+from services.crypto_client import crypto  # noqa: E402
+from services.sender import sender  # noqa: E402
+from services.yookassa_client import yookassa  # noqa: E402
+from tasks import start_background_tasks  # noqa: E402
+
+ROUTERS = (handlers_admin.router, handlers_user.router, handlers_yookassa.router, handlers_stars.router,
+           handlers_crypto.router)
+
+# Доли видов апдейтов в потоке
+MIX = (
+    ("start", 10),
+    ("view_products", 10),
+    ("next_product", 35),
+    ("prev_product", 25),
+    ("buy", 10),
+    ("yookassa", 5),
+    ("cryptobot", 5),
+)
+
+
+class AllocationMiddleware(BaseMiddleware):
+    """Выделения памяти по обработчикам по данным tracemalloc"""
+
+    def __init__(self) -> None:
+        self.stats: Dict[str, Dict[str, float]] = defaultdict(lambda: {"calls": 0, "peak": 0, "retained": 0})
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        try:
+            return await handler(event, data)
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            stats = self.stats[data["handler"].callback.__name__]
+            stats["calls"] += 1
+            stats["peak"] += peak - before
+            stats["retained"] += current - before
+
+    def report(self) -> dict:
+        return {
+            name: {"calls": stats["calls"],
+                   "avg_peak_kb": round(stats["peak"] / stats["calls"] / 1024, 2),
+                   "retained_kb": round(stats["retained"] / 1024, 1)}
+            for name, stats in sorted(self.stats.items(), key=lambda item: -item[1]["retained"])
+        }
+
+
+def rss_mb() -> float:
+    """Текущий RSS процесса (Linux), иначе максимальный за время работы"""
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        scale = 2 ** 20 if sys.platform == "darwin" else 2 ** 10
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def make_update(kind: str, product_ids: list) -> dict:
+    user_id = random.randint(1, args.users)
+    product_id = random.choice(product_ids)
+    if kind == "start":
+        return message_update(user_id, "/start")
+    if kind == "view_products":
+        return callback_update(user_id, "view_products")
+    if kind in ("next_product", "prev_product"):
+        return callback_update(user_id, f"{kind}_{product_id}", photo=True)
+    return callback_update(user_id, f"{kind}_{product_id}")
+
+
+def sample(processed: int, started: float) -> dict:
+    gc.collect()
+    traced, _ = tracemalloc.get_traced_memory()
+    return {
+        "updates": processed,
+        "seconds": round(time.perf_counter() - started, 1),
+        "rss_mb": round(rss_mb(), 1),
+        "traced_mb": round(traced / 2 ** 20, 2),
+    }
+
+
+async def main() -> None:
+    bot.session = FakeSession()
+    servers = FakePaymentServers()
+    url = await servers.start()
+    yookassa.base_url = f"{url}/v3"
+    crypto.network = url
+
+    await run_migrations()
+    await bot_context.refresh(bot)
+    async with Session() as session:
+        await session.execute(Product.__table__.insert(), [
+            {"name": f"Товар {i}", "description": f"Описание товара {i}", "price": 10000, "photo_file_id": f"p{i}"}
+            for i in range(1, args.products + 1)
+        ])
+        await session.commit()
+    await catalog.load()
+    sender.start()
+    await start_background_tasks()
+
+    dp = Dispatcher()
+    allocations = AllocationMiddleware()
+    for router in ROUTERS:
+        for observer in (router.message, router.callback_query):
+            observer.middleware(allocations)
+        dp.include_router(router)
+
+    product_ids = [product.id for product in catalog.products]
+    kinds = random.choices([kind for kind, _ in MIX], weights=[weight for _, weight in MIX], k=args.updates)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    errors = 0
+
+    async def feed(kind: str) -> None:
+        nonlocal errors
+        async with semaphore:
+            try:
+                await dp.feed_update(bot, Update.model_validate(make_update(kind, product_ids), context={"bot": bot}))
+            except Exception:
+                errors += 1
+
+    tracemalloc.start(args.frames)
+    started = time.perf_counter()
+    samples = [sample(0, started)]
+    warmup_end = int(args.updates * args.warmup)
+    baseline = baseline_snapshot = None
+
+    for offset in range(0, args.updates, args.sample_every):
+        await asyncio.gather(*(feed(kind) for kind in kinds[offset:offset + args.sample_every]))
+        # Даем очереди отправки разобрать ответы, иначе в замер попадает ее наполнение
+        while sender.stats()["pending"]:
+            await asyncio.sleep(0.01)
+        processed = min(offset + args.sample_every, args.updates)
+        samples.append(sample(processed, started))
+        print(json.dumps(samples[-1]), file=sys.stderr)
+        if baseline is None and processed >= warmup_end:
+            baseline = samples[-1]
+            baseline_snapshot = tracemalloc.take_snapshot()
+
+    final_snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    final = samples[-1]
+    rss_growth = final["rss_mb"] - baseline["rss_mb"]
+    traced_growth = final["traced_mb"] - baseline["traced_mb"]
+    top = final_snapshot.compare_to(baseline_snapshot, "traceback" if args.frames > 1 else "lineno")[:args.top]
+
+    report = {
+        "params": vars(args) | {"db_url": db_url},
+        "updates_per_s": round(args.updates / (time.perf_counter() - started), 1),
+        "errors": errors,
+        "rss_growth_mb": round(rss_growth, 1),
+        "traced_growth_mb": round(traced_growth, 2),
+        "passed": rss_growth <= args.max_growth_mb and traced_growth <= args.max_growth_mb,
+        "samples": samples,
+        "top_allocators": [
+            {"where": [str(frame) for frame in stat.traceback], "size_diff_kb": round(stat.size_diff / 1024, 1),
+             "count_diff": stat.count_diff}
+            for stat in top
+        ],
+        "handlers": allocations.report(),
+        "bot_api_calls": dict(bot.session.calls),
+    }
+    await servers.close()
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text + "\n")
+    print(text)
+    if not report["passed"] or errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
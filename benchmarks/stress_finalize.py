@@ -0,0 +1,162 @@
+"""
+Стресс-тест финализации платежей: кнопка проверки, вебхук и фоновая проверка
+одновременно финализируют одни и те же платежи.
+
+Для каждого платежа конкурентно запускаются finalize_payment (кнопка и вебхук)
+и пакетная finalize_payments (фоновая проверка). Уведомления доставляются
+через outbox и очередь отправки, сама отправка сообщений подменяется
+счетчиком; тест проверяет, что каждый платеж финализирован ровно один раз
+(одно уведомление администратору) и ни один не остался в ожидании.
+Результат печатается в JSON, при нарушении код возврата 1.
+
+По умолчанию используется временный файл SQLite, другую базу можно задать
+через --db-url (например, postgresql+asyncpg://...).
+
+Пример:
+    python benchmarks/stress_finalize.py --payments 2000 --rounds 3
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--payments", type=int, default=1000)
+parser.add_argument("--rounds", type=int, default=3, help="число прогонов на новых платежах")
+parser.add_argument("--db-url", default=None)
+args = parser.parse_args()
+
+# Настройки читаются при импорте config, поэтому окружение задается до импорта модулей бота
+os.environ["DB_URL"] = args.db_url or f"sqlite+aiosqlite:///{os.path.join(tempfile.mkdtemp(), 'stress.db')}"
+os.environ.setdefault("TG_TOKEN", "1:stress")
+# Лимиты Telegram здесь не нужны: уведомления уходят в счетчик
+os.environ.update(SEND_RATE="1000000", SEND_BURST="1000000", SEND_CHAT_INTERVAL="0", SEND_QUEUE_SIZE="1000000")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot import bot  # noqa: E402
+from config import ORDER_CHAT_ID  # noqa: E402
+from db.migrations import run_migrations  # noqa: E402
+from db.models import Session, User, Product, LedgerModel, OutboxModel, engine  # noqa: E402
+from db.write_behind import write_behind  # noqa: E402
+from services.payments import finalize_payment, finalize_payments  # noqa: E402
+from services.outbox import outbox  # noqa: E402
+from services.sender import sender  # noqa: E402
+
+RUN_ID = int(time.time())
+user_notifications = Counter()
+admin_notifications = Counter()
+
+
+async def fake_send_message(chat_id, text, **kwargs):
+    payment_id = text.rsplit("ID платежа: ", 1)[-1] if chat_id == ORDER_CHAT_ID else None
+    if payment_id:
+        admin_notifications[payment_id] += 1
+    await asyncio.sleep(0)
+
+
+class FakeMessage:
+    """Сообщение с кнопкой проверки, которое заменяется уведомлением об оплате"""
+
+    def __init__(self, payment_id: str):
+        self.payment_id = payment_id
+
+    async def edit_text(self, text, **kwargs):
+        user_notifications[self.payment_id] += 1
+
+
+async def prepare(round_number: int, count: int) -> list:
+    # Префикс запуска: базу PostgreSQL можно использовать повторно
+    external_ids = [f"{RUN_ID}-r{round_number}-{i}" for i in range(count)]
+    async with Session() as session:
+        await session.execute(
+            LedgerModel.__table__.insert(),
+            [{"provider": "yookassa", "external_id": external_id, "status": "pending", "user_id": 1,
+              "product_id": 1, "amount": 10000, "currency": "RUB"} for external_id in external_ids]
+        )
+        await session.commit()
+    return external_ids
+
+
+async def run_round(external_ids: list) -> tuple:
+    started = time.perf_counter()
+    outcomes = await asyncio.gather(
+        # Фоновая проверка: одна пачка на все платежи
+        finalize_payments("yookassa", {external_id: "succeeded" for external_id in external_ids}),
+        # Кнопка проверки оплаты
+        *(finalize_payment("yookassa", external_id, "succeeded", edit_message=FakeMessage(external_id))
+          for external_id in external_ids),
+        # Вебхук
+        *(finalize_payment("yookassa", external_id, "succeeded") for external_id in external_ids),
+        return_exceptions=True,
+    )
+    errors = [outcome for outcome in outcomes if isinstance(outcome, Exception)]
+    for error in errors[:3]:
+        print(f"Ошибка финализации: {error!r}", file=sys.stderr)
+    return time.perf_counter() - started, len(errors)
+
+
+async def main() -> None:
+    bot.send_message = fake_send_message
+    sender.start()
+    dispatcher = asyncio.create_task(outbox.run())
+    await run_migrations()
+    async with Session() as session:
+        await session.merge(User(user_id=1, username="stress"))
+        await session.merge(Product(id=1, name="Товар", price=10000, photo_file_id="file"))
+        await session.commit()
+
+    results = []
+    all_ids = []
+    errors = 0
+    for round_number in range(args.rounds):
+        external_ids = await prepare(round_number, args.payments)
+        all_ids.extend(external_ids)
+        elapsed, round_errors = await run_round(external_ids)
+        errors += round_errors
+        results.append({"round": round_number, "seconds": round(elapsed, 3), "errors": round_errors,
+                        "finalizations_per_s": round(len(external_ids) / elapsed, 1)})
+
+    # Ждем доставки уведомлений из outbox (ответы кнопкой outbox не отправляет)
+    while True:
+        async with Session() as session:
+            undelivered = (await session.execute(
+                OutboxModel.__table__.select()
+                .where(OutboxModel.status == "pending", OutboxModel.key.like("%:admin"))
+            )).fetchall()
+        if not undelivered:
+            break
+        await asyncio.sleep(0.2)
+    await write_behind.close()
+    dispatcher.cancel()
+    await sender.close()
+    await outbox.close()
+
+    # Уведомление администратору отправляется при каждой успешной финализации,
+    # поэтому по нему считается, сколько раз был финализирован платеж
+    duplicates = sum(1 for external_id in all_ids if admin_notifications[external_id] > 1)
+    missing = sum(1 for external_id in all_ids if admin_notifications[external_id] == 0)
+    async with Session() as session:
+        pending = (await session.execute(
+            LedgerModel.__table__.select().where(LedgerModel.status == "pending")
+        )).fetchall()
+
+    await engine.dispose()
+    print(json.dumps({
+        "params": vars(args) | {"db_url": os.environ["DB_URL"]},
+        "results": results,
+        "payments": len(all_ids),
+        "duplicate_notifications": duplicates,
+        "missing_notifications": missing,
+        "left_pending": len(pending),
+        "button_notifications": sum(user_notifications.values()),
+    }, ensure_ascii=False, indent=2))
+    if duplicates or missing or pending or errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
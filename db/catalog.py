@@ -0,0 +1,85 @@
+import asyncio
+import logging
+from bisect import bisect_left, bisect_right
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy.engine import Row
+
+from db.models import Session, ReadSession, Product
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogCache:
+    """
+    Кэш активного каталога товаров в памяти процесса.
+
+    Хранит упорядоченный по id кортеж активных товаров, индекс id -> товар
+    и отсортированный кортеж id для поиска соседей бинарным поиском.
+    Загружается при старте бота и перестраивается после каждого изменения
+    товаров (write-through инвалидация), поэтому пользовательские обработчики
+    не обращаются к БД при просмотре каталога.
+    """
+
+    def __init__(self) -> None:
+        self.products: Tuple[Row, ...] = ()
+        self.by_id: Dict[int, Row] = {}
+        self.ids: Tuple[int, ...] = ()
+        self._lock = asyncio.Lock()
+
+    async def load(self, session_factory=ReadSession) -> None:
+        """Загружает активные товары из БД и атомарно подменяет снимок каталога"""
+        async with self._lock:
+            async with session_factory() as session:
+                result = await session.execute(
+                    Product.__table__.select()
+                    .where(Product.is_active == True)
+                    .order_by(Product.id)
+                )
+                products = tuple(result.fetchall())
+
+            # Подменяем все структуры одним присваиванием, чтобы читатели
+            # никогда не видели несогласованное состояние
+            self.products, self.by_id, self.ids = (
+                products, {p.id: p for p in products}, tuple(p.id for p in products)
+            )
+            logger.info(f"Каталог загружен в кэш: {len(products)} товаров")
+
+    async def invalidate(self) -> None:
+        """
+        Перестраивает кэш после изменения товаров в БД. Читает с основной БД,
+        чтобы не получить устаревший снимок с отстающей реплики
+        """
+        await self.load(Session)
+
+    def get(self, product_id: int) -> Optional[Row]:
+        return self.by_id.get(product_id)
+
+    def first(self) -> Optional[Row]:
+        return self.products[0] if self.products else None
+
+    def next_after(self, product_id: int) -> Optional[Row]:
+        """
+        Следующий товар с id больше product_id (с переходом в начало).
+        Работает и для уже удаленного из каталога product_id.
+        """
+        products = self.products
+        if not products:
+            return None
+        index = bisect_right(self.ids, product_id)
+        return products[index % len(products)]
+
+    def prev_before(self, product_id: int) -> Optional[Row]:
+        """Предыдущий товар с id меньше product_id (с переходом в конец)"""
+        products = self.products
+        if not products:
+            return None
+        index = bisect_left(self.ids, product_id) - 1
+        return products[index % len(products)]
+
+    def __len__(self) -> int:
+        return len(self.products)
+
+
+# Общий для всего процесса кэш каталога
+catalog = CatalogCache()
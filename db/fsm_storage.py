@@ -0,0 +1,176 @@
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Collection, Dict, List, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from sqlalchemy import bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import ADMIN_IDS, FSM_CACHE_CAPACITY, FSM_CACHE_TTL, FSM_STATE_TTL
+from db.models import Session, FsmStateModel, UPSERT_CHUNK_SIZE, upsert
+from db.write_behind import write_behind
+
+logger = logging.getLogger(__name__)
+
+class _Entry:
+    __slots__ = ("state", "data", "loaded_at")
+
+    def __init__(self, state: Optional[str], data: str, loaded_at: float) -> None:
+        self.state = state
+        self.data = data  # JSON: копия данных для каждого чтения без общих изменяемых объектов
+        self.loaded_at = loaded_at
+
+
+class SqlStorage(BaseStorage):
+    """
+    Хранилище FSM aiogram в таблице fsm_states (SQLite или PostgreSQL).
+
+    В БД хранятся состояния пользователей persistent_users (по умолчанию
+    ADMIN_IDS: оба мастера бота - добавление товара и рассылка - только для
+    администраторов). Состояния остальных пользователей живут только в
+    памяти процесса, как в MemoryStorage: FSMContextMiddleware читает
+    состояние на каждом апдейте, и покупатели не должны платить за это
+    запросом к БД.
+
+    Чтения состояний из БД идут через локальный кэш (не более
+    cache_capacity ключей, LRU): состояние используется без запроса к БД
+    cache_ttl секунд, затем перечитывается - так его видят и другие
+    процессы бота. Записи сразу попадают в кэш и пишутся пачками через
+    write_behind; очищенное состояние удаляет строку, а отброшенная после
+    всех попыток запись убирает ключ из кэша. Состояния, не менявшиеся
+    state_ttl секунд (брошенный мастер), удаляет cleanup() - и в БД, и в
+    памяти (состояний в памяти тоже не более cache_capacity, LRU).
+    """
+
+    def __init__(self, cache_capacity: int = FSM_CACHE_CAPACITY, cache_ttl: float = FSM_CACHE_TTL,
+                 state_ttl: float = FSM_STATE_TTL, persistent_users: Collection[int] = ADMIN_IDS) -> None:
+        self.cache_capacity = cache_capacity
+        self.cache_ttl = cache_ttl
+        self.state_ttl = state_ttl
+        self.persistent_users = frozenset(persistent_users)
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_business_connection_id=True, with_destiny=True)
+        self._cache: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._local: "OrderedDict[str, _Entry]" = OrderedDict()  # непустые состояния остальных пользователей
+        self.hits = 0
+        self.misses = 0
+
+    async def _entry(self, key: StorageKey) -> tuple:
+        storage_key = self.key_builder.build(key)
+        now = time.monotonic()
+        if key.user_id not in self.persistent_users:
+            # loaded_at состояния в памяти - время его записи
+            entry = self._local.get(storage_key)
+            if entry is None or now - entry.loaded_at > self.state_ttl:
+                return storage_key, _Entry(None, "{}", 0.0)
+            self._local.move_to_end(storage_key)
+            return storage_key, entry
+
+        entry = self._cache.get(storage_key)
+        if entry is not None and now - entry.loaded_at <= self.cache_ttl:
+            self._cache.move_to_end(storage_key)
+            self.hits += 1
+            return storage_key, entry
+
+        self.misses += 1
+        row = write_behind.pending_row("fsm_states", storage_key)
+        if row is not None:
+            # Запись вытесненного из кэша состояния еще не дошла до БД
+            entry = _Entry(row["state"], row["data"], now)
+            self._put(storage_key, entry)
+            return storage_key, entry
+
+        # Основная база, а не реплика: состояние могло быть записано только что
+        async with Session() as session:
+            row = await session.get(FsmStateModel, storage_key)
+        entry = _Entry(row.state, row.data, now) if row is not None else _Entry(None, "{}", now)
+        self._put(storage_key, entry)
+        return storage_key, entry
+
+    def _put(self, storage_key: str, entry: _Entry, entries: Optional[OrderedDict] = None) -> None:
+        entries = self._cache if entries is None else entries
+        entries[storage_key] = entry
+        entries.move_to_end(storage_key)
+        while len(entries) > self.cache_capacity:
+            entries.popitem(last=False)
+
+    def invalidate(self, storage_keys: Collection[str]) -> None:
+        """Убирает ключи из кэша: следующее чтение возьмет состояние из БД"""
+        for storage_key in storage_keys:
+            self._cache.pop(storage_key, None)
+
+    async def _write(self, key: StorageKey, storage_key: str, state: Optional[str], data: str) -> None:
+        if key.user_id not in self.persistent_users:
+            if state is None and data == "{}":
+                self._local.pop(storage_key, None)
+            else:
+                self._put(storage_key, _Entry(state, data, time.monotonic()), self._local)
+            return
+
+        self._put(storage_key, _Entry(state, data, time.monotonic()))
+        await write_behind.put("fsm_states", storage_key, {"key": storage_key, "state": state, "data": data,
+                                                           "updated_at": datetime.now()})
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key, entry = await self._entry(key)
+        await self._write(key, storage_key, state.state if isinstance(state, State) else state, entry.data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        _, entry = await self._entry(key)
+        return entry.state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        storage_key, entry = await self._entry(key)
+        # Сериализация сразу, чтобы ошибка (не-JSON значение) возникла в обработчике, а не при записи пачки
+        await self._write(key, storage_key, entry.state, json.dumps(dict(data), ensure_ascii=False))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, entry = await self._entry(key)
+        return json.loads(entry.data)
+
+    async def cleanup(self) -> None:
+        """Удаляет брошенные состояния и устаревшие записи кэша"""
+        async with Session() as session:
+            result = await session.execute(
+                FsmStateModel.__table__.delete()
+                .where(FsmStateModel.updated_at < datetime.now() - timedelta(seconds=self.state_ttl))
+            )
+            await session.commit()
+        now = time.monotonic()
+        for entries, ttl in ((self._cache, self.cache_ttl), (self._local, self.state_ttl)):
+            for storage_key in [k for k, entry in entries.items() if entry.loaded_at < now - ttl]:
+                del entries[storage_key]
+        if result.rowcount:
+            logger.info(f"Удалено брошенных состояний FSM: {result.rowcount}")
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._cache), "local": len(self._local), "hits": self.hits, "misses": self.misses}
+
+    async def close(self) -> None:
+        """Несохраненные состояния дописывает write_behind.close()"""
+
+
+async def save_states(session: AsyncSession, rows: List[dict]) -> None:
+    cleared = [{"b_key": row["key"]} for row in rows if row["state"] is None and row["data"] == "{}"]
+    saved = [row for row in rows if row["state"] is not None or row["data"] != "{}"]
+    if cleared:
+        await session.execute(FsmStateModel.__table__.delete().where(FsmStateModel.key == bindparam("b_key")),
+                              cleared)
+    for start in range(0, len(saved), UPSERT_CHUNK_SIZE):
+        await session.execute(upsert(FsmStateModel.__table__, saved[start:start + UPSERT_CHUNK_SIZE],
+                                     ["key"], ["state", "data", "updated_at"]))
+
+
+def states_dropped(rows: List[dict]) -> None:
+    # В кэше осталось несохраненное состояние: следующее чтение вернет то, что есть в БД
+    logger.error(f"Состояния FSM не сохранены: {len(rows)}")
+    fsm_storage.invalidate([row["key"] for row in rows])
+
+
+write_behind.register("fsm_states", save_states, dropped=states_dropped)
+
+# Общее для процесса хранилище FSM
+fsm_storage = SqlStorage()
@@ -0,0 +1,344 @@
+import logging
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, BigInteger, ForeignKey, Text, Index, MetaData, \
+    Table, UniqueConstraint, inspect, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from db.models import engine
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory-блокировки PostgreSQL, чтобы миграции выполнял только один процесс
+MIGRATIONS_LOCK_ID = 7311001
+
+
+# Таблицы в том виде, в каком их создают миграции: базовая схема (как ее
+# создавал create_tables до появления миграций) и таблицы последующих миграций.
+# Не меняются вслед за моделями: изменения схемы оформляются новыми миграциями
+SCHEMA = MetaData()
+
+Table(
+    "users", SCHEMA,
+    Column("user_id", BigInteger, primary_key=True),
+    Column("username", String(100)),
+    Column("first_name", String(100)),
+    Column("last_name", String(100)),
+    Column("created_at", DateTime),
+    Column("is_active", Boolean),
+)
+
+Table(
+    "products", SCHEMA,
+    Column("id", Integer, primary_key=True),
+    Column("name", String(100), nullable=False),
+    Column("description", Text),
+    Column("price", Integer, nullable=False),
+    Column("photo_file_id", String(255), nullable=False),
+    Column("created_at", DateTime),
+    Column("is_active", Boolean),
+)
+
+Table(
+    "payments", SCHEMA,
+    Column("id", String(255), primary_key=True),
+    Column("status", String(20), nullable=False),
+    Column("user_id", BigInteger, ForeignKey("users.user_id"), nullable=False),
+    Column("product_id", Integer, ForeignKey("products.id"), nullable=False),
+    Column("amount", Integer, nullable=False),
+    Column("created_at", DateTime),
+    Column("updated_at", DateTime),
+)
+
+Table(
+    "stars_payments", SCHEMA,
+    Column("id", String(255), primary_key=True),
+    Column("status", String(20), nullable=False),
+    Column("user_id", BigInteger, ForeignKey("users.user_id"), nullable=False),
+    Column("product_id", Integer, ForeignKey("products.id"), nullable=False),
+    Column("amount", Integer, nullable=False),
+    Column("created_at", DateTime),
+    Column("updated_at", DateTime),
+)
+
+Table(
+    "crypto_payments", SCHEMA,
+    Column("id", BigInteger, primary_key=True),
+    Column("status", String(20), nullable=True),
+    Column("user_id", BigInteger, ForeignKey("users.user_id"), nullable=False),
+    Column("product_id", Integer, ForeignKey("products.id"), nullable=False),
+    Column("amount", Integer, nullable=False),
+    Column("created_at", DateTime),
+    Column("updated_at", DateTime),
+)
+
+
+Table(
+    "ledger", SCHEMA,
+    Column("id", Integer, primary_key=True),
+    Column("provider", String(20), nullable=False),
+    Column("external_id", String(255), nullable=False),
+    Column("status", String(20), nullable=False),
+    Column("user_id", BigInteger, ForeignKey("users.user_id"), nullable=False),
+    Column("product_id", Integer, ForeignKey("products.id"), nullable=False),
+    Column("amount", Integer, nullable=False),
+    Column("currency", String(10), nullable=False),
+    Column("created_at", DateTime),
+    Column("updated_at", DateTime),
+    Column("next_check_at", DateTime),
+    Column("check_attempts", Integer, nullable=False),
+    UniqueConstraint("provider", "external_id", name="uq_ledger_provider_external_id"),
+    Index("ix_ledger_status_next_check_at", "status", "next_check_at"),
+    Index("ix_ledger_provider_status", "provider", "status"),
+)
+
+Table(
+    "outbox", SCHEMA,
+    Column("id", Integer, primary_key=True),
+    Column("key", String(100), nullable=False, unique=True),
+    Column("chat_id", BigInteger, nullable=False),
+    Column("text", Text, nullable=False),
+    Column("reply_markup", Text),
+    Column("priority", Integer, nullable=False),
+    Column("status", String(20), nullable=False),
+    Column("attempts", Integer, nullable=False),
+    Column("next_attempt_at", DateTime),
+    Column("last_error", Text),
+    Column("created_at", DateTime),
+    Column("sent_at", DateTime),
+    Index("ix_outbox_status_next_attempt_at", "status", "next_attempt_at"),
+)
+
+Table(
+    "broadcasts", SCHEMA,
+    Column("id", Integer, primary_key=True),
+    Column("admin_id", BigInteger, nullable=False),
+    Column("text", Text, nullable=False),
+    Column("status", String(20), nullable=False, index=True),
+    Column("last_user_id", BigInteger, nullable=False),
+    Column("total", Integer, nullable=False),
+    Column("sent", Integer, nullable=False),
+    Column("failed", Integer, nullable=False),
+    Column("blocked", Integer, nullable=False),
+    Column("created_at", DateTime),
+    Column("updated_at", DateTime),
+    Column("finished_at", DateTime),
+)
+
+Table(
+    "fsm_states", SCHEMA,
+    Column("key", String(255), primary_key=True),
+    Column("state", String(255)),
+    Column("data", Text, nullable=False),
+    Column("updated_at", DateTime, nullable=False, index=True),
+)
+
+Table(
+    "user_positions", SCHEMA,
+    Column("user_id", BigInteger, primary_key=True),
+    Column("product_id", Integer, nullable=False),
+    Column("updated_at", DateTime),
+)
+
+
+# Вспомогательные операции. Базы, созданные create_tables до появления
+# миграций, имеют версию 0, но могут уже содержать часть последующих
+# изменений, поэтому колонки, индексы и таблицы создаются, только если их нет
+
+def _column_names(sync_conn, table_name: str) -> set:
+    return {column["name"] for column in inspect(sync_conn).get_columns(table_name)}
+
+
+async def create_schema_tables(conn: AsyncConnection, *names: str) -> None:
+    """Создает таблицы схемы SCHEMA с их индексами, если их еще нет"""
+    await conn.run_sync(SCHEMA.create_all, tables=[SCHEMA.tables[name] for name in names])
+
+
+async def add_column(conn: AsyncConnection, table: str, column: Column, server_default: str = None) -> None:
+    """Добавляет колонку в существующую таблицу, если ее еще нет"""
+    if column.name in await conn.run_sync(_column_names, table):
+        return
+
+    ddl = f"ALTER TABLE {table} ADD COLUMN {column.name} {column.type.compile(dialect=conn.dialect)}"
+    if server_default is not None:
+        ddl += f" DEFAULT {server_default}"
+        if not column.nullable:
+            ddl += " NOT NULL"
+    await conn.execute(text(ddl))
+
+
+async def create_index(conn: AsyncConnection, name: str, table: str, columns: list) -> None:
+    """
+    Создает индекс, если его нет. В PostgreSQL индекс строится CONCURRENTLY,
+    не блокируя запись в таблицу (conn должен работать в режиме AUTOCOMMIT)
+    """
+    concurrently = "CONCURRENTLY " if conn.dialect.name == "postgresql" else ""
+    await conn.execute(text(
+        f"CREATE INDEX {concurrently}IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"
+    ))
+
+
+# Миграции
+
+async def create_base_schema(conn: AsyncConnection) -> None:
+    await create_schema_tables(conn, "users", "products", "payments", "stars_payments", "crypto_payments")
+
+
+async def add_payment_check_schedule(conn: AsyncConnection) -> None:
+    for table in ("payments", "crypto_payments"):
+        await add_column(conn, table, Column("next_check_at", DateTime))
+        await add_column(conn, table, Column("check_attempts", Integer, nullable=False), server_default="0")
+        # Платежи, созданные до появления расписания, проверяются в ближайшей выборке
+        await conn.execute(text(
+            f"UPDATE {table} SET next_check_at = :now "
+            f"WHERE next_check_at IS NULL AND status IN ('pending', 'active')"
+        ), {"now": datetime.now()})
+
+
+async def create_payment_check_indexes(conn: AsyncConnection) -> None:
+    await create_index(conn, "ix_payments_status_next_check_at", "payments", ["status", "next_check_at"])
+    await create_index(conn, "ix_crypto_payments_status_next_check_at", "crypto_payments", ["status", "next_check_at"])
+
+
+async def create_status_indexes(conn: AsyncConnection) -> None:
+    await create_index(conn, "ix_products_is_active", "products", ["is_active"])
+    await create_index(conn, "ix_stars_payments_status", "stars_payments", ["status"])
+
+
+async def create_ledger(conn: AsyncConnection) -> None:
+    await create_schema_tables(conn, "ledger")
+
+    # Перенос платежей из таблиц отдельных платежных систем. Суммы переводятся
+    # в минимальные единицы валюты, статусы Crypto Pay - в статусы журнала.
+    # Для каждой таблицы: (таблица, провайдер, внешний id, колонки после external_id)
+    sources = [
+        ("payments", "yookassa", "src.id",
+         "src.status, src.amount, 'RUB', src.next_check_at, src.check_attempts"),
+        ("stars_payments", "stars", "src.id",
+         "src.status, src.amount, 'XTR', NULL, 0"),
+        ("crypto_payments", "crypto", "CAST(src.id AS VARCHAR(255))",
+         "CASE src.status WHEN 'paid' THEN 'succeeded' WHEN 'expired' THEN 'expired' "
+         "WHEN 'failed' THEN 'canceled' ELSE 'pending' END, "
+         "CAST(ROUND(src.amount * 100) AS INTEGER), 'USDT', src.next_check_at, src.check_attempts"),
+    ]
+    for table, provider, external_id, values in sources:
+        await conn.execute(text(
+            f"INSERT INTO ledger (provider, external_id, status, amount, currency, next_check_at, check_attempts, "
+            f"user_id, product_id, created_at, updated_at) "
+            f"SELECT '{provider}', {external_id}, {values}, "
+            f"src.user_id, src.product_id, src.created_at, src.updated_at FROM {table} AS src "
+            f"WHERE NOT EXISTS (SELECT 1 FROM ledger "
+            f"WHERE ledger.provider = '{provider}' AND ledger.external_id = {external_id})"
+        ))
+
+
+async def create_outbox(conn: AsyncConnection) -> None:
+    await create_schema_tables(conn, "outbox")
+
+
+async def create_broadcasts(conn: AsyncConnection) -> None:
+    await create_schema_tables(conn, "broadcasts")
+
+
+async def create_fsm_states(conn: AsyncConnection) -> None:
+    await create_schema_tables(conn, "fsm_states")
+
+
+async def make_crypto_amount_fractional(conn: AsyncConnection) -> None:
+    # Суммы Crypto Pay дробные (USDT). В SQLite тип колонки не ограничивает значения
+    if conn.dialect.name == "postgresql":
+        await conn.execute(text("ALTER TABLE crypto_payments ALTER COLUMN amount TYPE DOUBLE PRECISION"))
+
+
+async def create_user_positions(conn: AsyncConnection) -> None:
+    await create_schema_tables(conn, "user_positions")
+
+
+async def unschedule_stars_payments(conn: AsyncConnection) -> None:
+    # Платежи Stars подтверждает Telegram: снимаем с расписания проверки записанные раньше
+    await conn.execute(text(
+        "UPDATE ledger SET next_check_at = NULL WHERE provider = 'stars' AND next_check_at IS NOT NULL"
+    ))
+
+
+# Упорядоченный список миграций: (версия, описание, функция, выполнять вне транзакции).
+# Вне транзакции выполняются миграции с построением индексов (CONCURRENTLY в PostgreSQL)
+MIGRATIONS = [
+    (1, "Базовая схема", create_base_schema, False),
+    (2, "Расписание фоновой проверки платежей", add_payment_check_schedule, False),
+    (3, "Индексы расписания проверки платежей", create_payment_check_indexes, True),
+    (4, "Индексы статусов платежей Stars и активности товаров", create_status_indexes, True),
+    (5, "Единый журнал платежей", create_ledger, False),
+    (6, "Outbox уведомлений", create_outbox, False),
+    (7, "Рассылки администратора", create_broadcasts, False),
+    (8, "Хранилище состояний FSM", create_fsm_states, False),
+    (9, "Дробные суммы платежей Crypto Pay", make_crypto_amount_fractional, False),
+    (10, "Позиции пользователей в каталоге", create_user_positions, False),
+    (11, "Платежи Stars без фоновой проверки", unschedule_stars_payments, False),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+async def get_schema_version(db_engine: AsyncEngine = engine) -> int:
+    """Текущая версия схемы (0 - база без таблицы версий)"""
+    async with db_engine.connect() as conn:
+        try:
+            return (await conn.execute(text("SELECT version FROM schema_version"))).scalar() or 0
+        except DBAPIError:
+            # Версия 0 только у базы без таблицы версий: ошибки подключения,
+            # прав доступа и прочие пробрасываются, а не запускают миграции заново
+            await conn.rollback()
+            if await conn.run_sync(lambda sync_conn: inspect(sync_conn).has_table("schema_version")):
+                raise
+            return 0
+
+
+async def _set_schema_version(conn: AsyncConnection, version: int) -> None:
+    await conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+    await conn.execute(text("DELETE FROM schema_version"))
+    await conn.execute(text("INSERT INTO schema_version (version) VALUES (:version)"), {"version": version})
+
+
+async def run_migrations(db_engine: AsyncEngine = engine) -> None:
+    """
+    Проверка схемы при запуске: применяет недостающие миграции по порядку.
+    Если миграций нет, выполняется единственный запрос версии схемы.
+    db_engine - база, к которой применяются миграции (по умолчанию база бота)
+    """
+    version = await get_schema_version(db_engine)
+    if version == LATEST_VERSION:
+        return
+    if version > LATEST_VERSION:
+        raise RuntimeError(f"Версия схемы БД {version} новее поддерживаемой {LATEST_VERSION}")
+
+    async with db_engine.connect() as lock_conn:
+        if db_engine.dialect.name == "postgresql":
+            await lock_conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATIONS_LOCK_ID})
+            await lock_conn.commit()
+            # Пока ждали блокировку, миграции мог применить другой процесс
+            version = await get_schema_version(db_engine)
+
+        try:
+            for number, description, migration, outside_transaction in MIGRATIONS:
+                if number <= version:
+                    continue
+
+                logger.info(f"Применение миграции {number}: {description}")
+                if outside_transaction:
+                    async with db_engine.connect() as conn:
+                        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+                        await migration(conn)
+                    async with db_engine.begin() as conn:
+                        await _set_schema_version(conn, number)
+                else:
+                    async with db_engine.begin() as conn:
+                        await migration(conn)
+                        await _set_schema_version(conn, number)
+        finally:
+            if db_engine.dialect.name == "postgresql":
+                await lock_conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATIONS_LOCK_ID})
+                await lock_conn.commit()
+
+    logger.info(f"Схема БД обновлена до версии {LATEST_VERSION}")
@@ -1,13 +1,73 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, BigInteger, ForeignKey, Text
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncAttrs
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, BigInteger, ForeignKey, Text, Index, Float, UniqueConstraint, event, or_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncAttrs, AsyncEngine
 from sqlalchemy.orm import DeclarativeBase, relationship
 from datetime import datetime
 
-# Настройка асинхронного подключения к SQLite3
-DB_URL = "sqlite+aiosqlite:///db/database.db"
-engine = create_async_engine(DB_URL)  # Асинхронный движок SQLAlchemy
+from config import (DB_URL, DB_READ_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE, DB_STATEMENT_CACHE_SIZE,
+                    SQLITE_SYNCHRONOUS, SQLITE_CACHE_SIZE_KB, SQLITE_MMAP_SIZE, SQLITE_BUSY_TIMEOUT, DB_READ_ENGINE)
+
+
+def apply_sqlite_pragmas(engine: AsyncEngine, read_only: bool = False) -> None:
+    """
+    Настраивает каждое новое соединение SQLite: журнал WAL (читатели не
+    блокируются писателем), synchronous, размер кэша страниц, отображение
+    файла в память и ожидание блокировки вместо немедленной ошибки
+    """
+    pragmas = [
+        "PRAGMA journal_mode=WAL",
+        f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}",
+        f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}",
+        f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",
+        f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}",
+        "PRAGMA temp_store=MEMORY",
+    ]
+    if read_only:
+        pragmas.append("PRAGMA query_only=ON")
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+def create_engine(url: str, read_only: bool = False) -> AsyncEngine:
+    """
+    Создает асинхронный движок под СУБД из url. Для PostgreSQL (asyncpg)
+    настраивается пул соединений с проверкой перед выдачей и кэш
+    подготовленных запросов, для SQLite - PRAGMA соединений
+    """
+    if url.startswith("postgresql"):
+        return create_async_engine(
+            url,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_pre_ping=True,
+            pool_recycle=DB_POOL_RECYCLE,
+            connect_args={"prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE}
+        )
+
+    sqlite_engine = create_async_engine(url)
+    apply_sqlite_pragmas(sqlite_engine, read_only=read_only)
+    return sqlite_engine
+
+
+# Настройка асинхронного подключения к базе данных
+engine = create_engine(DB_URL)  # Асинхронный движок SQLAlchemy
 Session = async_sessionmaker(expire_on_commit=False, bind=engine)  # Фабрика сессий
 
+# Отдельный движок для чтения: реплика PostgreSQL или, для SQLite, свой пул
+# соединений, который в режиме WAL читает параллельно с записью
+if DB_READ_URL:
+    read_engine = create_engine(DB_READ_URL, read_only=True)
+elif DB_READ_ENGINE and engine.dialect.name == "sqlite":
+    read_engine = create_engine(DB_URL, read_only=True)
+else:
+    read_engine = engine
+ReadSession = async_sessionmaker(expire_on_commit=False, bind=read_engine)  # Фабрика сессий только для чтения
+
 
 class Base(DeclarativeBase, AsyncAttrs):
     pass
@@ -33,9 +93,12 @@ class Product(Base):
     price = Column(Integer, nullable=False)  # цена в копейках/центах
     photo_file_id = Column(String(255), nullable=False)
     created_at = Column(DateTime, default=datetime.now)
-    is_active = Column(Boolean, default=True)
+    is_active = Column(Boolean, default=True, index=True)
 
 
+# Таблицы payments, stars_payments и crypto_payments оставлены для совместимости:
+# их данные перенесены миграцией в единый журнал платежей LedgerModel
+
 class PaymentModel(Base):
     __tablename__ = "payments"
 
@@ -46,17 +109,24 @@ class PaymentModel(Base):
     amount = Column(Integer, nullable=False)  # сумма в копейках
     created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    # Расписание фоновой проверки статуса (NULL - проверки прекращены)
+    next_check_at = Column(DateTime, default=datetime.now)
+    check_attempts = Column(Integer, nullable=False, default=0)
 
     # Связи
     user = relationship("User")
     product = relationship("Product")
 
+    __table_args__ = (
+        Index("ix_payments_status_next_check_at", "status", "next_check_at"),
+    )
+
 
 class StarsModel(Base):
     __tablename__ = "stars_payments"
 
     id = Column(String(255), primary_key=True)  # invoice_payload от Telegram
-    status = Column(String(20), nullable=False, default="pending")  # pending, canceled, succeeded
+    status = Column(String(20), nullable=False, default="pending", index=True)  # pending, canceled, succeeded
     user_id = Column(BigInteger, ForeignKey("users.user_id"), nullable=False)
     product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
     amount = Column(Integer, nullable=False)  # сумма в звездах
@@ -75,16 +145,132 @@ class CryptoModel(Base):
     status = Column(String(20), nullable=True, default="pending")
     user_id = Column(BigInteger, ForeignKey("users.user_id"), nullable=False)
     product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
-    amount = Column(Integer, nullable=False)
+    amount = Column(Float, nullable=False)  # сумма в USDT
     created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    # Расписание фоновой проверки статуса (NULL - проверки прекращены)
+    next_check_at = Column(DateTime, default=datetime.now)
+    check_attempts = Column(Integer, nullable=False, default=0)
 
     # Связи
     user = relationship("User")
     product = relationship("Product")
 
+    __table_args__ = (
+        Index("ix_crypto_payments_status_next_check_at", "status", "next_check_at"),
+    )
+
+
+class LedgerModel(Base):
+    """Единый журнал платежей всех платежных систем"""
+    __tablename__ = "ledger"
+
+    id = Column(Integer, primary_key=True)
+    provider = Column(String(20), nullable=False)  # yookassa, stars, crypto
+    external_id = Column(String(255), nullable=False)  # id платежа в платежной системе
+    status = Column(String(20), nullable=False, default="pending")  # pending, succeeded, canceled, expired
+    user_id = Column(BigInteger, ForeignKey("users.user_id"), nullable=False)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    amount = Column(Integer, nullable=False)  # сумма в минимальных единицах валюты (копейки, центы, звезды)
+    currency = Column(String(10), nullable=False)  # RUB, USDT, XTR
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    # Расписание фоновой проверки статуса (NULL - не проверяется)
+    next_check_at = Column(DateTime, default=datetime.now)
+    check_attempts = Column(Integer, nullable=False, default=0)
+
+    # Связи
+    user = relationship("User")
+    product = relationship("Product")
+
+    __table_args__ = (
+        UniqueConstraint("provider", "external_id", name="uq_ledger_provider_external_id"),
+        Index("ix_ledger_status_next_check_at", "status", "next_check_at"),
+        Index("ix_ledger_provider_status", "provider", "status"),
+    )
+
+
+class OutboxModel(Base):
+    """Исходящие уведомления, записанные в одной транзакции со сменой статуса платежа"""
+    __tablename__ = "outbox"
+
+    id = Column(Integer, primary_key=True)
+    key = Column(String(100), nullable=False, unique=True)  # ключ идемпотентности, например ledger:42:admin
+    chat_id = Column(BigInteger, nullable=False)
+    text = Column(Text, nullable=False)
+    reply_markup = Column(Text)  # JSON клавиатуры
+    priority = Column(Integer, nullable=False, default=0)  # очередь приоритета отправки
+    status = Column(String(20), nullable=False, default="pending")  # pending, sent, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.now)
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=datetime.now)
+    sent_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_outbox_status_next_attempt_at", "status", "next_attempt_at"),
+    )
+
+
+class BroadcastModel(Base):
+    """Рассылка администратора и ее прогресс (курсор по user_id)"""
+    __tablename__ = "broadcasts"
+
+    id = Column(Integer, primary_key=True)
+    admin_id = Column(BigInteger, nullable=False)  # кому отправлять отчеты
+    text = Column(Text, nullable=False)  # HTML
+    status = Column(String(20), nullable=False, default="running", index=True)  # running, done, canceled
+    last_user_id = Column(BigInteger, nullable=False, default=0)  # последний обработанный пользователь
+    total = Column(Integer, nullable=False, default=0)  # активных пользователей на момент запуска
+    sent = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    blocked = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    finished_at = Column(DateTime)
+
+
+class FsmStateModel(Base):
+    """Состояние FSM aiogram (мастер добавления товара, рассылка) по ключу чата и пользователя"""
+    __tablename__ = "fsm_states"
+
+    key = Column(String(255), primary_key=True)  # ключ DefaultKeyBuilder
+    state = Column(String(255))
+    data = Column(Text, nullable=False, default="{}")  # JSON
+    updated_at = Column(DateTime, default=datetime.now, nullable=False, index=True)
+
+
+class UserPosition(Base):
+    __tablename__ = "user_positions"
+
+    user_id = Column(BigInteger, primary_key=True)
+    product_id = Column(Integer, nullable=False)  # последний просмотренный товар
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+# Строк в одном INSERT, формируемом upsert (ограничение SQLite на число параметров запроса)
+UPSERT_CHUNK_SIZE = 500
+
 
+def upsert(table, rows: list, index_elements: list, update_columns: list, changed_only: bool = False):
+    """
+    Формирует INSERT ... ON CONFLICT DO UPDATE под диалект текущего движка.
 
-async def create_tables():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
\ No newline at end of file
+    rows - список словарей значений, index_elements - колонки уникального ключа,
+    update_columns - колонки, обновляемые при конфликте (пустой список -
+    существующая строка не меняется, ON CONFLICT DO NOTHING). changed_only -
+    обновлять строку, только если значение хотя бы одной из колонок
+    отличается (без лишней записи на диск, RETURNING такие строки не возвращает).
+    """
+    dialect = postgresql if engine.dialect.name == "postgresql" else sqlite
+    stmt = dialect.insert(table).values(rows)
+    if not update_columns:
+        return stmt.on_conflict_do_nothing(index_elements=index_elements)
+    where = None
+    if changed_only:
+        where = or_(*(table.c[column].is_distinct_from(stmt.excluded[column]) for column in update_columns))
+    return stmt.on_conflict_do_update(
+        index_elements=index_elements,
+        set_={column: stmt.excluded[column] for column in update_columns},
+        where=where
+    )
\ No newline at end of file
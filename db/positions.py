@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional
+
+from config import POSITIONS_CAPACITY, POSITIONS_TTL, POSITIONS_PERSIST, POSITIONS_MAX_DIRTY
+from db.models import Session, ReadSession, UserPosition, UPSERT_CHUNK_SIZE, upsert
+
+logger = logging.getLogger(__name__)
+
+class _Entry:
+    """Компактная запись позиции: без __dict__, два поля на пользователя"""
+    __slots__ = ("product_id", "touched_at")
+
+    def __init__(self, product_id: int, touched_at: float) -> None:
+        self.product_id = product_id
+        self.touched_at = touched_at
+
+
+class PositionBackend:
+    """Интерфейс постоянного хранилища позиций"""
+
+    async def load(self, user_id: int) -> Optional[int]:
+        raise NotImplementedError
+
+    async def save_many(self, positions: Dict[int, int]) -> None:
+        raise NotImplementedError
+
+
+class SqlPositionBackend(PositionBackend):
+    """Хранение позиций в таблице user_positions"""
+
+    async def load(self, user_id: int) -> Optional[int]:
+        async with ReadSession() as session:
+            position = await session.get(UserPosition, user_id)
+            return position.product_id if position else None
+
+    async def save_many(self, positions: Dict[int, int]) -> None:
+        now = datetime.now()
+        rows = [
+            {"user_id": user_id, "product_id": product_id, "updated_at": now}
+            for user_id, product_id in positions.items()
+        ]
+        async with Session() as session:
+            for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+                await session.execute(upsert(
+                    UserPosition.__table__, rows[start:start + UPSERT_CHUNK_SIZE],
+                    ["user_id"], ["product_id", "updated_at"]
+                ))
+            await session.commit()
+
+
+class PositionStore:
+    """
+    Ограниченное хранилище последних просмотренных товаров пользователей.
+
+    В памяти держится не более capacity записей с вытеснением давно
+    неиспользуемых (LRU) и истечением по TTL. Если задан backend, изменения
+    накапливаются и записываются пачкой в flush() (досрочно - при
+    накоплении max_dirty изменений), а промахи кэша дочитываются из backend
+    в фоне, поэтому позиции переживают перезапуск. Чтение никогда не ждет
+    БД: при промахе пользователь начинает с первого товара, а сохраненная
+    позиция подхватывается со следующего открытия каталога.
+    """
+
+    def __init__(self, capacity: int, ttl: float, backend: Optional[PositionBackend] = None,
+                 max_dirty: int = POSITIONS_MAX_DIRTY) -> None:
+        self.capacity = capacity
+        self.ttl = ttl
+        self.backend = backend
+        self.max_dirty = max_dirty
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._dirty: Dict[int, int] = {}
+        self._loading: set = set()  # пользователи, чья позиция дочитывается из backend
+        self._tasks: set = set()
+        self._flush_lock = asyncio.Lock()
+        self._forced_flush: Optional[asyncio.Task] = None
+
+        # Счетчики для мониторинга
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id: int) -> Optional[int]:
+        """Возвращает id последнего просмотренного товара или None (без ожидания БД)"""
+        now = time.monotonic()
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            if now - entry.touched_at <= self.ttl:
+                self._entries.move_to_end(user_id)
+                entry.touched_at = now
+                self.hits += 1
+                return entry.product_id
+            del self._entries[user_id]
+            self.evictions += 1
+
+        self.misses += 1
+        if self.backend is None:
+            return None
+
+        # Вытесненная, но еще не сохраненная позиция
+        product_id = self._dirty.get(user_id)
+        if product_id is not None:
+            self._put(user_id, product_id, now)
+            return product_id
+
+        if user_id not in self._loading:
+            self._loading.add(user_id)
+            task = asyncio.create_task(self._load(user_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return None
+
+    async def _load(self, user_id: int) -> None:
+        try:
+            product_id = await self.backend.load(user_id)
+        except Exception as e:
+            logger.error(f"Ошибка чтения позиции пользователя {user_id}: {e}")
+            return
+        finally:
+            self._loading.discard(user_id)
+        # Пока шло чтение, пользователь мог уже перейти к другому товару
+        if product_id is not None and user_id not in self._entries:
+            self._put(user_id, product_id, time.monotonic())
+
+    def set(self, user_id: int, product_id: int) -> None:
+        """Запоминает позицию пользователя (без обращения к БД)"""
+        self._put(user_id, product_id, time.monotonic())
+        if self.backend is not None:
+            self._dirty[user_id] = product_id
+            if len(self._dirty) >= self.max_dirty and (self._forced_flush is None or self._forced_flush.done()):
+                self._forced_flush = asyncio.create_task(self.flush())
+
+    def _put(self, user_id: int, product_id: int, now: float) -> None:
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            entry.product_id = product_id
+            entry.touched_at = now
+            self._entries.move_to_end(user_id)
+            return
+
+        self._entries[user_id] = _Entry(product_id, now)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def purge_expired(self) -> int:
+        """Удаляет записи с истекшим TTL, возвращает их количество"""
+        deadline = time.monotonic() - self.ttl
+        removed = 0
+        # Записи упорядочены по времени использования, старые - в начале
+        while self._entries:
+            user_id, entry = next(iter(self._entries.items()))
+            if entry.touched_at > deadline:
+                break
+            del self._entries[user_id]
+            removed += 1
+        self.evictions += removed
+        return removed
+
+    async def flush(self) -> None:
+        """Записывает накопленные изменения в backend одной транзакцией"""
+        if self.backend is None:
+            return
+
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, {}
+            try:
+                await self.backend.save_many(dirty)
+            except Exception as e:
+                # Возвращаем изменения, не перетирая более свежие позиции и не
+                # превышая max_dirty: позиции - некритичные данные
+                lost = 0
+                for user_id, product_id in dirty.items():
+                    if user_id in self._dirty:
+                        continue
+                    if len(self._dirty) >= self.max_dirty:
+                        lost += 1
+                        continue
+                    self._dirty[user_id] = product_id
+                logger.error(f"Ошибка сохранения позиций пользователей: {e}, потеряно позиций: {lost}")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "dirty": len(self._dirty),
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# Общее для процесса хранилище позиций в каталоге
+positions = PositionStore(
+    capacity=POSITIONS_CAPACITY,
+    ttl=POSITIONS_TTL,
+    backend=SqlPositionBackend() if POSITIONS_PERSIST else None
+)
@@ -0,0 +1,120 @@
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from aiogram.types import User as TelegramUser
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import KNOWN_USERS_CAPACITY
+from db.models import User, UPSERT_CHUNK_SIZE, upsert
+from db.write_behind import write_behind
+
+logger = logging.getLogger(__name__)
+
+Profile = Tuple[Optional[str], Optional[str], Optional[str]]  # username, first_name, last_name
+
+
+class KnownUsers:
+    """
+    Пользователи, уже записанные в БД с актуальными данными профиля.
+
+    Хранит не более capacity записей user_id -> профиль с вытеснением давно
+    не заходивших (LRU). Пользователь с тем же профилем не требует запроса
+    к БД; смена имени или username считается промахом и обновляет строку.
+    """
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self._profiles: "OrderedDict[int, Profile]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def is_known(self, user_id: int, profile: Profile) -> bool:
+        if self._profiles.get(user_id) == profile:
+            self._profiles.move_to_end(user_id)
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def add(self, user_id: int, profile: Profile) -> None:
+        self._profiles[user_id] = profile
+        self._profiles.move_to_end(user_id)
+        while len(self._profiles) > self.capacity:
+            self._profiles.popitem(last=False)
+
+    def discard(self, user_ids: Iterable[int]) -> None:
+        """Забывает пользователей, чья строка изменилась в обход кэша (например, is_active=False)"""
+        for user_id in user_ids:
+            self._profiles.pop(user_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._profiles), "hits": self.hits, "misses": self.misses}
+
+
+async def register_user(user_id: int, username: Optional[str], first_name: Optional[str],
+                        last_name: Optional[str]) -> None:
+    """
+    Регистрирует пользователя или обновляет его профиль.
+
+    Повторный /start с тем же профилем отвечается из кэша без обращения к
+    БД, остальные ставятся в отложенную запись (write_behind) и
+    записываются пачкой. В кэш пользователь попадает только после коммита
+    пачки: если запись не удалась, следующий /start повторит регистрацию
+    (от строки users зависят платежи пользователя).
+    """
+    profile = (username, first_name, last_name)
+    if known_users.is_known(user_id, profile):
+        return
+    await write_behind.put("users", user_id, {"user_id": user_id, "username": username, "first_name": first_name,
+                                              "last_name": last_name, "is_active": True,
+                                              "created_at": datetime.now()})
+
+
+async def ensure_user(session: AsyncSession, user: TelegramUser) -> None:
+    """
+    Создает строку пользователя в транзакции session, если ее еще нет.
+    Вызывается перед записью платежа (ledger.user_id ссылается на users):
+    регистрация пользователя может еще ждать в отложенной записи или быть
+    отброшена после неудачных попыток. Существующая строка не меняется
+    """
+    await session.execute(upsert(User.__table__, [{
+        "user_id": user.id, "username": user.username, "first_name": user.first_name,
+        "last_name": user.last_name, "is_active": True, "created_at": datetime.now()
+    }], ["user_id"], []))
+
+
+async def save_users(session: AsyncSession, rows: List[dict]) -> None:
+    """
+    Пачка регистраций: INSERT ... ON CONFLICT DO UPDATE. Существующая строка
+    обновляется, только если изменился профиль или пользователь был отмечен
+    неактивным (заблокировал бота): после /start он снова получает рассылки
+    """
+    created = {row["user_id"]: row["created_at"] for row in rows}
+    new_users = 0
+    for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        result = await session.execute(
+            upsert(User.__table__, rows[start:start + UPSERT_CHUNK_SIZE],
+                   ["user_id"], ["username", "first_name", "last_name", "is_active"], changed_only=True)
+            .returning(User.user_id, User.created_at)
+        )
+        # created_at вставленной строки совпадает с переданным, у обновленной - дата регистрации
+        new_users += sum(1 for row in result.fetchall() if row.created_at == created[row.user_id])
+    if new_users:
+        logger.info(f"Зарегистрировано новых пользователей: {new_users}")
+
+
+def users_saved(rows: List[dict]) -> None:
+    for row in rows:
+        known_users.add(row["user_id"], (row["username"], row["first_name"], row["last_name"]))
+
+
+def users_dropped(rows: List[dict]) -> None:
+    known_users.discard(row["user_id"] for row in rows)
+
+
+write_behind.register("users", save_users, committed=users_saved, dropped=users_dropped)
+
+# Общий для процесса кэш зарегистрированных пользователей
+known_users = KnownUsers(KNOWN_USERS_CAPACITY)
@@ -0,0 +1,196 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import WRITE_BEHIND_INTERVAL_MS, WRITE_BEHIND_MAX_ROWS, WRITE_BEHIND_MAX_PENDING, WRITE_BEHIND_RETRIES
+from db.models import Session
+
+logger = logging.getLogger(__name__)
+
+FlushFunction = Callable[[AsyncSession, List[dict]], Awaitable[None]]
+RowsCallback = Callable[[List[dict]], None]
+
+
+class WriteBehindBuffer:
+    """
+    Отложенная запись некритичных данных с групповым коммитом.
+
+    Обработчики кладут строки в буфер и не ждут БД; фоновая задача раз в
+    interval_ms (или сразу при накоплении max_rows строк) записывает все
+    накопленное - вместо отдельного коммита на каждый апдейт. Каждый вид
+    строк пишется своей транзакцией: ошибка в строках одного вида не
+    откатывает и не отбрасывает остальные. Строки с одинаковым ключом в
+    пределах пачки схлопываются (остается последняя). Если в буфере
+    max_pending строк, put ждет записи (back-pressure), при остановке бота
+    буфер дописывается в close().
+
+    Подходит только для данных, потерю которых за последние interval_ms при
+    аварийном завершении можно пережить: изменения статусов платежей
+    записываются синхронно в своих транзакциях.
+    """
+
+    def __init__(self, interval_ms: float = WRITE_BEHIND_INTERVAL_MS, max_rows: int = WRITE_BEHIND_MAX_ROWS,
+                 max_pending: int = WRITE_BEHIND_MAX_PENDING, retries: int = WRITE_BEHIND_RETRIES) -> None:
+        self.interval = interval_ms / 1000
+        self.max_rows = max_rows
+        self.max_pending = max_pending
+        self.retries = retries
+        self._writers: Dict[str, FlushFunction] = {}
+        self._committed: Dict[str, Optional[RowsCallback]] = {}
+        self._dropped: Dict[str, Optional[RowsCallback]] = {}
+        self._buffers: Dict[str, Dict[Hashable, dict]] = {}
+        self._inflight: Dict[str, List[Dict[Hashable, dict]]] = {}  # пачки, которые пишутся сейчас (до коммита)
+        self._pending = 0
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self._failures: Counter = Counter()  # вид -> неудачных попыток подряд
+        self.flushes = 0
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.retries_by_kind: Counter = Counter()
+        self.dropped_by_kind: Counter = Counter()
+        self.waits = 0
+        self.last_flush_ms = 0.0
+
+    def register(self, kind: str, flush: FlushFunction, committed: Optional[RowsCallback] = None,
+                 dropped: Optional[RowsCallback] = None) -> None:
+        """
+        flush(session, rows) записывает пачку строк вида kind в транзакции
+        session. committed(rows) вызывается после коммита пачки,
+        dropped(rows) - если пачка отброшена после всех попыток
+        """
+        self._writers[kind] = flush
+        self._committed[kind] = committed
+        self._dropped[kind] = dropped
+        self._buffers[kind] = {}
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def put(self, kind: str, key: Hashable, row: dict) -> None:
+        """Ставит строку в очередь на запись; ждет, только если буфер переполнен"""
+        self.start()
+        while self._pending >= self.max_pending:
+            self.waits += 1
+            self._space.clear()
+            self._wakeup.set()
+            await self._space.wait()
+
+        buffer = self._buffers[kind]
+        if key not in buffer:
+            self._pending += 1
+        buffer[key] = row
+        if self._pending >= self.max_rows:
+            self._wakeup.set()
+
+    def pending_row(self, kind: str, key: Hashable) -> Optional[dict]:
+        """
+        Строка, ожидающая записи или записываемая сейчас (для чтения своих еще
+        не закоммиченных изменений)
+        """
+        row = self._buffers[kind].get(key)
+        if row is None:
+            for buffer in reversed(self._inflight.get(kind, ())):
+                row = buffer.get(key)
+                if row is not None:
+                    break
+        return row
+
+    async def _run(self) -> None:
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Записывает все накопленные строки: каждый вид - одной транзакцией"""
+        if not self._pending:
+            return
+        batches = {kind: buffer for kind, buffer in self._buffers.items() if buffer}
+        self._buffers = {kind: {} for kind in self._writers}
+        self._pending = 0
+        self._space.set()
+
+        started = time.perf_counter()
+        written = 0
+        for kind, buffer in batches.items():
+            written += await self._flush_kind(kind, buffer)
+        if written:
+            self.flushes += 1
+            self.rows_written += written
+            self.last_flush_ms = round((time.perf_counter() - started) * 1000, 1)
+
+    async def _flush_kind(self, kind: str, buffer: Dict[Hashable, dict]) -> int:
+        """Пишет пачку одного вида, возвращает число записанных строк"""
+        rows = list(buffer.values())
+        inflight = self._inflight.setdefault(kind, [])
+        inflight.append(buffer)
+        try:
+            async with Session() as session:
+                await self._writers[kind](session, rows)
+                await session.commit()
+        except Exception as e:
+            self._failures[kind] += 1
+            if self._failures[kind] > self.retries:
+                self._failures[kind] = 0
+                self.rows_dropped += len(rows)
+                self.dropped_by_kind[kind] += len(rows)
+                logger.error(f"Отложенная запись {kind}: пачка из {len(rows)} строк отброшена после "
+                             f"{self.retries + 1} попыток: {e}")
+                if self._dropped[kind] is not None:
+                    self._dropped[kind](rows)
+                return 0
+            self.retries_by_kind[kind] += 1
+            # Возвращаем строки в буфер, не перетирая более свежие
+            for key, row in buffer.items():
+                if key not in self._buffers[kind]:
+                    self._buffers[kind][key] = row
+                    self._pending += 1
+            logger.warning(f"Ошибка отложенной записи {kind} ({len(rows)} строк), повтор: {e}")
+            return 0
+        finally:
+            inflight.remove(buffer)
+
+        self._failures[kind] = 0
+        if self._committed[kind] is not None:
+            self._committed[kind](rows)
+        return len(rows)
+
+    async def close(self) -> None:
+        """Останавливает фоновую запись (текущая пачка дописывается) и записывает остаток буфера"""
+        if self._task is not None:
+            self._closing = True
+            self._wakeup.set()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for _ in range(self.retries + 1):
+            await self.flush()
+            if not self._pending:
+                break
+        logger.info(f"Отложенная запись: {self.stats()}")
+
+    def stats(self) -> dict:
+        return {
+            "pending": self._pending,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "rows_dropped": self.rows_dropped,
+            "waits": self.waits,
+            "last_flush_ms": self.last_flush_ms,
+            "retries_by_kind": dict(self.retries_by_kind),
+            "dropped_by_kind": dict(self.dropped_by_kind),
+        }
+
+
+# Общий для процесса буфер отложенной записи
+write_behind = WriteBehindBuffer()
@@ -1,12 +1,15 @@
 import logging
 from aiogram import Router, F
-from aiogram.types import Message, ReplyKeyboardRemove
-from aiogram.filters import Command, StateFilter
+from aiogram.types import Message, CallbackQuery, ReplyKeyboardRemove
+from aiogram.filters import Command, CommandObject, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
+from db.catalog import catalog
 from db.models import Session, Product
 from config import ADMIN_IDS
+from keyboard import create_kb
+from services.broadcast import start_broadcast, cancel_broadcast
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -19,6 +22,11 @@ class AddProduct(StatesGroup):
     photo = State()
 
 
+class Broadcast(StatesGroup):
+    text = State()
+    confirm = State()
+
+
 @router.message(Command("add"))
 async def cmd_add(message: Message, state: FSMContext):
     if message.from_user.id not in ADMIN_IDS:
@@ -75,6 +83,9 @@ async def process_photo(message: Message, state: FSMContext):
         session.add(product)
         await session.commit()
 
+    # Перестраиваем кэш каталога, чтобы новый товар сразу стал виден покупателям
+    await catalog.invalidate()
+
     await message.answer_photo(
         photo_file_id,
         caption=f"✅ Товар успешно добавлен!\n\n"
@@ -87,4 +98,62 @@ async def process_photo(message: Message, state: FSMContext):
 
 @router.message(StateFilter(AddProduct.photo))
 async def process_photo_invalid(message: Message, state: FSMContext):
-    await message.answer("❌ Пожалуйста, отправьте фото товара:")
\ No newline at end of file
+    await message.answer("❌ Пожалуйста, отправьте фото товара:")
+
+
+@router.message(Command("broadcast"))
+async def cmd_broadcast(message: Message, state: FSMContext):
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("⛔ У вас нет прав для выполнения этой команды")
+        return
+
+    await message.answer("📣 Введите текст рассылки для всех пользователей:")
+    await state.set_state(Broadcast.text)
+
+
+@router.message(StateFilter(Broadcast.text), F.text)
+async def process_broadcast_text(message: Message, state: FSMContext):
+    # Текст сохраняется в HTML, чтобы рассылка сохранила форматирование
+    await state.update_data(text=message.html_text)
+    await message.answer(
+        f"Предпросмотр рассылки:\n\n{message.html_text}",
+        parse_mode="HTML",
+        reply_markup=create_kb(2, broadcast_confirm="✅ Отправить", broadcast_cancel="❌ Отмена")
+    )
+    await state.set_state(Broadcast.confirm)
+
+
+@router.message(StateFilter(Broadcast.text))
+async def process_broadcast_text_invalid(message: Message, state: FSMContext):
+    await message.answer("❌ Пожалуйста, отправьте текст рассылки:")
+
+
+@router.callback_query(StateFilter(Broadcast.confirm), F.data.in_({"broadcast_confirm", "broadcast_cancel"}))
+async def process_broadcast_confirm(callback: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    await state.clear()
+    if callback.data == "broadcast_cancel":
+        await callback.message.edit_text("❌ Рассылка отменена")
+        return
+
+    broadcast = await start_broadcast(callback.from_user.id, data['text'])
+    await callback.message.edit_text(
+        f"🚀 Рассылка #{broadcast.id} запущена: {broadcast.total} получателей.\n"
+        f"Отчеты о ходе будут приходить сюда. Остановить: /stop_broadcast {broadcast.id}"
+    )
+
+
+@router.message(Command("stop_broadcast"))
+async def cmd_stop_broadcast(message: Message, command: CommandObject):
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("⛔ У вас нет прав для выполнения этой команды")
+        return
+
+    if not command.args or not command.args.strip().isdigit():
+        await message.answer("Использование: /stop_broadcast <номер рассылки>")
+        return
+
+    if await cancel_broadcast(int(command.args)):
+        await message.answer("⏹ Рассылка остановлена")
+    else:
+        await message.answer("❌ Рассылка не найдена или уже завершена")
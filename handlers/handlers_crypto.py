@@ -3,28 +3,26 @@ import uuid
 
 from aiogram import Router, F
 from aiogram.types import CallbackQuery
-from aiocryptopay import AioCryptoPay, Networks
 
-from bot import bot
-from config import CRYPTO_PAY_API_KEY
-from db.models import Session, Product, CryptoModel
+from db.models import Session, Product, LedgerModel
+from db.users import ensure_user
 from keyboard import create_kb
+from services.bot_context import bot_context
+from services.crypto_client import crypto
+from services.metrics import provider_call
+from services.payments import finalize_payment
+from services.providers import PROVIDERS
 
 logger = logging.getLogger(__name__)
 router = Router()
 
-# Инициализация Crypto Pay
-crypto = AioCryptoPay(CRYPTO_PAY_API_KEY, network=Networks.MAIN_NET)
-
 
 @router.callback_query(F.data.startswith("cryptobot_"))
 async def process_cryptobot(callback: CallbackQuery):
     product_id = int(callback.data.split('_')[1])
     try:
         asset = "USDT"
-        bot_info = await bot.get_me()
-        username = bot_info.username
-        bot_link = f"https://t.me/{username}"
+        bot_link = bot_context.link
 
         async with Session() as session:
             # Получаем информацию о товаре
@@ -37,25 +35,29 @@ async def process_cryptobot(callback: CallbackQuery):
             crypto_amount = float(f"{product.price / 8500:.2f}")
 
             # Создаем счет в Crypto Pay
-            invoice = await crypto.create_invoice(
-                asset=asset,
-                amount=crypto_amount,
-                description="Покупка в боте услуги",
-                hidden_message="Спасибо за оплату!",
-                paid_btn_name="openBot",
-                paid_btn_url=bot_link,
-                payload=str(uuid.uuid4()),
-                expires_in=900
-            )
+            async with provider_call("crypto", "create_invoice"):
+                invoice = await crypto.create_invoice(
+                    asset=asset,
+                    amount=crypto_amount,
+                    description="Покупка в боте услуги",
+                    hidden_message="Спасибо за оплату!",
+                    paid_btn_name="openBot",
+                    paid_btn_url=bot_link,
+                    payload=str(uuid.uuid4()),
+                    expires_in=900
+                )
 
             # Сохраняем запись в базе данных
-            crypto_payment = CryptoModel(
-                id=invoice.invoice_id,
+            crypto_payment = LedgerModel(
+                provider="crypto",
+                external_id=str(invoice.invoice_id),
                 user_id=callback.from_user.id,
                 product_id=product_id,
-                amount=crypto_amount,
-                status="active"
+                amount=round(crypto_amount * 100),  # в центах
+                currency=asset,
+                status="pending"
             )
+            await ensure_user(session, callback.from_user)
             session.add(crypto_payment)
             await session.commit()
 
@@ -91,59 +93,42 @@ async def check_crypto_payment(callback: CallbackQuery):
     payment_id = callback.data.split('___')[1]
 
     async with Session() as session:
-        # Находим платеж в базе
-        crypto_payment = await session.get(CryptoModel, payment_id)
-        if not crypto_payment:
-            await callback.answer("❌ Платеж не найден", show_alert=True)
-            return
-
-        # Проверяем статус в Crypto Pay
-        try:
-            invoices = await crypto.get_invoices(invoice_ids=payment_id)
-            if not invoices:
-                await callback.answer("❌ Платеж не найден в системе", show_alert=True)
-                return
-
-            invoice = invoices[0]
-
-            if invoice.status == 'paid':
-                # Обновляем статус платежа
-                crypto_payment.status = "paid"
-
-                # Получаем информацию о товаре
-                product = await session.get(Product, crypto_payment.product_id)
-
-                await session.commit()
-
-                # Уведомляем пользователя
-                await callback.message.edit_text(
-                    f'''✅ Платеж прошел успешно!
-
-📦 Товар: {product.name}
-💰 Сумма: {crypto_payment.amount} USDT
-
-👨‍💻 Контакты разработчика: @AltiBalti, в ближайшее время он с Вами свяжется для уточнения деталей''',
-                    reply_markup=create_kb(1, view_products='В главное меню')
-                )
+        # Находим платеж в журнале
+        result = await session.execute(
+            LedgerModel.__table__.select()
+            .where(LedgerModel.provider == "crypto", LedgerModel.external_id == payment_id)
+        )
+        crypto_payment = result.fetchone()
+    if not crypto_payment:
+        await callback.answer("❌ Платеж не найден", show_alert=True)
+        return
+    if crypto_payment.status == 'succeeded':
+        await callback.answer('✅ Платеж уже подтвержден', show_alert=True)
+        return
+
+    # Проверяем статус в Crypto Pay
+    try:
+        status = await PROVIDERS["crypto"].fetch_status(payment_id)
+    except Exception as e:
+        logging.error(f"Ошибка запроса статуса крипто-платежа {payment_id}: {e}")
+        await callback.answer('⏳ Не удалось проверить оплату, попробуйте позже', show_alert=True)
+        return
+    if status is None:
+        await callback.answer("❌ Платеж не найден в системе", show_alert=True)
+        return
 
-                # Уведомляем администратора
-                admin_message = (
-                    f"🛒 Новый заказ через Crypto Pay!\n"
-                    f"👤 Пользователь: {callback.from_user.username} (ID: {callback.from_user.id})\n"
-                    f"📦 Товар: {product.name}\n"
-                    f"💰 Сумма: {crypto_payment.amount} USDT\n"
-                    f"🆔 ID платежа: {payment_id}"
-                )
-                await bot.send_message(1012882762, admin_message)
+    try:
+        if status == 'succeeded':
+            if not await finalize_payment("crypto", payment_id, status, edit_message=callback.message):
+                await callback.answer('✅ Платеж уже подтвержден', show_alert=True)
 
-            elif invoice.status in ['expired', 'failed']:
-                crypto_payment.status = invoice.status
-                await session.commit()
-                await callback.answer('❌ Платеж отменен или просрочен', show_alert=True)
+        elif status in ('expired', 'canceled'):
+            await finalize_payment("crypto", payment_id, status)
+            await callback.answer('❌ Платеж отменен или просрочен', show_alert=True)
 
-            else:
-                await callback.answer('⏳ Оплата еще не прошла или возникла ошибка', show_alert=True)
+        else:
+            await callback.answer('⏳ Оплата еще не прошла или возникла ошибка', show_alert=True)
 
-        except Exception as e:
-            logging.error(f"Ошибка проверки крипто-платежа: {e}")
-            await callback.answer('❌ Ошибка при проверке платежа', show_alert=True)
+    except Exception as e:
+        logging.error(f"Ошибка проверки крипто-платежа: {e}")
+        await callback.answer('❌ Ошибка при проверке платежа', show_alert=True)
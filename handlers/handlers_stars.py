@@ -6,8 +6,9 @@ from aiogram.types import CallbackQuery, LabeledPrice, PreCheckoutQuery, Message
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from bot import bot
-from db.models import Session, StarsModel, Product
-from keyboard import create_kb
+from db.models import Session, LedgerModel, Product
+from db.users import ensure_user
+from services.payments import finalize_payment
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -21,7 +22,7 @@ def payment_keyboard(value):
 
 @router.callback_query(F.data.startswith("stars_"))
 async def process_stars(callback: CallbackQuery):
-    product_id = callback.data.split('_')[1]
+    product_id = int(callback.data.split('_')[1])
 
     async with Session() as session:
         # Получаем информацию о товаре
@@ -32,13 +33,17 @@ async def process_stars(callback: CallbackQuery):
 
         # Создаем запись о платеже в базе
         stars_payment_id = str(uuid.uuid4())
-        stars_payment = StarsModel(
-            id=stars_payment_id,
+        stars_payment = LedgerModel(
+            provider="stars",
+            external_id=stars_payment_id,
             user_id=callback.from_user.id,
             product_id=product.id,
             amount=product.price // 200,  # сумма в звездах (предполагаем 1 звезда = 1 рубль)
-            status="pending"
+            currency="XTR",
+            status="pending",
+            next_check_at=None  # оплату подтверждает сам Telegram, фоновая проверка не нужна
         )
+        await ensure_user(session, callback.from_user)
         session.add(stars_payment)
         await session.commit()
 
@@ -63,16 +68,21 @@ async def process_stars(callback: CallbackQuery):
 
 @router.pre_checkout_query()
 async def pre_checkout_handler(pre_checkout_query: PreCheckoutQuery):
-    # Проверяем наличие платежа в базе
+    # Проверяем наличие платежа в журнале
     async with Session() as session:
-        payment = await session.get(StarsModel, pre_checkout_query.invoice_payload)
-        if not payment:
-            await pre_checkout_query.answer(ok=False, error_message="Платеж не найден")
-            return
+        result = await session.execute(
+            LedgerModel.__table__.select()
+            .where(LedgerModel.provider == "stars",
+                   LedgerModel.external_id == pre_checkout_query.invoice_payload)
+        )
+        payment = result.fetchone()
+    if not payment:
+        await pre_checkout_query.answer(ok=False, error_message="Платеж не найден")
+        return
 
-        if payment.status != "pending":
-            await pre_checkout_query.answer(ok=False, error_message="Платеж уже обработан")
-            return
+    if payment.status != "pending":
+        await pre_checkout_query.answer(ok=False, error_message="Платеж уже обработан")
+        return
 
     await pre_checkout_query.answer(ok=True)
 
@@ -81,39 +91,7 @@ async def pre_checkout_handler(pre_checkout_query: PreCheckoutQuery):
 async def success_payment_handler(msg: Message):
     payment_payload = msg.successful_payment.invoice_payload
 
-    async with Session() as session:
-        # Находим платеж в базе
-        stars_payment = await session.get(StarsModel, payment_payload)
-        if not stars_payment:
-            logger.error(f"Платеж Stars не найден: {payment_payload}")
-            await msg.answer("❌ Ошибка при обработке платежа")
-            return
-
-        # Обновляем статус платежа
-        stars_payment.status = "succeeded"
-
-        # Получаем информацию о товаре
-        product = await session.get(Product, stars_payment.product_id)
-
-        await session.commit()
-
-    # Уведомляем пользователя
-    await msg.answer(
-        f'''✅ Платеж прошел успешно!
-
-📦 Товар: {product.name}
-💰 Сумма: {stars_payment.amount} ⭐️
-
-👨‍💻 Контакты разработчика: @AltiBalti, в ближайшее время он с Вами свяжется для уточнения деталей''',
-        reply_markup=create_kb(1, view_products='В главное меню')
-    )
-
-    # Уведомляем администратора
-    admin_message = (
-        f"🛒 Новый заказ через Stars!\n"
-        f"👤 Пользователь: {msg.from_user.username} (ID: {msg.from_user.id})\n"
-        f"📦 Товар: {product.name}\n"
-        f"💰 Сумма: {stars_payment.amount} ⭐️\n"
-        f"🆔 ID платежа: {payment_payload}"
-    )
-    await bot.send_message(1012882762, admin_message)
+    # Уведомления пользователю и администратору отправляются при финализации
+    if not await finalize_payment("stars", payment_payload, "succeeded"):
+        logger.error(f"Платеж Stars не найден или уже обработан: {payment_payload}")
+        await msg.answer("❌ Ошибка при обработке платежа")
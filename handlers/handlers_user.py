@@ -6,31 +6,20 @@ from aiogram.filters import Command
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from bot import bot
-from db.models import Session, User, Product
+from db.catalog import catalog
+from db.positions import positions
+from db.users import register_user
 from keyboard import create_kb
 
 logger = logging.getLogger(__name__)
 router = Router()
 
-# Кэш для хранения текущих позиций пользователей
-user_positions = {}
-
 
 @router.message(Command("start"))
 async def cmd_start(message: Message):
-    # Регистрируем пользователя в БД
-    async with Session() as session:
-        user = await session.get(User, message.from_user.id)
-        if not user:
-            user = User(
-                user_id=message.from_user.id,
-                username=message.from_user.username,
-                first_name=message.from_user.first_name,
-                last_name=message.from_user.last_name
-            )
-            session.add(user)
-            await session.commit()
-            logger.info(f"Зарегистрирован новый пользователь: {message.from_user.id}")
+    # Регистрируем пользователя в БД (повторный /start - без запроса к БД)
+    await register_user(message.from_user.id, message.from_user.username,
+                        message.from_user.first_name, message.from_user.last_name)
 
     # Создаем клавиатуру
     builder = InlineKeyboardBuilder()
@@ -46,46 +35,32 @@ async def cmd_start(message: Message):
 
 @router.callback_query(F.data == "view_products")
 async def view_products(callback: CallbackQuery):
-    async with Session() as session:
-        products = await session.execute(
-            Product.__table__.select().where(Product.is_active == True)
-        )
-        products = products.fetchall()
+    # Возвращаем пользователя к последнему просмотренному товару
+    last_product_id = positions.get(callback.from_user.id)
+    product = catalog.get(last_product_id) or catalog.first()
 
-    if not products:
+    if not product:
         await callback.message.edit_text(
             "😔 В настоящий момент товаров нет в наличии.\n"
             "Пожалуйста, проверьте позже! 🔄"
         )
         return
 
-    # Сохраняем позицию пользователя
-    user_positions[callback.from_user.id] = 0
-    await show_product(callback.from_user.id, callback.message, 0)
-
-
-async def show_product(user_id: int, message: Message, product_index: int):
-    async with Session() as session:
-        products = await session.execute(
-            Product.__table__.select().where(Product.is_active == True)
-        )
-        products = products.fetchall()
-
-    if not products:
-        await message.edit_text("😔 Товары временно недоступны")
-        return
+    await show_product(callback.message, product)
 
-    product = products[product_index]
 
+async def show_product(message: Message, product):
     # Создаем клавиатуру
     builder = InlineKeyboardBuilder()
     builder.button(text="🛒 Купить", callback_data=f"buy_{product.id}")
 
-    # Добавляем кнопки навигации если товаров больше 1
-    if len(products) > 1:
+    # Добавляем кнопки навигации если товаров больше 1.
+    # id текущего товара передается в callback-данных, поэтому позицию
+    # пользователя не нужно хранить на сервере
+    if len(catalog) > 1:
         builder.row()
-        builder.button(text="◀️ Назад", callback_data="prev_product")
-        builder.button(text="Вперед ▶️", callback_data="next_product")
+        builder.button(text="◀️ Назад", callback_data=f"prev_product_{product.id}")
+        builder.button(text="Вперед ▶️", callback_data=f"next_product_{product.id}")
         builder.adjust(1, 2)
 
     caption = (f"📦 {product.name}\n\n"
@@ -115,47 +90,37 @@ async def show_product(user_id: int, message: Message, product_index: int):
         await message.delete()
 
 
-@router.callback_query(F.data == "next_product")
-async def next_product(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    current_position = user_positions.get(user_id, 0)
+def _current_product_id(data: str):
+    """id товара из callback-данных навигации (None для кнопок старого формата без id)"""
+    parts = data.split('_')
+    return int(parts[2]) if len(parts) > 2 else None
 
-    async with Session() as session:
-        products = await session.execute(
-            Product.__table__.select().where(Product.is_active == True)
-        )
-        products = products.fetchall()
 
-    if not products:
+@router.callback_query(F.data.startswith("next_product"))
+async def next_product(callback: CallbackQuery):
+    current_id = _current_product_id(callback.data)
+    product = catalog.next_after(current_id) if current_id is not None else catalog.first()
+
+    if not product:
         await callback.answer("😔 Товаров нет", show_alert=True)
         return
 
-    new_position = (current_position + 1) % len(products)
-    user_positions[user_id] = new_position
-
-    await show_product(user_id, callback.message, new_position)
+    positions.set(callback.from_user.id, product.id)
+    await show_product(callback.message, product)
     await callback.answer()
 
 
-@router.callback_query(F.data == "prev_product")
+@router.callback_query(F.data.startswith("prev_product"))
 async def prev_product(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    current_position = user_positions.get(user_id, 0)
-
-    async with Session() as session:
-        products = await session.execute(
-            Product.__table__.select().where(Product.is_active == True)
-        )
-        products = products.fetchall()
+    current_id = _current_product_id(callback.data)
+    product = catalog.prev_before(current_id) if current_id is not None else catalog.first()
 
-    if not products:
+    if not product:
         await callback.answer("😔 Товаров нет", show_alert=True)
         return
 
-    new_position = (current_position - 1) % len(products)
-    user_positions[user_id] = new_position
-
-    await show_product(user_id, callback.message, new_position)
+    positions.set(callback.from_user.id, product.id)
+    await show_product(callback.message, product)
     await callback.answer()
 
 
@@ -3,11 +3,14 @@ import uuid
 
 from aiogram import Router, F
 from aiogram.types import CallbackQuery
-from yookassa import Payment
 
-from bot import bot
-from db.models import Session, PaymentModel, Product
+from db.models import Session, LedgerModel, Product
+from db.users import ensure_user
 from keyboard import create_kb
+from services.bot_context import bot_context
+from services.payments import finalize_payment
+from services.providers import PROVIDERS
+from services.yookassa_client import yookassa, REQUEST_ERRORS
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -27,33 +30,40 @@ async def process_yookassa(callback: CallbackQuery):
         payment_uuid = str(uuid.uuid4())
 
         # Создаем платеж в YooKassa
-        bot_info = await bot.get_me()
-        username = bot_info.username
-        bot_link = f"https://t.me/{username}"
-
-        yookassa_payment = Payment.create({
-            "amount": {
-                "value": f"{product.price / 100:.2f}",
-                "currency": "RUB"
-            },
-            "confirmation": {
-                "type": "redirect",
-                "return_url": bot_link
-            },
-            "capture": True,
-            "metadata": {
-                "user_id": callback.from_user.id,
-                "product_id": product_id
-            },
-            "description": product.name
-        }, payment_uuid)
-        payment_record = PaymentModel(
-            id=yookassa_payment.id,
+        bot_link = bot_context.link
+
+        try:
+            yookassa_payment = await yookassa.create_payment({
+                "amount": {
+                    "value": f"{product.price / 100:.2f}",
+                    "currency": "RUB"
+                },
+                "confirmation": {
+                    "type": "redirect",
+                    "return_url": bot_link
+                },
+                "capture": True,
+                "metadata": {
+                    "user_id": callback.from_user.id,
+                    "product_id": product_id
+                },
+                "description": product.name
+            }, payment_uuid)
+        except REQUEST_ERRORS as e:
+            logger.error(f"Ошибка создания платежа юкасса: {e}")
+            await callback.answer("⏳ Не удалось создать платеж, попробуйте позже", show_alert=True)
+            return
+
+        payment_record = LedgerModel(
+            provider="yookassa",
+            external_id=yookassa_payment.id,
             user_id=callback.from_user.id,
             product_id=product_id,
             amount=product.price,
+            currency="RUB",
             status="pending"
         )
+        await ensure_user(session, callback.from_user)
         session.add(payment_record)
         await session.commit()
         payment_keyboard = create_kb(
@@ -72,7 +82,7 @@ async def process_yookassa(callback: CallbackQuery):
 📝 Назначение: {product.name}
 
 👇 Для оплаты перейдите по ссылке:
-{yookassa_payment.confirmation.confirmation_url}
+{yookassa_payment.confirmation_url}
 
 ⚠️ Внимание: 
 • После оплаты нажмите кнопку "🔄 Проверить оплату"
@@ -84,48 +94,35 @@ async def process_yookassa(callback: CallbackQuery):
 @router.callback_query(F.data.startswith("check_yookassa___"))
 async def check_yookassa(callback: CallbackQuery):
     payment_id = callback.data.split('___')[1]
-    print(payment_id)
 
     async with Session() as session:
-        # Обновляем статус платежа в базе
-        payment = await session.get(PaymentModel, payment_id)
-        if not payment:
-            await callback.answer("❌ Платеж не найден", show_alert=True)
-            return
-
-        # Проверяем статус в YooKassa
-        yookassa_payment = Payment.find_one(payment_id)
-
-        if yookassa_payment.status == 'succeeded':
-            # Обновляем статус в базе
-            payment.status = 'succeeded'
-            await session.commit()
-
-            # Получаем информацию о товаре
-            product = await session.get(Product, payment.product_id)
-
-            await callback.message.edit_text(
-                f'''✅ Платеж прошел успешно!
-
-📦 Товар: {product.name}
-💰 Сумма: {product.price // 100} руб
-
-👨‍💻 Контакты разработчика: @AltiBalti, в ближайшее время он с Вами свяжется для уточнения деталей''',
-                reply_markup=create_kb(1, view_products='В главное меню')
-            )
-
-            # Уведомляем администратора
-            await bot.send_message(
-                1012882762,
-                f"🛒 Новый заказ!\n"
-                f"👤 Пользователь: {callback.from_user.id}\n"
-                f"📦 Товар: {product.name}\n"
-                f"💰 Сумма: {product.price // 100} руб"
-            )
-
-        elif yookassa_payment.status == 'canceled':
-            payment.status = 'canceled'
-            await session.commit()
-            await callback.answer('❌ Платеж отменен', show_alert=True)
-        else:
-            await callback.answer('⏳ Оплата еще не прошла или возникла ошибка', show_alert=True)
+        # Находим платеж в журнале
+        result = await session.execute(
+            LedgerModel.__table__.select()
+            .where(LedgerModel.provider == "yookassa", LedgerModel.external_id == payment_id)
+        )
+        payment = result.fetchone()
+    if not payment:
+        await callback.answer("❌ Платеж не найден", show_alert=True)
+        return
+    if payment.status == 'succeeded':
+        await callback.answer('✅ Платеж уже подтвержден', show_alert=True)
+        return
+
+    # Проверяем статус в YooKassa
+    try:
+        yookassa_payment = await yookassa.find_payment(payment_id)
+    except REQUEST_ERRORS as e:
+        logger.error(f"Ошибка при проверке платежа юкасса {payment_id}: {e}")
+        await callback.answer("⏳ Не удалось проверить оплату, попробуйте позже", show_alert=True)
+        return
+    status = PROVIDERS["yookassa"].map_status(yookassa_payment.status)
+
+    if status == 'succeeded':
+        if not await finalize_payment("yookassa", payment_id, status, edit_message=callback.message):
+            await callback.answer('✅ Платеж уже подтвержден', show_alert=True)
+    elif status == 'canceled':
+        await finalize_payment("yookassa", payment_id, status)
+        await callback.answer('❌ Платеж отменен', show_alert=True)
+    else:
+        await callback.answer('⏳ Оплата еще не прошла или возникла ошибка', show_alert=True)
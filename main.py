@@ -2,12 +2,28 @@ import asyncio
 import logging
 
 from aiogram import Dispatcher
-from yookassa import Configuration
+from aiogram.fsm.storage.memory import MemoryStorage
 
 from handlers import handlers_admin, handlers_user, handlers_yookassa, handlers_stars, handlers_crypto
 from bot import bot
-from config import SHOP_ID, SECRET_KEY
-from db.models import create_tables
+from db.catalog import catalog
+from db.migrations import run_migrations
+from db.positions import positions
+from db.write_behind import write_behind
+from config import (YOOKASSA_WEBHOOK_ENABLED, BOT_MODE, ORDER_CHAT_ID, METRICS_ENABLED, TRACE_ENABLED,
+                    FSM_STORAGE, UPDATE_SCHEDULER_ENABLED)
+from db.fsm_storage import fsm_storage
+from db.models import engine, read_engine
+from services.web import create_app, start_web_server
+from services.bot_context import bot_context
+from services.metrics import setup_handler_metrics, instrument_engine, setup_metrics_endpoint
+from services.outbox import outbox
+from services.tracing import setup_tracing
+from services.update_scheduler import update_scheduler
+from services.sender import sender, PRIORITY_ADMIN
+from services.telegram_webhook import setup_telegram_webhook, run_webhook
+from services.yookassa_client import yookassa
+from services.yookassa_webhook import setup_yookassa_webhook
 from typing import NoReturn
 
 from tasks import start_background_tasks
@@ -24,34 +40,56 @@ async def main() -> None:
     Основная функция запуска бота
 
     Эта функция:
-    1. Инициализирует таблицы в базе данных
+    1. Проверяет схему базы данных и загружает кэш каталога
     2. Настраивает логирование
     3. Регистрирует обработчики сообщений
-    4. Запускает бота в режиме long-polling
+    4. Запускает бота в режиме long-polling или webhook (BOT_MODE)
 
     Шаги выполнения:
-    1. Создание таблиц БД (если не существуют)
+    1. Применение недостающих миграций схемы БД
     2. Настройка уровня логирования (INFO)
     3. Инициализация диспетчера
     4. Регистрация роутеров (пользовательские и административные обработчики)
     5. Удаление ожидающих апдейтов
-    6. Запуск опроса серверов Telegram
+    6. Запуск опроса серверов Telegram либо веб-сервера с вебхуком
 
     Обработка ошибок:
         Ловит и логирует все исключения во время работы
     """
     try:
-        Configuration.account_id = SHOP_ID
-        Configuration.secret_key = SECRET_KEY
-        # Инициализация таблиц в базе данных
-        await create_tables()
-        await bot.send_message(1012882762, 'Бот запущен!!!')
+        if METRICS_ENABLED:
+            instrument_engine(engine, "write")
+            if read_engine is not engine:
+                instrument_engine(read_engine, "read")
+        # Проверка схемы базы данных и применение миграций
+        await run_migrations()
+        # Загрузка активного каталога в кэш
+        await catalog.load()
+        # Данные бота для ссылок на оплату запрашиваются один раз
+        await bot_context.refresh(bot)
+        # Исходящие уведомления отправляются через очередь с учетом лимитов Telegram
+        sender.start()
+        # Некритичные записи (регистрации и т.п.) пишутся пачками
+        write_behind.start()
+        sender.send_message(ORDER_CHAT_ID, 'Бот запущен!!!', priority=PRIORITY_ADMIN)
         # Настройка базового логирования
         logger.info("Инициализация таблиц базы данных завершена")
         await start_background_tasks()
 
-        # Создание диспетчера для обработки событий
-        dp: Dispatcher = Dispatcher()
+        # Создание диспетчера для обработки событий. Состояния FSM (мастер
+        # добавления товара, рассылка) хранятся в БД и переживают перезапуск
+        dp: Dispatcher = Dispatcher(storage=fsm_storage if FSM_STORAGE == "sql" else MemoryStorage())
+        if UPDATE_SCHEDULER_ENABLED:
+            # Апдейты разных чатов параллельно, одного чата - по порядку. Очередь
+            # дорабатывается при остановке первой, пока работают БД и отправка
+            update_scheduler.setup(dp)
+            dp.shutdown.register(update_scheduler.close)
+        # Сохранение несохраненных позиций пользователей при остановке
+        dp.shutdown.register(positions.flush)
+        dp.shutdown.register(write_behind.close)
+        dp.shutdown.register(yookassa.close)
+        dp.shutdown.register(sender.close)
+        dp.shutdown.register(outbox.close)
 
         # Регистрация роутеров
         dp.include_router(handlers_admin.router)
@@ -59,16 +97,41 @@ async def main() -> None:
         dp.include_router(handlers_yookassa.router)
         dp.include_router(handlers_stars.router)
         dp.include_router(handlers_crypto.router)
+        if TRACE_ENABLED:
+            setup_tracing(dp, bot, *{engine, read_engine})
+        if METRICS_ENABLED:
+            setup_handler_metrics(handlers_admin.router, handlers_user.router, handlers_yookassa.router,
+                                  handlers_stars.router, handlers_crypto.router)
         logger.info("Роутеры успешно зарегистрированы")
 
+        # Общий веб-сервер для вебхука Telegram, уведомлений платежных систем и метрик
+        app = create_app() if BOT_MODE == "webhook" or YOOKASSA_WEBHOOK_ENABLED or METRICS_ENABLED else None
+        if YOOKASSA_WEBHOOK_ENABLED:
+            setup_yookassa_webhook(app)
+        if METRICS_ENABLED:
+            setup_metrics_endpoint(app)
+
+        if BOT_MODE == "webhook":
+            # Запуск бота в режиме webhook
+            secret_token = setup_telegram_webhook(app, dp, bot)
+            dp.shutdown.register(bot.session.close)
+            logger.info("Запуск бота в режиме webhook...")
+            await run_webhook(app, dp, bot, secret_token)
+            return
+
+        if app is not None:
+            runner = await start_web_server(app)
+            dp.shutdown.register(runner.cleanup)
+
         # Удаление вебхука для очистки ожидающих обновлений
         await bot.delete_webhook(drop_pending_updates=True)
         logger.info("Ожидающие обновления очищены")
 
         # Запуск бота в режиме long-polling
         logger.info("Запуск бота в режиме long-polling...")
-        await dp.start_polling(bot)
-
+        # С планировщиком апдейт только ставится в очередь чата; пока очередь
+        # переполнена, новые апдейты не запрашиваются
+        await dp.start_polling(bot, handle_as_tasks=not UPDATE_SCHEDULER_ENABLED)
 
     except Exception as e:
         logger.exception(f"Критическая ошибка: {str(e)}")
@@ -0,0 +1,42 @@
+import asyncio
+import logging
+from typing import Optional
+
+from aiogram import Bot
+
+logger = logging.getLogger(__name__)
+
+
+class BotContext:
+    """
+    Данные о самом боте, полученные один раз при запуске.
+
+    Избавляет обработчики оформления заказа от вызова get_me на каждое
+    нажатие: ссылка на бота берется из памяти.
+    """
+
+    def __init__(self) -> None:
+        self.id: Optional[int] = None
+        self.username: Optional[str] = None
+
+    @property
+    def link(self) -> str:
+        return f"https://t.me/{self.username}"
+
+    async def refresh(self, bot: Bot) -> None:
+        bot_info = await bot.get_me()
+        self.id, self.username = bot_info.id, bot_info.username
+        logger.info(f"Данные бота обновлены: @{self.username}")
+
+    async def refresh_periodically(self, bot: Bot, interval: int) -> None:
+        """Периодическое обновление (например, после смены username бота)"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh(bot)
+            except Exception as e:
+                logger.error(f"Не удалось обновить данные бота: {e}")
+
+
+# Общий для процесса контекст бота
+bot_context = BotContext()
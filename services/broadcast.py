@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Dict, List
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from sqlalchemy import func, select
+
+from config import BROADCAST_CHUNK_SIZE, BROADCAST_REPORT_INTERVAL
+from db.models import Session, ReadSession, User, BroadcastModel
+from db.users import known_users
+from services.sender import sender, SendQueueFull, PRIORITY_BULK, PRIORITY_ADMIN
+
+logger = logging.getLogger(__name__)
+
+# Запущенные в этом процессе рассылки: id -> задача
+running: Dict[int, asyncio.Task] = {}
+
+# Ошибки, после которых сообщение отправляется повторно: очередь отправки
+# переполнена или Telegram недоступен дольше, чем повторяет сама очередь
+TRANSIENT_ERRORS = (SendQueueFull, TelegramNetworkError, TelegramServerError, TelegramRetryAfter)
+RETRY_MAX_DELAY = 60  # секунды между повторами недоставленной части пачки
+RETRY_ATTEMPTS = 6  # повторов, после которых сообщение считается недоставленным (~2 мин)
+
+
+async def start_broadcast(admin_id: int, text: str) -> BroadcastModel:
+    """Создает рассылку по активным пользователям и запускает ее в фоне"""
+    async with Session() as session:
+        total = (await session.execute(
+            select(func.count()).select_from(User).where(User.is_active == True)
+        )).scalar()
+        broadcast = BroadcastModel(admin_id=admin_id, text=text, total=total)
+        session.add(broadcast)
+        await session.commit()
+
+    running[broadcast.id] = asyncio.create_task(run_broadcast(broadcast.id))
+    return broadcast
+
+
+async def cancel_broadcast(broadcast_id: int) -> bool:
+    """Останавливает рассылку. Возвращает False, если она уже завершена"""
+    async with Session() as session:
+        result = await session.execute(
+            BroadcastModel.__table__.update()
+            .where(BroadcastModel.id == broadcast_id, BroadcastModel.status == "running")
+            .values(status="canceled", finished_at=datetime.now())
+        )
+        await session.commit()
+
+    task = running.pop(broadcast_id, None)
+    if task:
+        task.cancel()
+    return result.rowcount > 0
+
+
+async def resume_broadcasts() -> None:
+    """Продолжает рассылки, прерванные остановкой бота, с сохраненного курсора"""
+    async with Session() as session:
+        result = await session.execute(
+            select(BroadcastModel.id).where(BroadcastModel.status == "running")
+        )
+        broadcast_ids = result.scalars().all()
+
+    for broadcast_id in broadcast_ids:
+        if broadcast_id not in running:
+            logger.info(f"Продолжение рассылки {broadcast_id}")
+            running[broadcast_id] = asyncio.create_task(run_broadcast(broadcast_id))
+
+
+def progress_text(broadcast, elapsed: float, processed: int) -> str:
+    """Отчет о ходе рассылки: processed - обработано в этом запуске за elapsed секунд"""
+    done = broadcast.sent + broadcast.failed + broadcast.blocked
+    rate = processed / elapsed if elapsed > 0 else 0
+    eta = (broadcast.total - done) / rate if rate > 0 else 0
+    return (
+        f"📣 Рассылка #{broadcast.id}: {done}/{broadcast.total}\n"
+        f"✅ Доставлено: {broadcast.sent}\n"
+        f"🚫 Заблокировали бота: {broadcast.blocked}\n"
+        f"❌ Ошибки: {broadcast.failed}\n"
+        f"⚡ Скорость: {rate:.1f} сообщ./с, осталось ~{int(max(eta, 0)) // 60} мин"
+    )
+
+
+async def send_chunk(broadcast, user_ids: List[int]) -> Dict[int, object]:
+    """
+    Отправляет пачку; недоставленное из-за временных ошибок повторяется
+    не более RETRY_ATTEMPTS раз, после чего последняя ошибка считается
+    окончательной. Возвращает user_id -> результат отправки или ошибка
+    """
+    results: Dict[int, object] = {}
+    pending = list(user_ids)
+    attempt = 0
+    while pending:
+        futures = [
+            sender.send_message(user_id, broadcast.text, priority=PRIORITY_BULK, parse_mode="HTML")
+            for user_id in pending
+        ]
+        retry = []
+        for user_id, result in zip(pending, await asyncio.gather(*futures, return_exceptions=True)):
+            results[user_id] = result
+            if isinstance(result, TRANSIENT_ERRORS):
+                retry.append(user_id)
+        if retry and attempt >= RETRY_ATTEMPTS:
+            logger.warning(f"Рассылка {broadcast.id}: {len(retry)} сообщений не доставлено "
+                           f"после {attempt} повторов, считаются ошибками")
+            break
+        if retry:
+            attempt += 1
+            delay = min(2 ** attempt, RETRY_MAX_DELAY)
+            logger.warning(f"Рассылка {broadcast.id}: {len(retry)} сообщений не доставлено из-за временных "
+                           f"ошибок, повтор #{attempt} через {delay} с")
+            await asyncio.sleep(delay)
+        pending = retry
+    return results
+
+
+async def run_broadcast(broadcast_id: int) -> None:
+    """
+    Отправляет рассылку пачками по BROADCAST_CHUNK_SIZE пользователей.
+
+    Пользователи выбираются keyset-пагинацией (user_id > курсора) в порядке
+    первичного ключа, поэтому в памяти находится только одна пачка. Скорость
+    задает очередь отправки: рассылка идет в самой низкой очереди приоритета
+    и не задерживает ответы покупателям. После каждой пачки курсор и счетчики
+    сохраняются в одной транзакции с отметкой заблокировавших бота
+    пользователей; после перезапуска рассылка продолжается со следующей
+    пачки (прерванная пачка может быть отправлена повторно).
+
+    Курсор переходит за пачку, только когда по каждому ее пользователю
+    получен окончательный результат: временные ошибки (TRANSIENT_ERRORS)
+    повторяются с паузой, ошибкой считаются постоянные и временные,
+    не прошедшие за RETRY_ATTEMPTS повторов.
+    """
+    try:
+        async with Session() as session:
+            broadcast = await session.get(BroadcastModel, broadcast_id)
+        started = time.monotonic()
+        last_report = started
+        processed = 0
+
+        while broadcast.status == "running":
+            async with ReadSession() as session:
+                result = await session.execute(
+                    select(User.user_id)
+                    .where(User.is_active == True, User.user_id > broadcast.last_user_id)
+                    .order_by(User.user_id)
+                    .limit(BROADCAST_CHUNK_SIZE)
+                )
+                user_ids = result.scalars().all()
+            if not user_ids:
+                break
+
+            results = await send_chunk(broadcast, user_ids)
+
+            blocked = [user_id for user_id, r in results.items() if isinstance(r, TelegramForbiddenError)]
+            failed = sum(1 for r in results.values() if isinstance(r, Exception)) - len(blocked)
+            async with Session() as session:
+                if blocked:
+                    await session.execute(
+                        User.__table__.update().where(User.user_id.in_(blocked)).values(is_active=False)
+                    )
+                await session.execute(
+                    BroadcastModel.__table__.update()
+                    .where(BroadcastModel.id == broadcast_id, BroadcastModel.status == "running")
+                    .values(last_user_id=user_ids[-1],
+                            sent=BroadcastModel.sent + len(user_ids) - len(blocked) - failed,
+                            failed=BroadcastModel.failed + failed,
+                            blocked=BroadcastModel.blocked + len(blocked))
+                )
+                await session.commit()
+                broadcast = await session.get(BroadcastModel, broadcast_id, populate_existing=True)
+            # Следующий /start заблокировавшего пользователя должен снова сделать его активным
+            known_users.discard(blocked)
+            processed += len(user_ids)
+
+            now = time.monotonic()
+            if now - last_report >= BROADCAST_REPORT_INTERVAL:
+                last_report = now
+                sender.send_message(broadcast.admin_id, progress_text(broadcast, now - started, processed),
+                                    priority=PRIORITY_ADMIN)
+                logger.info(f"Рассылка {broadcast_id}: {processed} за {now - started:.0f} с")
+
+        if broadcast.status != "running":
+            return
+
+        async with Session() as session:
+            await session.execute(
+                BroadcastModel.__table__.update()
+                .where(BroadcastModel.id == broadcast_id, BroadcastModel.status == "running")
+                .values(status="done", finished_at=datetime.now())
+            )
+            await session.commit()
+        sender.send_message(
+            broadcast.admin_id,
+            "🏁 Рассылка завершена\n\n" + progress_text(broadcast, time.monotonic() - started, processed),
+            priority=PRIORITY_ADMIN
+        )
+        logger.info(f"Рассылка {broadcast_id} завершена")
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        # Статус остается running: рассылка продолжится после перезапуска
+        logger.exception(f"Ошибка рассылки {broadcast_id}: {e}")
+    finally:
+        running.pop(broadcast_id, None)
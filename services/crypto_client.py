@@ -0,0 +1,6 @@
+from aiocryptopay import AioCryptoPay, Networks
+
+from config import CRYPTO_PAY_API_KEY
+
+# Инициализация Crypto Pay
+crypto = AioCryptoPay(CRYPTO_PAY_API_KEY, network=Networks.MAIN_NET)
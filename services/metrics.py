@@ -0,0 +1,226 @@
+import logging
+import time
+from bisect import bisect_left
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from aiogram import BaseMiddleware, Router
+from aiogram.types import TelegramObject
+from aiohttp import web
+from sqlalchemy import event as sql_event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from config import METRICS_PATH, METRICS_ALLOWED_IPS
+from services.tracing import record_span
+from services.web import client_ip
+
+logger = logging.getLogger(__name__)
+
+# Метрики в текстовом формате Prometheus. Собственный минимальный реестр вместо
+# prometheus_client: значения с метками хранятся в словарях и обновляются за
+# несколько операций без блокировок (весь бот работает в одном event loop)
+
+# Границы гистограмм длительности по умолчанию, секунды
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY: list = []
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        REGISTRY.append(self)
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+
+class Counter(Metric):
+    """
+    Счетчик: увеличивается inc либо берется функцией collect в момент запроса
+    метрик (счетчики, которые уже ведет сам компонент)
+    """
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = (),
+                 collect: Optional[Callable[[], Dict[tuple, float]]] = None) -> None:
+        super().__init__(name, documentation, labels)
+        self.values: Dict[tuple, float] = {}
+        self.collect = collect
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def current(self) -> Dict[tuple, float]:
+        if self.collect is None:
+            return self.values
+        try:
+            return self.collect()
+        except Exception as e:
+            logger.error(f"Ошибка сбора метрики {self.name}: {e}")
+            return {}
+
+    def render(self) -> list:
+        lines = super().render()
+        for labels, value in self.current().items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    """Текущее значение: задается set либо вычисляется функцией collect"""
+    type = "gauge"
+
+    def set(self, value: float, *labels: str) -> None:
+        self.values[labels] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        # метки -> [счетчики по корзинам (без накопления) + переполнение, сумма]
+        self.values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> list:
+        lines = super().render()
+        for labels, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, le)} {cumulative}")
+            label_text = _format_labels(self.label_names, labels)
+            lines.append(f"{self.name}_sum{label_text} {total}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Метрики бота
+
+HANDLER_DURATION = Histogram("bot_handler_duration_seconds", "Время обработки апдейта обработчиком", ["handler"])
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Исключения в обработчиках", ["handler"])
+
+DB_QUERIES = Counter("db_queries_total", "SQL-запросы", ["engine", "operation"])
+DB_QUERY_DURATION = Histogram("db_query_duration_seconds", "Время выполнения SQL-запроса", ["engine"])
+
+PROVIDER_REQUESTS = Counter("provider_requests_total", "Запросы к платежным системам",
+                            ["provider", "operation", "outcome"])
+PROVIDER_DURATION = Histogram("provider_request_duration_seconds", "Время запроса к платежной системе",
+                              ["provider", "operation"])
+
+SWEEP_DURATION = Histogram("payments_sweep_duration_seconds", "Длительность фоновой проверки платежей",
+                           buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+PAYMENTS_DUE = Gauge("payments_due", "Платежей к проверке в последней выборке", ["provider"])
+PAYMENTS_PENDING = Gauge("payments_pending", "Платежей в ожидании оплаты", ["provider"])
+
+
+# Обработчики
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренняя middleware роутера: время и ошибки каждого обработчика"""
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object is not None else "unknown"
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_DURATION.observe(time.perf_counter() - started, name)
+
+
+def setup_handler_metrics(*routers: Router) -> None:
+    """Подключает метрики обработчиков к роутерам"""
+    middleware = HandlerMetricsMiddleware()
+    for router in routers:
+        for observer in (router.message, router.callback_query, router.pre_checkout_query):
+            observer.middleware(middleware)
+
+
+# База данных
+
+def instrument_engine(engine: AsyncEngine, name: str) -> None:
+    """Число и время SQL-запросов движка по событиям курсора SQLAlchemy"""
+    sync_engine = engine.sync_engine
+
+    @sql_event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_started"] = time.perf_counter()
+
+    @sql_event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop("query_started", None)
+        operation = statement.lstrip()[:6].lower()
+        if operation not in ("select", "insert", "update", "delete"):
+            operation = "other"
+        DB_QUERIES.inc(name, operation)
+        if started is not None:
+            DB_QUERY_DURATION.observe(time.perf_counter() - started, name)
+
+
+# Платежные системы
+
+@asynccontextmanager
+async def provider_call(provider: str, operation: str):
+    """Учет времени и исхода запроса к платежной системе (метрики и трасса апдейта)"""
+    started = time.perf_counter()
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = repr(e)
+        PROVIDER_REQUESTS.inc(provider, operation, "error")
+        raise
+    else:
+        PROVIDER_REQUESTS.inc(provider, operation, "ok")
+    finally:
+        duration = time.perf_counter() - started
+        PROVIDER_DURATION.observe(duration, provider, operation)
+        record_span("provider", f"{provider}.{operation}", started, duration, error)
+
+
+# HTTP-эндпоинт
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    # Метрики отдаются только с разрешенных адресов (по умолчанию локально)
+    if client_ip(request) not in METRICS_ALLOWED_IPS:
+        return web.Response(status=403)
+    return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Content-Type-Options": "nosniff"})
+
+
+def setup_metrics_endpoint(app: web.Application) -> None:
+    app.router.add_get(METRICS_PATH, metrics_handler)
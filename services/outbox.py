@@ -0,0 +1,225 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.types import InlineKeyboardMarkup
+from sqlalchemy import bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import (OUTBOX_POLL_INTERVAL, OUTBOX_BATCH_SIZE, OUTBOX_MAX_ATTEMPTS, OUTBOX_LEASE,
+                    OUTBOX_RETENTION_DAYS)
+from db.models import Session, OutboxModel
+from services.metrics import Counter, Gauge
+from services.sender import sender
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, при которых повтор не поможет (бот заблокирован, чат не найден и т.п.)
+PERMANENT_ERRORS = (TelegramForbiddenError, TelegramBadRequest)
+
+
+def outbox_message(key: str, chat_id: int, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None,
+                   priority: int = 0, delay: float = 0) -> dict:
+    """Строка outbox. delay - через сколько секунд сообщение можно отправлять"""
+    return {
+        "key": key,
+        "chat_id": chat_id,
+        "text": text,
+        "reply_markup": reply_markup.model_dump_json(exclude_none=True) if reply_markup else None,
+        "priority": priority,
+        "status": "pending",
+        "attempts": 0,
+        "next_attempt_at": datetime.now() + timedelta(seconds=delay),
+    }
+
+
+async def add_messages(session: AsyncSession, messages: List[dict]) -> None:
+    """
+    Записывает уведомления в outbox в транзакции вызывающего кода, вместе со
+    сменой статуса платежа: после коммита уведомление не потеряется
+    """
+    if messages:
+        await session.execute(OutboxModel.__table__.insert(), messages)
+
+
+async def mark_sent(key: str) -> None:
+    """
+    Отмечает уведомление отправленным (например, ответ уже доставлен правкой
+    сообщения). Запись синхронная, не через write_behind: потерянная отметка
+    означала бы повторное уведомление об оплате
+    """
+    async with Session() as session:
+        await session.execute(
+            OutboxModel.__table__.update()
+            .where(OutboxModel.key == key, OutboxModel.status == "pending")
+            .values(status="sent", sent_at=datetime.now())
+        )
+        await session.commit()
+
+
+def retry_delay(attempts: int) -> float:
+    """Пауза перед повтором: 10 с, 20 с, 40 с ... до 30 минут"""
+    return min(10 * 2 ** (attempts - 1), 1800)
+
+
+class OutboxDispatcher:
+    """
+    Доставка уведомлений из outbox через очередь отправки.
+
+    Выборка забирает пачку готовых к отправке строк условным UPDATE с арендой
+    (next_attempt_at сдвигается на OUTBOX_LEASE), поэтому несколько процессов
+    не отправят одно сообщение одновременно, а сообщения, выданные процессу,
+    который упал до подтверждения, будут выданы повторно после аренды.
+    Результаты отправки записываются пачкой при следующем проходе.
+    """
+
+    def __init__(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._results: list = []  # (id, ошибка или None, постоянная ли ошибка)
+        self._in_flight: set = set()
+        self._last_cleanup: Optional[datetime] = None
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    def wake(self) -> None:
+        """Запускает внеочередной проход (новые уведомления в outbox)"""
+        self._wakeup.set()
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._in_flight), "sent": self.sent, "retried": self.retried, "failed": self.failed}
+
+    async def run(self) -> None:
+        while True:
+            try:
+                claimed = await self.dispatch()
+            except Exception as e:
+                logger.error(f"Ошибка доставки outbox: {e}")
+                claimed = 0
+
+            # Полная пачка - вероятно, есть еще готовые сообщения
+            if claimed < OUTBOX_BATCH_SIZE:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), OUTBOX_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+
+    async def dispatch(self) -> int:
+        """Один проход: запись результатов, выдача пачки сообщений в очередь отправки"""
+        await self.save_results()
+        await self.cleanup()
+
+        now = datetime.now()
+        async with Session() as session:
+            result = await session.execute(
+                OutboxModel.__table__.select()
+                .where(OutboxModel.status == "pending", OutboxModel.next_attempt_at <= now)
+                .order_by(OutboxModel.next_attempt_at)
+                .limit(OUTBOX_BATCH_SIZE)
+            )
+            ids = [row.id for row in result.fetchall() if row.id not in self._in_flight]
+            if not ids:
+                return 0
+
+            # Аренда: строку получает только тот, чей UPDATE ее изменил
+            result = await session.execute(
+                OutboxModel.__table__.update()
+                .where(OutboxModel.id.in_(ids), OutboxModel.status == "pending",
+                       OutboxModel.next_attempt_at <= now)
+                .values(next_attempt_at=now + timedelta(seconds=OUTBOX_LEASE))
+                .returning(*OutboxModel.__table__.c)
+            )
+            rows = result.fetchall()
+            await session.commit()
+
+        for row in rows:
+            self._in_flight.add(row.id)
+            markup = InlineKeyboardMarkup.model_validate_json(row.reply_markup) if row.reply_markup else None
+            future = sender.send_message(row.chat_id, row.text, priority=row.priority, reply_markup=markup)
+            future.add_done_callback(lambda f, row_id=row.id: self._on_sent(row_id, f))
+        return len(rows)
+
+    def _on_sent(self, row_id: int, future: asyncio.Future) -> None:
+        error = future.exception() if not future.cancelled() else asyncio.CancelledError()
+        self._results.append((row_id, error, isinstance(error, PERMANENT_ERRORS)))
+        self.wake()
+
+    async def save_results(self) -> None:
+        """Записывает результаты отправки одной транзакцией"""
+        if not self._results:
+            return
+        results, self._results = self._results, []
+
+        now = datetime.now()
+        sent = [{"b_id": row_id} for row_id, error, _ in results if error is None]
+        failed = [(row_id, error, permanent) for row_id, error, permanent in results if error is not None]
+        async with Session() as session:
+            if sent:
+                await session.execute(
+                    OutboxModel.__table__.update()
+                    .where(OutboxModel.id == bindparam("b_id"))
+                    .values(status="sent", sent_at=now),
+                    sent
+                )
+            if failed:
+                attempts = dict((await session.execute(
+                    OutboxModel.__table__.select().with_only_columns(OutboxModel.id, OutboxModel.attempts)
+                    .where(OutboxModel.id.in_([row_id for row_id, _, _ in failed]))
+                )).fetchall())
+                params = []
+                for row_id, error, permanent in failed:
+                    attempt = attempts.get(row_id, 0) + 1
+                    give_up = permanent or attempt >= OUTBOX_MAX_ATTEMPTS
+                    params.append({
+                        "b_id": row_id,
+                        "b_status": "failed" if give_up else "pending",
+                        "b_attempts": attempt,
+                        "b_next_attempt_at": now + timedelta(seconds=retry_delay(attempt)),
+                        "b_last_error": str(error)[:1000],
+                    })
+                    if give_up:
+                        self.failed += 1
+                        logger.error(f"Уведомление outbox {row_id} не доставлено: {error}")
+                    else:
+                        self.retried += 1
+                await session.execute(
+                    OutboxModel.__table__.update()
+                    .where(OutboxModel.id == bindparam("b_id"))
+                    .values(status=bindparam("b_status"), attempts=bindparam("b_attempts"),
+                            next_attempt_at=bindparam("b_next_attempt_at"), last_error=bindparam("b_last_error")),
+                    params
+                )
+            await session.commit()
+
+        self.sent += len(sent)
+        self._in_flight.difference_update(row_id for row_id, _, _ in results)
+
+    async def cleanup(self) -> None:
+        """Раз в час удаляет отправленные уведомления старше OUTBOX_RETENTION_DAYS"""
+        now = datetime.now()
+        if self._last_cleanup and now - self._last_cleanup < timedelta(hours=1):
+            return
+        self._last_cleanup = now
+        async with Session() as session:
+            await session.execute(
+                OutboxModel.__table__.delete()
+                .where(OutboxModel.status == "sent",
+                       OutboxModel.sent_at < now - timedelta(days=OUTBOX_RETENTION_DAYS))
+            )
+            await session.commit()
+
+    async def close(self) -> None:
+        """Записывает результаты отправок, завершившихся до остановки"""
+        await self.save_results()
+
+
+# Общий для процесса диспетчер outbox
+outbox = OutboxDispatcher()
+
+Counter("outbox_messages_total", "Уведомления outbox по результату доставки", ["result"],
+        collect=lambda: {(name,): getattr(outbox, name) for name in ("sent", "retried", "failed")})
+Gauge("outbox_in_flight", "Уведомлений outbox, переданных в очередь отправки",
+      collect=lambda: {(): len(outbox._in_flight)})
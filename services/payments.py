@@ -0,0 +1,147 @@
+import logging
+from typing import Dict, List, Optional
+
+from aiogram.types import Message
+from sqlalchemy import select
+
+from config import ORDER_CHAT_ID, OUTBOX_EDIT_GRACE
+from db.models import Session, LedgerModel, Product, User
+from keyboard import create_kb
+from services.providers import PROVIDERS, PENDING, SUCCEEDED, FINAL_STATUSES, format_amount
+from services.outbox import outbox, outbox_message, add_messages, mark_sent
+from services.sender import PRIORITY_USER, PRIORITY_ADMIN
+
+logger = logging.getLogger(__name__)
+
+
+def finalize_statement(status: str, *conditions):
+    """
+    Условное обновление (compare-and-set) статуса pending-платежей журнала.
+
+    Статус меняется только у платежей, которые еще в ожидании, поэтому из
+    конкурирующих обработчиков (кнопка, вебхук, фоновая проверка) строку
+    получает ровно один - он и записывает уведомления. RETURNING сразу
+    возвращает название товара и имя покупателя, так что финализация
+    выполняется одним запросом к базе
+    """
+    return (
+        LedgerModel.__table__.update()
+        .where(LedgerModel.status == PENDING, *conditions)
+        .values(status=status, next_check_at=None)
+        .returning(
+            *LedgerModel.__table__.c,
+            select(Product.name).where(Product.id == LedgerModel.product_id)
+            .scalar_subquery().label("product_name"),
+            select(User.username).where(User.user_id == LedgerModel.user_id)
+            .scalar_subquery().label("username"),
+        )
+    )
+
+
+async def finalize_payment(provider: str, external_id: str, status: str,
+                           edit_message: Optional[Message] = None):
+    """
+    Единая финализация платежа любой платежной системы: применяет финальный
+    статус к pending-платежу журнала и при успешной оплате уведомляет
+    пользователя и администратора.
+
+    Вызывается вебхуками и кнопками проверки оплаты. Возвращает строку
+    журнала, если статус изменил именно этот вызов, иначе None (платеж не
+    найден или уже обработан другим путем).
+
+    edit_message - сообщение с кнопкой проверки, которое заменяется
+    уведомлением об оплате (иначе уведомление отправляется новым сообщением)
+    """
+    if status not in FINAL_STATUSES:
+        return None
+
+    async with Session() as session:
+        result = await session.execute(finalize_statement(
+            status, LedgerModel.provider == provider, LedgerModel.external_id == external_id
+        ))
+        payment = result.fetchone()
+        paid = payment is not None and status == SUCCEEDED
+        if paid:
+            # Уведомления записываются в outbox в той же транзакции, что и статус
+            await add_messages(session, paid_notifications(payment, edited=edit_message is not None))
+        await session.commit()
+
+    if paid:
+        if edit_message is not None:
+            # Ответ пользователю - правка сообщения с кнопкой; если она не удалась,
+            # outbox отправит уведомление отдельным сообщением
+            try:
+                await edit_message.edit_text(user_text(payment), reply_markup=create_kb(1, view_products='В главное меню'))
+                await mark_sent(f"ledger:{payment.id}:user")
+            except Exception as e:
+                logger.error(f"Не удалось отправить сообщение пользователю {payment.user_id}: {e}")
+        outbox.wake()
+    return payment
+
+
+async def finalize_payments(provider: str, statuses: Dict[str, str]) -> List:
+    """
+    Пакетная финализация для фоновой проверки: все изменения статусов
+    платежей одной платежной системы и уведомления об оплате записываются
+    одной транзакцией. statuses - финальные статусы журнала по внешним id платежей.
+    Возвращает строки журнала, статус которых изменил этот вызов
+    """
+    transitions = {}
+    for external_id, status in statuses.items():
+        if status in FINAL_STATUSES:
+            transitions.setdefault(status, []).append(external_id)
+    if not transitions:
+        return []
+
+    async with Session() as session:
+        changed = []
+        for status, external_ids in transitions.items():
+            result = await session.execute(finalize_statement(
+                status, LedgerModel.provider == provider, LedgerModel.external_id.in_(external_ids)
+            ))
+            changed.extend(result.fetchall())
+        await add_messages(session, [
+            message for payment in changed if payment.status == SUCCEEDED
+            for message in paid_notifications(payment)
+        ])
+        await session.commit()
+
+    if any(payment.status == SUCCEEDED for payment in changed):
+        outbox.wake()
+    return changed
+
+
+def user_text(payment) -> str:
+    return f'''✅ Платеж прошел успешно!
+
+📦 Товар: {payment.product_name}
+💰 Сумма: {format_amount(payment.amount, payment.currency)}
+
+👨‍💻 Контакты разработчика: @AltiBalti, в ближайшее время он с Вами свяжется для уточнения деталей'''
+
+
+def paid_notifications(payment, edited: bool = False) -> List[dict]:
+    """
+    Строки outbox с уведомлениями пользователя и администратора об успешной
+    оплате (payment - строка finalize_statement). Ключи идемпотентности
+    привязаны к записи журнала, поэтому уведомление не может быть записано дважды.
+
+    edited - ответ пользователю отправляется правкой сообщения с кнопкой,
+    outbox отправит его сам, только если правка не подтвердится за OUTBOX_EDIT_GRACE
+    """
+    return [
+        outbox_message(
+            f"ledger:{payment.id}:user", payment.user_id, user_text(payment),
+            reply_markup=create_kb(1, view_products='В главное меню'),
+            priority=PRIORITY_USER, delay=OUTBOX_EDIT_GRACE if edited else 0
+        ),
+        outbox_message(
+            f"ledger:{payment.id}:admin", ORDER_CHAT_ID,
+            f"🛒 Новый заказ{PROVIDERS[payment.provider].title}!\n"
+            f"👤 Пользователь: {payment.username} (ID: {payment.user_id})\n"
+            f"📦 Товар: {payment.product_name}\n"
+            f"💰 Сумма: {format_amount(payment.amount, payment.currency)}\n"
+            f"🆔 ID платежа: {payment.external_id}",
+            priority=PRIORITY_ADMIN
+        ),
+    ]
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Awaitable, Iterable, List, Optional
+
+from sqlalchemy import bindparam
+
+from config import (PAYMENTS_CONCURRENCY, PAYMENTS_SWEEP_LIMIT, PAYMENTS_FAST_WINDOW,
+                    PAYMENTS_FAST_INTERVAL, PAYMENTS_MAX_INTERVAL)
+from db.models import Session, ReadSession
+
+logger = logging.getLogger(__name__)
+
+# Проверок, которые успевает получить платеж в окне частых проверок
+FAST_ATTEMPTS = PAYMENTS_FAST_WINDOW // PAYMENTS_FAST_INTERVAL
+
+
+def next_check_delay(age: float, attempts: int, expiry: float, min_interval: float = 0) -> Optional[float]:
+    """
+    Задержка в секундах до следующей проверки платежа или None, если проверки пора прекратить.
+
+    Новый платеж проверяется каждые PAYMENTS_FAST_INTERVAL секунд в течение
+    PAYMENTS_FAST_WINDOW, затем интервал удваивается с каждой проверкой
+    до PAYMENTS_MAX_INTERVAL. Последняя проверка выполняется в момент истечения
+    срока expiry, после чего платеж больше не выбирается.
+    """
+    if age >= expiry:
+        return None
+
+    if age < PAYMENTS_FAST_WINDOW:
+        delay = PAYMENTS_FAST_INTERVAL
+    else:
+        delay = min(PAYMENTS_MAX_INTERVAL, PAYMENTS_FAST_INTERVAL * 2 ** max(1, attempts - FAST_ATTEMPTS))
+
+    return min(max(delay, min_interval), expiry - age)
+
+
+async def select_due(model, pending_status: str, now: datetime) -> list:
+    """
+    Платежи, у которых подошло время проверки. Выборка идет по индексу
+    (status, next_check_at) и ограничена PAYMENTS_SWEEP_LIMIT строками
+    """
+    async with ReadSession() as session:
+        result = await session.execute(
+            model.__table__.select()
+            .where(model.status == pending_status, model.next_check_at <= now)
+            .order_by(model.next_check_at)
+            .limit(PAYMENTS_SWEEP_LIMIT)
+        )
+        return result.fetchall()
+
+
+async def reschedule(model, pending_status: str, payments: Iterable, now: datetime,
+                     expiry: float, min_interval: float = 0) -> None:
+    """Назначает оставшимся в ожидании платежам время следующей проверки одной транзакцией"""
+    params = []
+    for payment in payments:
+        attempts = payment.check_attempts + 1
+        delay = next_check_delay((now - payment.created_at).total_seconds(), attempts, expiry, min_interval)
+        params.append({
+            "b_id": payment.id,
+            "b_attempts": attempts,
+            "b_next_check_at": now + timedelta(seconds=delay) if delay is not None else None,
+        })
+
+    if not params:
+        return
+
+    async with Session() as session:
+        await session.execute(
+            model.__table__.update()
+            .where(model.id == bindparam("b_id"), model.status == pending_status)
+            .values(check_attempts=bindparam("b_attempts"), next_check_at=bindparam("b_next_check_at")),
+            params
+        )
+        await session.commit()
+
+
+async def gather_bounded(coros: List[Awaitable], limit: int = PAYMENTS_CONCURRENCY) -> list:
+    """Выполняет корутины конкурентно, но не более limit одновременно"""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*(run(coro) for coro in coros), return_exceptions=True)
@@ -0,0 +1,128 @@
+import logging
+from typing import Dict, List, Optional
+
+from config import (CRYPTO_BATCH_SIZE, YOOKASSA_PENDING_TTL, CRYPTO_PENDING_TTL, PAYMENTS_RECONCILE_INTERVAL,
+                    YOOKASSA_WEBHOOK_ENABLED)
+from services.crypto_client import crypto
+from services.metrics import provider_call
+from services.poller import gather_bounded
+from services.yookassa_client import yookassa
+
+logger = logging.getLogger(__name__)
+
+# Статусы платежей в журнале
+PENDING = "pending"
+SUCCEEDED = "succeeded"
+CANCELED = "canceled"
+EXPIRED = "expired"
+FINAL_STATUSES = {SUCCEEDED, CANCELED, EXPIRED}
+
+
+class PaymentProvider:
+    """
+    Адаптер платежной системы для фоновой проверки и финализации платежей.
+
+    Переводит статусы платежной системы в статусы журнала и запрашивает
+    статусы сразу для списка платежей, насколько это позволяет ее API.
+    """
+
+    name: str = ""
+    title: str = ""  # для уведомления администратора: "Новый заказ{title}!"
+    currency: str = ""
+    pending_ttl: float = 0  # секунды, после которых проверки прекращаются
+    min_interval: float = 0  # минимальный интервал между проверками одного платежа
+
+    async def fetch_statuses(self, external_ids: List[str]) -> Dict[str, str]:
+        """Статусы журнала для переданных платежей (недоступные платежи пропускаются)"""
+        raise NotImplementedError
+
+    async def fetch_status(self, external_id: str) -> Optional[str]:
+        """
+        Статус журнала одного платежа для кнопки проверки: None - платежа нет
+        в платежной системе, ошибка запроса пробрасывается
+        """
+        raise NotImplementedError
+
+
+class YooKassaProvider(PaymentProvider):
+    name = "yookassa"
+    currency = "RUB"
+    pending_ttl = YOOKASSA_PENDING_TTL
+    # При включенном вебхуке фоновая проверка служит редкой сверкой
+    min_interval = PAYMENTS_RECONCILE_INTERVAL if YOOKASSA_WEBHOOK_ENABLED else 0
+
+    STATUSES = {"succeeded": SUCCEEDED, "canceled": CANCELED}
+
+    def map_status(self, status: str) -> str:
+        return self.STATUSES.get(status, PENDING)
+
+    async def fetch_statuses(self, external_ids: List[str]) -> Dict[str, str]:
+        # API YooKassa не умеет запрашивать несколько платежей по id,
+        # поэтому платежи проверяются конкурентно с ограничением
+        results = await gather_bounded([yookassa.find_payment(external_id) for external_id in external_ids])
+        statuses = {}
+        for external_id, result in zip(external_ids, results):
+            if isinstance(result, Exception):
+                logger.error(f"Ошибка при проверке платежа юкасса {external_id}: {result}")
+                continue
+            statuses[external_id] = self.map_status(result.status)
+        return statuses
+
+
+class CryptoProvider(PaymentProvider):
+    name = "crypto"
+    title = " через Crypto Pay"
+    currency = "USDT"
+    pending_ttl = CRYPTO_PENDING_TTL
+
+    STATUSES = {"paid": SUCCEEDED, "expired": EXPIRED, "failed": CANCELED}
+
+    def map_status(self, status: str) -> str:
+        return self.STATUSES.get(status, PENDING)
+
+    async def fetch_statuses(self, external_ids: List[str]) -> Dict[str, str]:
+        """Статусы счетов пачками до CRYPTO_BATCH_SIZE id за запрос getInvoices"""
+        async def fetch_batch(batch: list) -> list:
+            try:
+                async with provider_call("crypto", "get_invoices"):
+                    return await crypto.get_invoices(invoice_ids=[int(i) for i in batch], count=len(batch)) or []
+            except Exception as e:
+                logger.error(f"Ошибка при запросе крипто-платежей {batch[0]}..{batch[-1]}: {e}")
+                return []
+
+        batches = [external_ids[start:start + CRYPTO_BATCH_SIZE]
+                   for start in range(0, len(external_ids), CRYPTO_BATCH_SIZE)]
+        statuses = {}
+        for invoices in await gather_bounded([fetch_batch(batch) for batch in batches]):
+            for invoice in invoices:
+                statuses[str(invoice.invoice_id)] = self.map_status(invoice.status)
+        return statuses
+
+    async def fetch_status(self, external_id: str) -> Optional[str]:
+        async with provider_call("crypto", "get_invoices"):
+            invoices = await crypto.get_invoices(invoice_ids=[int(external_id)], count=1) or []
+        return self.map_status(invoices[0].status) if invoices else None
+
+
+class StarsProvider(PaymentProvider):
+    """
+    Оплата звездами подтверждается самим Telegram (successful_payment), опрос
+    не нужен: платежи записываются в журнал без расписания проверки
+    """
+    name = "stars"
+    title = " через Stars"
+    currency = "XTR"
+
+
+PROVIDERS: Dict[str, PaymentProvider] = {
+    provider.name: provider for provider in (YooKassaProvider(), CryptoProvider(), StarsProvider())
+}
+
+
+def format_amount(amount: int, currency: str) -> str:
+    """Сумма из минимальных единиц валюты в текст для сообщений"""
+    if currency == "RUB":
+        return f"{amount // 100} руб"
+    if currency == "XTR":
+        return f"{amount} ⭐️"
+    return f"{amount / 100:.2f} {currency}"
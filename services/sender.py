@@ -0,0 +1,286 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+from aiogram.exceptions import TelegramRetryAfter, TelegramNetworkError, TelegramServerError
+
+from bot import bot
+from config import (SEND_RATE, SEND_BURST, SEND_CHAT_INTERVAL, SEND_GROUP_INTERVAL, SEND_QUEUE_SIZE,
+                    SEND_WORKERS, SEND_MAX_RETRIES, SEND_DRAIN_TIMEOUT)
+from services.metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+# Очереди приоритета: ответы пользователям отправляются раньше уведомлений
+# администратору, рассылки - в последнюю очередь
+PRIORITY_USER = 0
+PRIORITY_ADMIN = 1
+PRIORITY_BULK = 2
+PRIORITY_NAMES = ("user", "admin", "bulk")
+
+
+class SendQueueFull(Exception):
+    """Очередь приоритета заполнена, сообщение не принято"""
+
+
+class TokenBucket:
+    """Общий лимит отправки: rate сообщений в секунду с запасом burst"""
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def pause(self, seconds: float) -> None:
+        """Приостанавливает отправку (ответ Telegram 429 с retry_after)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class _Job:
+    __slots__ = ("chat_id", "call", "priority", "future", "attempts", "enqueued_at", "not_before")
+
+    def __init__(self, chat_id: int, call: Callable[[], Awaitable], priority: int, future: asyncio.Future) -> None:
+        self.chat_id = chat_id
+        self.call = call
+        self.priority = priority
+        self.future = future
+        self.attempts = 0
+        self.enqueued_at = time.monotonic()
+        self.not_before: Optional[float] = None  # зарезервированное время отправки в чат
+
+
+class OutboundSender:
+    """
+    Очередь исходящих сообщений Telegram.
+
+    Отправитель ставит сообщение в очередь и сразу получает Future, не дожидаясь
+    отправки. Воркеры соблюдают общий лимит бота (token bucket), интервал между
+    сообщениями в один чат и ответы 429 (RetryAfter): сообщение повторяется
+    после указанной паузы, а не теряется. Пока сообщение ждет повтора,
+    следующие сообщения в тот же чат откладываются, поэтому порядок
+    сообщений в чате сохраняется. Очереди приоритетов ограничены
+    SEND_QUEUE_SIZE; при переполнении Future завершается SendQueueFull.
+    """
+
+    def __init__(self, rate: float = SEND_RATE, burst: int = SEND_BURST,
+                 chat_interval: float = SEND_CHAT_INTERVAL, group_interval: float = SEND_GROUP_INTERVAL,
+                 queue_size: int = SEND_QUEUE_SIZE, workers: int = SEND_WORKERS,
+                 max_retries: int = SEND_MAX_RETRIES) -> None:
+        self.bucket = TokenBucket(rate, burst)
+        self.chat_interval = chat_interval
+        self.group_interval = group_interval
+        self.queue_size = queue_size
+        self.workers = workers
+        self.max_retries = max_retries
+        self._lanes = tuple(deque() for _ in PRIORITY_NAMES)
+        self._has_jobs = asyncio.Event()
+        self._chat_next: dict = {}  # chat_id -> время, раньше которого в чат не отправляем
+        self._blocked: dict = {}  # chat_id -> сообщение, ждущее повтора: остальные в этот чат ждут его
+        self._held: dict = {}  # chat_id -> deque сообщений, отложенных до завершения повтора
+        self._tasks: list = []
+        self._pending = 0  # принятые, но еще не завершенные сообщения
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.dropped = 0
+        self.flood_waits = 0
+        self._wait_total = 0.0
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self) -> None:
+        """Дожидается отправки очереди (не дольше SEND_DRAIN_TIMEOUT) и останавливает воркеров"""
+        deadline = time.monotonic() + SEND_DRAIN_TIMEOUT
+        while self._pending and self._tasks and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._pending:
+            logger.warning(f"Очередь отправки остановлена, не отправлено сообщений: {self._pending}")
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info(f"Очередь отправки: {self.stats()}")
+
+    def submit(self, chat_id: int, call: Callable[[], Awaitable], priority: int = PRIORITY_USER) -> asyncio.Future:
+        """
+        Ставит вызов Bot API в очередь. call - функция без аргументов, создающая
+        корутину запроса (вызывается при каждой попытке). Future получает результат запроса
+        """
+        future = asyncio.get_running_loop().create_future()
+        # Ошибку отправки логирует сама очередь, ожидать Future не обязательно
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+        lane = self._lanes[priority]
+        if len(lane) >= self.queue_size:
+            self.dropped += 1
+            logger.warning(f"Очередь отправки {PRIORITY_NAMES[priority]} заполнена, сообщение в чат {chat_id} отброшено")
+            future.set_exception(SendQueueFull(PRIORITY_NAMES[priority]))
+            return future
+
+        lane.append(_Job(chat_id, call, priority, future))
+        self._pending += 1
+        self._has_jobs.set()
+        return future
+
+    def send_message(self, chat_id: int, text: str, priority: int = PRIORITY_USER, **kwargs) -> asyncio.Future:
+        return self.submit(chat_id, lambda: bot.send_message(chat_id, text, **kwargs), priority)
+
+    def stats(self) -> dict:
+        started = self.sent + self.failed
+        return {
+            **{f"queued_{name}": len(lane) for name, lane in zip(PRIORITY_NAMES, self._lanes)},
+            "pending": self._pending,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "dropped": self.dropped,
+            "flood_waits": self.flood_waits,
+            "avg_wait_ms": round(self._wait_total / started * 1000, 1) if started else 0.0,
+        }
+
+    def _next_job(self) -> Optional[_Job]:
+        for lane in self._lanes:
+            if lane:
+                return lane.popleft()
+        return None
+
+    def _requeue_later(self, job: _Job, delay: float) -> None:
+        """Возвращает сообщение в начало своей очереди через delay секунд"""
+        def requeue():
+            self._lanes[job.priority].appendleft(job)
+            self._has_jobs.set()
+
+        asyncio.get_running_loop().call_later(delay, requeue)
+
+    def _reserve_slot(self, chat_id: int, now: float) -> float:
+        """Время отправки в чат с учетом интервала между сообщениями (порядок сообщений сохраняется)"""
+        interval = self.group_interval if chat_id < 0 else self.chat_interval
+        at = max(now, self._chat_next.get(chat_id, 0.0))
+        self._chat_next[chat_id] = at + interval
+        if len(self._chat_next) > 10 * self.queue_size:
+            self._chat_next = {chat: t for chat, t in self._chat_next.items() if t > now}
+        return at
+
+    def _finish(self, job: _Job) -> None:
+        self._pending -= 1
+        self._wait_total += time.monotonic() - job.enqueued_at
+        self._release(job)
+
+    def _release(self, job: _Job) -> None:
+        """Снимает блокировку чата, если job - повторяемое сообщение, и возвращает отложенные в очереди"""
+        if self._blocked.get(job.chat_id) is not job:
+            return
+        del self._blocked[job.chat_id]
+        held = self._held.pop(job.chat_id, ())
+        for waiting in reversed(held):
+            # Слоты отправки перераспределяются заново - после повторенного сообщения
+            waiting.not_before = None
+            self._lanes[waiting.priority].appendleft(waiting)
+        if held:
+            self._has_jobs.set()
+
+    async def _worker(self) -> None:
+        while True:
+            job = self._next_job()
+            if job is None:
+                self._has_jobs.clear()
+                await self._has_jobs.wait()
+                continue
+
+            if job.future.cancelled():
+                # Отправитель отказался от сообщения (например, остановлена рассылка)
+                self._pending -= 1
+                self._release(job)
+                continue
+
+            blocker = self._blocked.get(job.chat_id)
+            if blocker is not None and blocker is not job:
+                # В чате повторяется более раннее сообщение: это уйдет после него
+                self._held.setdefault(job.chat_id, deque()).append(job)
+                continue
+
+            now = time.monotonic()
+            if job.not_before is None:
+                job.not_before = self._reserve_slot(job.chat_id, now)
+            if job.not_before > now:
+                # Чат еще на паузе: воркер не ждет, а берет следующее сообщение
+                self._requeue_later(job, job.not_before - now)
+                continue
+
+            await self.bucket.acquire()
+            try:
+                result = await job.call()
+            except TelegramRetryAfter as e:
+                self.flood_waits += 1
+                self.bucket.pause(e.retry_after)
+                self._retry(job, e, e.retry_after)
+            except (TelegramNetworkError, TelegramServerError) as e:
+                self._retry(job, e, 2 ** job.attempts)
+            except Exception as e:
+                self.failed += 1
+                self._finish(job)
+                logger.error(f"Не удалось отправить сообщение в чат {job.chat_id}: {e}")
+                self._resolve(job, error=e)
+            else:
+                self.sent += 1
+                self._finish(job)
+                self._resolve(job, result=result)
+
+    @staticmethod
+    def _resolve(job: _Job, result=None, error: Optional[Exception] = None) -> None:
+        # Future мог быть отменен, пока запрос выполнялся
+        if job.future.done():
+            return
+        if error is not None:
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(result)
+
+    def _retry(self, job: _Job, error: Exception, delay: float) -> None:
+        if job.attempts >= self.max_retries:
+            self.failed += 1
+            self._finish(job)
+            logger.error(f"Не удалось отправить сообщение в чат {job.chat_id} после {job.attempts + 1} попыток: {error}")
+            self._resolve(job, error=error)
+            return
+
+        job.attempts += 1
+        self.retried += 1
+        self._blocked[job.chat_id] = job
+        # Следующие сообщения в этот чат пойдут не раньше повтора
+        job.not_before = time.monotonic() + delay
+        self._chat_next[job.chat_id] = max(self._chat_next.get(job.chat_id, 0.0), job.not_before)
+        logger.warning(f"Повтор отправки в чат {job.chat_id} через {delay} с: {error}")
+        self._requeue_later(job, delay)
+
+
+# Общая для процесса очередь отправки
+sender = OutboundSender()
+
+Gauge("sender_queue_depth", "Сообщений в очереди отправки", ["lane"],
+      collect=lambda: {(name,): len(lane) for name, lane in zip(PRIORITY_NAMES, sender._lanes)})
+Counter("sender_messages_total", "Сообщения очереди отправки по результату", ["result"],
+        collect=lambda: {(name,): getattr(sender, name) for name in ("sent", "failed", "retried", "dropped",
+                                                                     "flood_waits")})
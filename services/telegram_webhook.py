@@ -0,0 +1,56 @@
+import asyncio
+import logging
+import secrets
+import signal
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from config import WEBHOOK_BASE_URL, TG_WEBHOOK_PATH, TG_WEBHOOK_SECRET
+from services.web import start_web_server
+
+logger = logging.getLogger(__name__)
+
+
+def setup_telegram_webhook(app: web.Application, dp: Dispatcher, bot: Bot) -> str:
+    """
+    Регистрирует эндпоинт обновлений Telegram и привязывает startup/shutdown
+    диспетчера к жизненному циклу веб-приложения. Возвращает секретный токен,
+    которым Telegram подписывает запросы (заголовок X-Telegram-Bot-Api-Secret-Token)
+    """
+    secret_token = TG_WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret_token).register(app, path=TG_WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    return secret_token
+
+
+async def run_webhook(app: web.Application, dp: Dispatcher, bot: Bot, secret_token: str) -> None:
+    """
+    Запускает веб-сервер, регистрирует вебхук в Telegram и работает до сигнала остановки.
+    При остановке веб-сервер завершается, вызывая shutdown-обработчики диспетчера
+    """
+    if not WEBHOOK_BASE_URL:
+        raise RuntimeError("Для режима webhook необходимо задать WEBHOOK_BASE_URL")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+
+    runner = await start_web_server(app)
+    try:
+        await bot.set_webhook(
+            f"{WEBHOOK_BASE_URL.rstrip('/')}{TG_WEBHOOK_PATH}",
+            secret_token=secret_token,
+            allowed_updates=dp.resolve_used_update_types(),
+            drop_pending_updates=True
+        )
+        logger.info(f"Вебхук Telegram установлен: {WEBHOOK_BASE_URL}{TG_WEBHOOK_PATH}")
+        await stop.wait()
+    finally:
+        logger.info("Остановка веб-сервера...")
+        await runner.cleanup()
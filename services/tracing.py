@@ -0,0 +1,207 @@
+import json
+import logging
+import os
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.types import TelegramObject, Update
+from sqlalchemy import event as sql_event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from config import TRACE_SLOW_UPDATE_MS, TRACE_MAX_SPANS, TRACE_EXPORT_PATH
+
+logger = logging.getLogger(__name__)
+
+# Трассировка апдейтов: на время обработки апдейта в контексте задачи лежит
+# Trace, в который SQL-запросы, запросы к Bot API и платежным системам
+# добавляют интервалы (spans). Вне обработки апдейта (фоновые задачи,
+# очередь отправки) трассы нет и интервалы не записываются
+
+current_trace: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+
+
+class Span:
+    __slots__ = ("kind", "name", "start", "duration", "error")
+
+    def __init__(self, kind: str, name: str, start: float, duration: float, error: Optional[str]) -> None:
+        self.kind = kind  # db, telegram, provider
+        self.name = name
+        self.start = start  # смещение от начала апдейта, секунды
+        self.duration = duration
+        self.error = error
+
+
+class Trace:
+    __slots__ = ("trace_id", "update_id", "event_type", "started", "started_ns", "spans", "dropped")
+
+    def __init__(self, update_id: int, event_type: str) -> None:
+        self.trace_id = os.urandom(16).hex()
+        self.update_id = update_id
+        self.event_type = event_type
+        self.started = time.perf_counter()
+        self.started_ns = time.time_ns()
+        self.spans: List[Span] = []
+        self.dropped = 0  # интервалы сверх TRACE_MAX_SPANS
+
+    def add(self, kind: str, name: str, started: float, duration: float, error: Optional[str] = None) -> None:
+        if len(self.spans) >= TRACE_MAX_SPANS:
+            self.dropped += 1
+            return
+        self.spans.append(Span(kind, name, started - self.started, duration, error))
+
+    def summary(self) -> Dict[str, Any]:
+        """Сводка по видам интервалов: число и суммарное время, мс"""
+        totals: Dict[str, Dict[str, float]] = {}
+        for span in self.spans:
+            total = totals.setdefault(span.kind, {"count": 0, "ms": 0.0})
+            total["count"] += 1
+            total["ms"] += span.duration * 1000
+        return {kind: {"count": total["count"], "ms": round(total["ms"], 1)} for kind, total in totals.items()}
+
+
+def record_span(kind: str, name: str, started: float, duration: float, error: Optional[str] = None) -> None:
+    """Добавляет интервал в трассу текущего апдейта (started - значение time.perf_counter())"""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(kind, name, started, duration, error)
+
+
+# Апдейты
+
+class TracingMiddleware(BaseMiddleware):
+    """
+    Внешняя middleware апдейтов: открывает трассу и пишет в лог апдейты,
+    обработанные дольше TRACE_SLOW_UPDATE_MS, с разбивкой по интервалам
+    """
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: Update, data: Dict[str, Any]) -> Any:
+        trace = Trace(event.update_id, event.event_type)
+        token = current_trace.set(trace)
+        error = None
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            error = repr(e)
+            raise
+        finally:
+            current_trace.reset(token)
+            duration = time.perf_counter() - trace.started
+            if duration * 1000 >= TRACE_SLOW_UPDATE_MS:
+                report_slow_update(trace, duration, error)
+
+
+def report_slow_update(trace: Trace, duration: float, error: Optional[str]) -> None:
+    slowest = sorted(trace.spans, key=lambda span: span.duration, reverse=True)[:5]
+    logger.warning("Медленный апдейт " + json.dumps({
+        "update_id": trace.update_id,
+        "type": trace.event_type,
+        "trace_id": trace.trace_id,
+        "ms": round(duration * 1000, 1),
+        "spans": trace.summary(),
+        "slowest": [{"kind": span.kind, "name": span.name, "ms": round(span.duration * 1000, 1)}
+                    for span in slowest],
+        "dropped_spans": trace.dropped,
+        "error": error,
+    }, ensure_ascii=False))
+    if TRACE_EXPORT_PATH:
+        try:
+            export_trace(trace, duration, error)
+        except OSError as e:
+            logger.error(f"Не удалось записать трассу в {TRACE_EXPORT_PATH}: {e}")
+
+
+# Экспорт в формате OTLP/JSON (одна трасса на строку, как у file exporter
+# OpenTelemetry Collector): файл можно загрузить в Jaeger, Tempo и т.п.
+
+def _attributes(values: Dict[str, Any]) -> list:
+    attributes = []
+    for key, value in values.items():
+        if isinstance(value, int):
+            attributes.append({"key": key, "value": {"intValue": str(value)}})
+        else:
+            attributes.append({"key": key, "value": {"stringValue": str(value)}})
+    return attributes
+
+
+def _otlp_span(trace: Trace, span_id: str, parent_id: str, name: str, start: float, duration: float,
+               attributes: Dict[str, Any], error: Optional[str]) -> dict:
+    start_ns = trace.started_ns + int(start * 1e9)
+    span = {
+        "traceId": trace.trace_id,
+        "spanId": span_id,
+        "parentSpanId": parent_id,
+        "name": name,
+        "kind": 1,  # SPAN_KIND_INTERNAL
+        "startTimeUnixNano": str(start_ns),
+        "endTimeUnixNano": str(start_ns + int(duration * 1e9)),
+        "attributes": _attributes(attributes),
+    }
+    if error:
+        span["status"] = {"code": 2, "message": error}  # STATUS_CODE_ERROR
+    return span
+
+
+def export_trace(trace: Trace, duration: float, error: Optional[str]) -> None:
+    root_id = os.urandom(8).hex()
+    spans = [_otlp_span(trace, root_id, "", f"update {trace.event_type}", 0.0, duration,
+                        {"update.id": trace.update_id, "update.type": trace.event_type}, error)]
+    for span in trace.spans:
+        spans.append(_otlp_span(trace, os.urandom(8).hex(), root_id, span.name, span.start, span.duration,
+                                {"span.kind": span.kind}, span.error))
+
+    line = json.dumps({"resourceSpans": [{
+        "resource": {"attributes": _attributes({"service.name": "shop-bot"})},
+        "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}],
+    }]}, ensure_ascii=False)
+    with open(TRACE_EXPORT_PATH, "a", encoding="utf-8") as file:
+        file.write(line + "\n")
+
+
+# Bot API
+
+class TracingRequestMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: интервал на каждый запрос к Bot API"""
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        if current_trace.get() is None:
+            return await make_request(bot, method)
+        started = time.perf_counter()
+        error = None
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            error = repr(e)
+            raise
+        finally:
+            record_span("telegram", method.__api_method__, started, time.perf_counter() - started, error)
+
+
+# База данных
+
+def trace_engine(engine: AsyncEngine) -> None:
+    """Интервал на каждый SQL-запрос (текст запроса без параметров, первые 200 символов)"""
+    sync_engine = engine.sync_engine
+
+    @sql_event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if current_trace.get() is not None:
+            conn.info["trace_started"] = time.perf_counter()
+
+    @sql_event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop("trace_started", None)
+        if started is not None:
+            record_span("db", " ".join(statement.split())[:200], started, time.perf_counter() - started)
+
+
+def setup_tracing(dispatcher, bot: Bot, *engines: AsyncEngine) -> None:
+    """Подключает трассировку апдейтов, запросов к Bot API и к базе данных"""
+    dispatcher.update.outer_middleware(TracingMiddleware())
+    bot.session.middleware(TracingRequestMiddleware())
+    for engine in engines:
+        trace_engine(engine)
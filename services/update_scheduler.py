@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.dispatcher.middlewares.error import ErrorsMiddleware
+from aiogram.types import TelegramObject, Update
+
+from config import UPDATE_WORKERS, UPDATE_QUEUE_SIZE, UPDATE_DRAIN_TIMEOUT
+from services.metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+UPDATE_WAIT = Histogram("update_scheduler_wait_seconds",
+                        "Ожидание апдейта в планировщике: предыдущих апдейтов чата (chat) и свободного воркера (worker)",
+                        ["stage"])
+
+
+class _Job:
+    __slots__ = ("handler", "event", "data", "enqueued_at")
+
+    def __init__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]], event: Update,
+                 data: Dict[str, Any]) -> None:
+        self.handler = handler
+        self.event = event
+        self.data = data
+        self.enqueued_at = time.monotonic()
+
+
+class _Chat:
+    __slots__ = ("jobs", "ready_at")
+
+    def __init__(self) -> None:
+        self.jobs: deque = deque()
+        self.ready_at = 0.0  # когда чат встал в очередь к воркерам
+
+
+class UpdateScheduler(BaseMiddleware):
+    """
+    Планировщик апдейтов: разные чаты параллельно, один чат - строго по очереди.
+
+    Внешняя middleware диспетчера ставит апдейт в очередь его чата и сразу
+    возвращает управление. Чат с апдейтами встает в общую очередь, откуда его
+    берет один из workers воркеров: обрабатывает первый апдейт и, если в
+    чате есть еще, ставит чат в конец очереди. Пока апдейт чата
+    обрабатывается, следующий апдейт того же чата не начнется - клики по
+    карусели и шаги мастеров FSM не гоняются друг с другом, а медленный
+    запрос к платежной системе задерживает только свой чат.
+
+    Всего в очереди не более queue_size апдейтов: при переполнении прием
+    ждет (в режиме polling не запрашиваются новые апдейты). При остановке
+    бота очередь дорабатывается в close().
+    """
+
+    def __init__(self, workers: int = UPDATE_WORKERS, queue_size: int = UPDATE_QUEUE_SIZE) -> None:
+        self.workers = workers
+        self.queue_size = queue_size
+        self._chats: Dict[Hashable, _Chat] = {}  # чаты с апдейтами: в очереди _ready либо у воркера
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._space = asyncio.Event()
+        self._tasks: list = []
+        self._errors: Optional[ErrorsMiddleware] = None
+        self._closing = False
+        self._pending = 0  # принятые, но еще не обработанные апдейты
+        self.busy = 0
+        self.processed = 0
+        self.failed = 0
+        self.waits = 0
+
+    def setup(self, dispatcher: Dispatcher) -> None:
+        """
+        Подключает планировщик к диспетчеру: после определения чата апдейта
+        (UserContextMiddleware), но до FSM - состояние читается, когда до
+        апдейта дошла очередь его чата
+        """
+        self._errors = ErrorsMiddleware(dispatcher)
+        outer = dispatcher.update.outer_middleware
+        outer.unregister(dispatcher.fsm)
+        outer.register(self)
+        outer.register(dispatcher.fsm)
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        if self._closing:
+            return await handler(event, data)
+
+        self.start()
+        while self._pending >= self.queue_size:
+            self.waits += 1
+            self._space.clear()
+            await self._space.wait()
+
+        key = self._chat_key(event, data)
+        chat = self._chats.get(key)
+        if chat is None:
+            chat = self._chats[key] = _Chat()
+            chat.ready_at = time.monotonic()
+            self._ready.put_nowait(key)
+        chat.jobs.append(_Job(handler, event, data))
+        self._pending += 1
+
+    @staticmethod
+    def _chat_key(event: Update, data: Dict[str, Any]) -> Hashable:
+        # Платежи (pre_checkout_query) без чата упорядочиваются с личным чатом пользователя
+        chat = data.get("event_chat")
+        if chat is not None:
+            return chat.id
+        user = data.get("event_from_user")
+        if user is not None:
+            return user.id
+        return "update", event.update_id
+
+    async def _worker(self) -> None:
+        while True:
+            key = await self._ready.get()
+            chat = self._chats[key]
+            job = chat.jobs.popleft()
+
+            now = time.monotonic()
+            started_waiting = max(job.enqueued_at, chat.ready_at)
+            UPDATE_WAIT.observe(started_waiting - job.enqueued_at, "chat")
+            UPDATE_WAIT.observe(now - started_waiting, "worker")
+
+            self.busy += 1
+            try:
+                await self._errors(job.handler, job.event, job.data)
+            except Exception as e:
+                self.failed += 1
+                logger.exception(f"Ошибка обработки апдейта {job.event.update_id}: {e}")
+            else:
+                self.processed += 1
+            finally:
+                self.busy -= 1
+                self._pending -= 1
+                self._space.set()
+
+            if chat.jobs:
+                chat.ready_at = time.monotonic()
+                self._ready.put_nowait(key)
+            else:
+                del self._chats[key]
+
+    async def close(self) -> None:
+        """Дожидается обработки очереди (не дольше UPDATE_DRAIN_TIMEOUT) и останавливает воркеров"""
+        self._closing = True
+        deadline = time.monotonic() + UPDATE_DRAIN_TIMEOUT
+        while self._pending and self._tasks and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._pending:
+            logger.warning(f"Планировщик апдейтов остановлен, не обработано апдейтов: {self._pending}")
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info(f"Планировщик апдейтов: {self.stats()}")
+
+    def stats(self) -> dict:
+        return {
+            "pending": self._pending,
+            "chats": len(self._chats),
+            "busy": self.busy,
+            "processed": self.processed,
+            "failed": self.failed,
+            "waits": self.waits,
+        }
+
+
+# Общий для процесса планировщик апдейтов
+update_scheduler = UpdateScheduler()
+
+Gauge("update_scheduler_queue_depth", "Апдейтов в очереди планировщика (включая обрабатываемые)",
+      collect=lambda: {(): update_scheduler._pending})
+Gauge("update_scheduler_chats", "Чатов с необработанными апдейтами",
+      collect=lambda: {(): len(update_scheduler._chats)})
+Gauge("update_scheduler_max_chat_backlog", "Наибольшая очередь апдейтов одного чата",
+      collect=lambda: {(): max((len(chat.jobs) for chat in update_scheduler._chats.values()), default=0)})
+Gauge("update_scheduler_busy_workers", "Воркеров, обрабатывающих апдейт",
+      collect=lambda: {(): update_scheduler.busy})
+Counter("update_scheduler_updates_total", "Апдейты планировщика по результату", ["result"],
+        collect=lambda: {("processed",): update_scheduler.processed, ("failed",): update_scheduler.failed})
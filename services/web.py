@@ -0,0 +1,31 @@
+import logging
+from typing import Optional
+
+from aiohttp import web
+
+from config import WEB_HOST, WEB_PORT, WEB_TRUST_PROXY
+
+logger = logging.getLogger(__name__)
+
+
+def create_app() -> web.Application:
+    """Создает общее aiohttp-приложение для всех входящих HTTP-уведомлений"""
+    return web.Application()
+
+
+def client_ip(request: web.Request) -> Optional[str]:
+    """IP-адрес отправителя запроса с учетом обратного прокси"""
+    if WEB_TRUST_PROXY:
+        forwarded = request.headers.get("X-Forwarded-For")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.remote
+
+
+async def start_web_server(app: web.Application) -> web.AppRunner:
+    """Запускает веб-сервер и возвращает runner для последующей остановки"""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEB_HOST, WEB_PORT).start()
+    logger.info(f"Веб-сервер запущен на {WEB_HOST}:{WEB_PORT}")
+    return runner
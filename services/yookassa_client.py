@@ -0,0 +1,136 @@
+import asyncio
+import json
+import logging
+import uuid
+from typing import Any, Dict, Optional
+
+import aiohttp
+
+from services.metrics import provider_call
+from config import SHOP_ID, SECRET_KEY, YOOKASSA_API_URL, YOOKASSA_TIMEOUT, YOOKASSA_RETRIES
+
+logger = logging.getLogger(__name__)
+
+# Статусы ответа, после которых запрос имеет смысл повторить
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class YooKassaError(Exception):
+    """Ошибка ответа YooKassa API"""
+
+    def __init__(self, status: int, body: Any) -> None:
+        super().__init__(f"YooKassa API вернул {status}: {body}")
+        self.status = status
+        self.body = body
+
+
+# Ошибки запроса к YooKassa, оставшиеся после всех повторов
+REQUEST_ERRORS = (YooKassaError, aiohttp.ClientError, asyncio.TimeoutError)
+
+
+class YooKassaPayment:
+    """Платеж YooKassa (только используемые ботом поля)"""
+    __slots__ = ("id", "status", "paid", "amount", "currency", "metadata", "confirmation_url")
+
+    def __init__(self, data: Dict[str, Any]) -> None:
+        self.id: str = data["id"]
+        self.status: str = data["status"]
+        self.paid: bool = data.get("paid", False)
+        self.amount: Optional[str] = data.get("amount", {}).get("value")
+        self.currency: Optional[str] = data.get("amount", {}).get("currency")
+        self.metadata: Dict[str, Any] = data.get("metadata", {})
+        self.confirmation_url: Optional[str] = data.get("confirmation", {}).get("confirmation_url")
+
+
+class YooKassaClient:
+    """
+    Асинхронный клиент YooKassa API на aiohttp.
+
+    Использует одну сессию с пулом keep-alive соединений, таймауты и
+    повторы с экспоненциальной задержкой. Повтор POST-запросов безопасен:
+    YooKassa дедуплицирует их по заголовку Idempotence-Key, который
+    сохраняется между попытками.
+    """
+
+    def __init__(self,
+                 shop_id: Optional[str],
+                 secret_key: Optional[str],
+                 base_url: str = YOOKASSA_API_URL,
+                 timeout: float = YOOKASSA_TIMEOUT,
+                 retries: int = YOOKASSA_RETRIES,
+                 backoff: float = 0.5) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.retries = retries
+        self.backoff = backoff
+        self._auth = aiohttp.BasicAuth(shop_id or "", secret_key or "")
+        self._timeout = aiohttp.ClientTimeout(total=timeout)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                auth=self._auth,
+                timeout=self._timeout,
+                connector=aiohttp.TCPConnector(limit=100, keepalive_timeout=60)
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def _request(self, method: str, path: str,
+                       json: Optional[Dict[str, Any]] = None,
+                       idempotence_key: Optional[str] = None) -> Dict[str, Any]:
+        headers = {"Idempotence-Key": idempotence_key} if idempotence_key else None
+        url = f"{self.base_url}{path}"
+
+        for attempt in range(self.retries + 1):
+            try:
+                async with self._get_session().request(method, url, json=json, headers=headers) as response:
+                    text = await response.text()
+                    status = response.status
+                body = self._decode(text)
+                if status < 400 and body is not None:
+                    return body
+                # Прокси перед API отвечает 502/503 HTML-страницей: статус важнее тела
+                if status not in RETRY_STATUSES or attempt == self.retries:
+                    raise YooKassaError(status, body if body is not None else text[:500])
+                logger.warning(f"YooKassa {method} {path}: {status}, повтор #{attempt + 1}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == self.retries:
+                    raise
+                logger.warning(f"YooKassa {method} {path}: {e!r}, повтор #{attempt + 1}")
+
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    @staticmethod
+    def _decode(text: str) -> Optional[Dict[str, Any]]:
+        """JSON-тело ответа или None, если тело не JSON"""
+        try:
+            return json.loads(text)
+        except ValueError:
+            return None
+
+    async def create_payment(self, params: Dict[str, Any],
+                             idempotence_key: Optional[str] = None) -> YooKassaPayment:
+        async with provider_call("yookassa", "create_payment"):
+            data = await self._request("POST", "/payments", json=params,
+                                       idempotence_key=idempotence_key or str(uuid.uuid4()))
+        return YooKassaPayment(data)
+
+    async def find_payment(self, payment_id: str) -> YooKassaPayment:
+        async with provider_call("yookassa", "find_payment"):
+            data = await self._request("GET", f"/payments/{payment_id}")
+        return YooKassaPayment(data)
+
+    async def cancel_payment(self, payment_id: str,
+                             idempotence_key: Optional[str] = None) -> YooKassaPayment:
+        async with provider_call("yookassa", "cancel_payment"):
+            data = await self._request("POST", f"/payments/{payment_id}/cancel", json={},
+                                       idempotence_key=idempotence_key or str(uuid.uuid4()))
+        return YooKassaPayment(data)
+
+
+# Общий для процесса клиент YooKassa
+yookassa = YooKassaClient(SHOP_ID, SECRET_KEY)
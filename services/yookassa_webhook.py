@@ -0,0 +1,87 @@
+import ipaddress
+import logging
+
+from aiohttp import web
+
+from config import YOOKASSA_WEBHOOK_PATH, YOOKASSA_WEBHOOK_CHECK_IP
+from services.payments import finalize_payment
+from services.providers import PROVIDERS
+from services.web import client_ip
+from services.yookassa_client import yookassa, YooKassaError
+
+logger = logging.getLogger(__name__)
+
+# Адреса, с которых YooKassa отправляет уведомления
+# https://yookassa.ru/developers/using-api/webhooks#ip
+YOOKASSA_NETWORKS = [
+    ipaddress.ip_network(network) for network in (
+        "185.71.76.0/27",
+        "185.71.77.0/27",
+        "77.75.153.0/25",
+        "77.75.156.11/32",
+        "77.75.156.35/32",
+        "77.75.154.128/25",
+        "2a02:5180::/32",
+    )
+]
+
+# Обрабатываемые события
+EVENTS = {"payment.succeeded", "payment.canceled"}
+
+
+def is_yookassa_ip(ip: str) -> bool:
+    try:
+        address = ipaddress.ip_address(ip)
+    except (TypeError, ValueError):
+        return False
+    return any(address in network for network in YOOKASSA_NETWORKS)
+
+
+async def yookassa_webhook(request: web.Request) -> web.Response:
+    """
+    Прием уведомлений YooKassa о смене статуса платежа.
+
+    Уведомления YooKassa не подписываются, поэтому проверяется IP отправителя,
+    а статус платежа перед применением перезапрашивается через API.
+    Ответ 200 означает, что уведомление принято и повторять его не нужно.
+    """
+    ip = client_ip(request)
+    if YOOKASSA_WEBHOOK_CHECK_IP and not is_yookassa_ip(ip):
+        logger.warning(f"Уведомление YooKassa с недоверенного адреса {ip}")
+        return web.Response(status=403)
+
+    try:
+        notification = await request.json()
+        event = notification["event"]
+        payment_id = notification["object"]["id"]
+    except (ValueError, KeyError, TypeError):
+        return web.Response(status=400)
+
+    if event not in EVENTS:
+        return web.Response(status=200)
+
+    try:
+        payment = await yookassa.find_payment(payment_id)
+    except YooKassaError as e:
+        if e.status == 404:
+            logger.warning(f"Уведомление о неизвестном платеже YooKassa {payment_id}")
+            return web.Response(status=200)
+        logger.error(f"Ошибка проверки платежа юкасса {payment_id}: {e}")
+        return web.Response(status=502)
+    except Exception as e:
+        logger.error(f"Ошибка проверки платежа юкасса {payment_id}: {e}")
+        return web.Response(status=502)
+
+    try:
+        if await finalize_payment("yookassa", payment.id, PROVIDERS["yookassa"].map_status(payment.status)):
+            logger.info(f"Платеж юкасса {payment.id} обработан по уведомлению: {payment.status}")
+    except Exception as e:
+        # YooKassa повторит уведомление при ответе, отличном от 200
+        logger.error(f"Ошибка обработки уведомления юкасса {payment_id}: {e}")
+        return web.Response(status=500)
+
+    return web.Response(status=200)
+
+
+def setup_yookassa_webhook(app: web.Application) -> None:
+    app.router.add_post(YOOKASSA_WEBHOOK_PATH, yookassa_webhook)
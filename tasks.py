@@ -1,183 +1,121 @@
 import asyncio
 import logging
-from yookassa import Payment as YooPayment
+import time
+from datetime import datetime
+
+from sqlalchemy import func, select
 
 from bot import bot
-from db.models import Session, PaymentModel, Product, CryptoModel
-from handlers.handlers_crypto import crypto
-from keyboard import create_kb
+from config import POSITIONS_FLUSH_INTERVAL, PAYMENTS_POLL_INTERVAL, BOT_INFO_REFRESH_INTERVAL, FSM_STORAGE
+from db.fsm_storage import fsm_storage
+from db.models import ReadSession, LedgerModel
+from db.positions import positions
+from services.bot_context import bot_context
+from services.broadcast import resume_broadcasts
+from services.metrics import SWEEP_DURATION, PAYMENTS_DUE, PAYMENTS_PENDING
+from services.outbox import outbox
+from services.payments import finalize_payments
+from services.poller import select_due, reschedule
+from services.providers import PROVIDERS
 
 logger = logging.getLogger(__name__)
 
 
-async def check_pending_payments():
+async def run_periodically(check, interval: int):
     """
-    Периодическая проверка pending платежей
+    Периодический запуск проверки платежей с заданным интервалом (в секундах)
     """
     while True:
-        print("Проверка")
         try:
-            await check_yookassa_payments()
-            await check_crypto_payments()
+            await check()
         except Exception as e:
-            logger.error(f"Ошибка в check_pending_payments: {e}")
+            logger.error(f"Ошибка в {check.__name__}: {e}")
 
-        # Ожидаем 5 минут перед следующей проверкой
-        await asyncio.sleep(300)
+        await asyncio.sleep(interval)
 
 
-async def check_yookassa_payments():
+async def check_payments():
     """
-    Периодическая проверка pending платежей
+    Проверка pending-платежей журнала, у которых подошло время проверки.
+    Одна выборка по индексу (status, next_check_at) на все платежные системы,
+    статусы запрашиваются у каждой системы пачкой
     """
+    started = time.perf_counter()
     try:
-        async with Session() as session:
-            # Получаем все pending платежи
-            pending_payments = await session.execute(
-                PaymentModel.__table__.select().where(
-                    PaymentModel.status == "pending"
-                )
-            )
-            pending_payments = pending_payments.fetchall()
-
-            for payment_record in pending_payments:
-                try:
-                    # Проверяем статус в YooKassa
-                    yookassa_payment = YooPayment.find_one(payment_record.id)
-
-                    if yookassa_payment.status == 'succeeded':
-                        # Обновляем статус в базе
-                        await session.execute(
-                            PaymentModel.__table__.update()
-                            .where(PaymentModel.id == payment_record.id)
-                            .values(status='succeeded')
-                        )
-                        await session.commit()
-
-                        # Получаем информацию о товаре
-                        product = await session.get(Product, payment_record.product_id)
-                        user_id = payment_record.user_id
-
-                        # Уведомляем пользователя
-                        try:
-                            await bot.send_message(
-                                user_id,
-                                f'''✅ Платеж прошел успешно!
-
-📦 Товар: {product.name}
-💰 Сумма: {product.price // 100} руб
-
-👨‍💻 Контакты разработчика: @AltiBalti, в ближайшее время он с Вами свяжется для уточнения деталей''',
-                                reply_markup=create_kb(1, view_products='В главное меню')
-                            )
-                        except Exception as e:
-                            logger.error(f"Не удалось отправить сообщение пользователю {user_id}: {e}")
-
-                        # Уведомляем администратора
-                        try:
-                            await bot.send_message(
-                                1012882762,
-                                f"🛒 Новый заказ!\n"
-                                f"👤 Пользователь: {user_id}\n"
-                                f"📦 Товар: {product.name}\n"
-                                f"💰 Сумма: {product.price // 100} руб"
-                            )
-                        except Exception as e:
-                            logger.error(f"Не удалось отправить сообщение администратору: {e}")
-
-                    elif yookassa_payment.status == 'canceled':
-                        # Обновляем статус в базе
-                        await session.execute(
-                            PaymentModel.__table__.update()
-                            .where(PaymentModel.id == payment_record.id)
-                            .values(status='canceled')
-                        )
-                        await session.commit()
-
-                except Exception as e:
-                    logger.error(f"Ошибка при проверке платежа юкасса {payment_record.id}: {e}")
-                    continue
-
-
-    except Exception as e:
-        logger.error(f"Ошибка в check_pending_payments юкасса: {e}")
-
-
-async def check_crypto_payments():
-    """Проверка pending платежей Crypto Pay"""
-    async with Session() as session:
-        # Получаем все pending платежи Crypto Pay
-        pending_crypto_payments = await session.execute(
-            CryptoModel.__table__.select().where(
-                CryptoModel.status == "active"
-            )
+        await sweep_payments()
+    finally:
+        SWEEP_DURATION.observe(time.perf_counter() - started)
+        await update_pending_gauge()
+
+
+async def sweep_payments():
+    now = datetime.now()
+    pending_payments = await select_due(LedgerModel, "pending", now)
+
+    by_provider = {name: [] for name in PROVIDERS}
+    for payment in pending_payments:
+        by_provider.setdefault(payment.provider, []).append(payment)
+    for name, payments in by_provider.items():
+        PAYMENTS_DUE.set(len(payments), name)
+
+    for name, payments in by_provider.items():
+        if not payments:
+            continue
+        # Ошибка одной платежной системы не прерывает проверку остальных
+        try:
+            await sweep_provider(name, payments, now)
+        except Exception as e:
+            logger.exception(f"Ошибка проверки платежей {name}: {e}")
+
+
+async def sweep_provider(name: str, payments: list, now: datetime) -> None:
+    provider = PROVIDERS[name]
+    statuses = await provider.fetch_statuses([payment.external_id for payment in payments])
+    changed = {payment.external_id for payment in await finalize_payments(name, statuses)}
+    # Платежи, уже обработанные кнопкой или вебхуком, reschedule пропускает по условию на статус
+    still_pending = [payment for payment in payments if payment.external_id not in changed]
+    await reschedule(LedgerModel, "pending", still_pending, now, provider.pending_ttl, provider.min_interval)
+    logger.info(f"Платежи {name}: проверено {len(payments)}, изменено {len(changed)}")
+
+
+async def update_pending_gauge():
+    """Число ожидающих оплаты платежей по платежным системам (индекс provider, status)"""
+    async with ReadSession() as session:
+        result = await session.execute(
+            select(LedgerModel.provider, func.count())
+            .where(LedgerModel.status == "pending")
+            .group_by(LedgerModel.provider)
         )
-        pending_crypto_payments = pending_crypto_payments.fetchall()
-
-        for crypto_payment in pending_crypto_payments:
-            try:
-                # Проверяем статус в Crypto Pay
-                invoice = await crypto.get_invoices(invoice_ids=crypto_payment.id)
-                print(invoice.invoice_id)
-                print(invoice.status)
-
-                if invoice.status == 'paid':
-                    # Обновляем статус в базе
-                    await session.execute(
-                        CryptoModel.__table__.update()
-                        .where(CryptoModel.id == crypto_payment.id)
-                        .values(status='paid')
-                    )
-                    await session.commit()
-
-                    # Получаем информацию о товаре
-                    product = await session.get(Product, crypto_payment.product_id)
-                    user_id = crypto_payment.user_id
-
-                    # Уведомляем пользователя
-                    try:
-                        await bot.send_message(
-                            user_id,
-                            f'''✅ Платеж прошел успешно!
-
-📦 Товар: {product.name}
-💰 Сумма: {crypto_payment.amount} usdt
-
-👨‍💻 Контакты разработчика: @AltiBalti, в ближайшее время он с Вами свяжется для уточнения деталей''',
-                            reply_markup=create_kb(1, view_products='В главное меню')
-                        )
-                    except Exception as e:
-                        logger.error(f"Не удалось отправить сообщение пользователю {user_id}: {e}")
-
-                    # Уведомляем администратора
-                    try:
-                        await bot.send_message(
-                            1012882762,
-                            f"🛒 Новый заказ через Crypto Pay!\n"
-                            f"👤 Пользователь: {user_id}\n"
-                            f"📦 Товар: {product.name}\n"
-                            f"💰 Сумма: {crypto_payment.amount} usdt\n"
-                            f"🆔 ID платежа: {crypto_payment.id}"
-                        )
-                    except Exception as e:
-                        logger.error(f"Не удалось отправить сообщение администратору: {e}")
-
-                elif invoice.status in ['expired', 'failed']:
-                    # Обновляем статус в базе
-                    await session.execute(
-                        CryptoModel.__table__.update()
-                        .where(CryptoModel.id == crypto_payment.id)
-                        .values(status='invoice.status')
-                    )
-                    await session.commit()
-
-            except Exception as e:
-                logger.error(f"Ошибка при проверке крипто-платежа {crypto_payment.id}: {e}")
-                continue
+        counts = dict(result.fetchall())
+    for name in PROVIDERS:
+        PAYMENTS_PENDING.set(counts.get(name, 0), name)
+
+
+async def flush_positions():
+    """
+    Периодическое сохранение позиций пользователей в каталоге
+    """
+    while True:
+        await asyncio.sleep(POSITIONS_FLUSH_INTERVAL)
+        positions.purge_expired()
+        await positions.flush()
+        logger.info(f"Позиции пользователей: {positions.stats()}")
 
 
 async def start_background_tasks():
     """
     Запуск фоновых задач
     """
-    asyncio.create_task(check_pending_payments())
\ No newline at end of file
+    # Частота проверки каждого платежа задается его расписанием (next_check_at),
+    # здесь лишь выбираются платежи, у которых подошло время
+    asyncio.create_task(run_periodically(check_payments, PAYMENTS_POLL_INTERVAL))
+    asyncio.create_task(flush_positions())
+    if FSM_STORAGE == "sql":
+        # Брошенные состояния FSM (незавершенный мастер добавления товара)
+        asyncio.create_task(run_periodically(fsm_storage.cleanup, 3600))
+    # Доставка уведомлений из outbox, в том числе записанных до перезапуска
+    asyncio.create_task(outbox.run())
+    # Рассылки, прерванные остановкой бота
+    await resume_broadcasts()
+    if BOT_INFO_REFRESH_INTERVAL > 0:
+        asyncio.create_task(bot_context.refresh_periodically(bot, BOT_INFO_REFRESH_INTERVAL))
\ No newline at end of file
@@ -0,0 +1,44 @@
+"""
+Отправка записанных Update JSON на вебхук бота для локальной проверки.
+
+Бот запускается с переменными окружения:
+    BOT_MODE=webhook
+    WEBHOOK_BASE_URL=https://<публичный адрес или туннель>
+    TG_WEBHOOK_SECRET=<секрет>
+
+Пример:
+    python tools/post_update.py tools/updates/start.json tools/updates/view_products.json --secret <секрет>
+    python tools/post_update.py tools/updates --secret <секрет>
+"""
+import argparse
+import asyncio
+import json
+from pathlib import Path
+
+import aiohttp
+
+
+def load_updates(paths: list) -> list:
+    """Читает Update JSON из файлов и каталогов (файлы каталога - по имени)"""
+    files = []
+    for path in map(Path, paths):
+        files.extend(sorted(path.glob("*.json")) if path.is_dir() else [path])
+    return [(file.name, json.loads(file.read_text(encoding="utf-8"))) for file in files]
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="файлы или каталоги с Update JSON")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/telegram/webhook", help="эндпоинт бота")
+    parser.add_argument("--secret", help="значение TG_WEBHOOK_SECRET")
+    args = parser.parse_args()
+
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret} if args.secret else {}
+    async with aiohttp.ClientSession(headers=headers) as session:
+        for name, update in load_updates(args.paths):
+            async with session.post(args.url, json=update) as response:
+                print(f"{name}: {response.status}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
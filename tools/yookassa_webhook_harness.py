@@ -0,0 +1,76 @@
+"""
+Локальная проверка вебхука YooKassa.
+
+Поднимает поддельный YooKassa API, который отвечает заданным статусом
+платежа, и отправляет на эндпоинт бота пример уведомления.
+
+Бот запускается с переменными окружения:
+    YOOKASSA_WEBHOOK_ENABLED=1
+    YOOKASSA_WEBHOOK_CHECK_IP=0
+    YOOKASSA_API_URL=http://127.0.0.1:8766/v3
+
+Пример:
+    python tools/yookassa_webhook_harness.py <payment_id> --event payment.succeeded
+"""
+import argparse
+import asyncio
+import json
+
+import aiohttp
+from aiohttp import web
+
+
+def sample_notification(payment_id: str, event: str, amount: str) -> dict:
+    """Уведомление в формате YooKassa"""
+    status = event.split(".", 1)[1]
+    return {
+        "type": "notification",
+        "event": event,
+        "object": {
+            "id": payment_id,
+            "status": status,
+            "paid": status == "succeeded",
+            "amount": {"value": amount, "currency": "RUB"},
+            "metadata": {},
+        },
+    }
+
+
+def create_fake_api(payments: dict) -> web.Application:
+    """Поддельный YooKassa API: GET /v3/payments/{id} по словарю payment_id -> объект"""
+    async def find_payment(request: web.Request) -> web.Response:
+        payment = payments.get(request.match_info["payment_id"])
+        if payment is None:
+            return web.json_response({"type": "error", "code": "not_found"}, status=404)
+        return web.json_response(payment)
+
+    app = web.Application()
+    app.router.add_get("/v3/payments/{payment_id}", find_payment)
+    return app
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("payment_id")
+    parser.add_argument("--event", default="payment.succeeded", choices=["payment.succeeded", "payment.canceled"])
+    parser.add_argument("--amount", default="100.00")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/yookassa/webhook", help="эндпоинт бота")
+    parser.add_argument("--api-port", type=int, default=8766, help="порт поддельного YooKassa API")
+    args = parser.parse_args()
+
+    notification = sample_notification(args.payment_id, args.event, args.amount)
+    runner = web.AppRunner(create_fake_api({args.payment_id: notification["object"]}))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.api_port).start()
+
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.post(args.url, json=notification) as response:
+                print(f"{args.event} -> {response.status}")
+                print(json.dumps(notification, ensure_ascii=False, indent=2))
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())